@@ -1,4 +1,5 @@
-from typing import Any, Optional, Union
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Optional, Union
 
 from cryptography.fernet import Fernet
 from redis.asyncio import ConnectionPool, Redis
@@ -50,3 +51,29 @@ class CacheService:
 
     async def clear_all_cache(self) -> None:
         await self.client.flushdb()
+
+
+@asynccontextmanager
+async def get_task_cache_context() -> AsyncGenerator[CacheService, None]:
+    """
+    Asynchronous context manager pointing the cache at a dedicated Redis connection.
+    Used primarily in Celery tasks, where each task runs its own event loop and pooled connections
+    of an earlier loop cannot be reused.
+
+    Yields:
+        CacheService: The cache service, on a connection closed when the task ends
+    """
+    cache = CacheService()
+    shared_client = cache.client
+    cache.client = Redis(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        password=settings.REDIS_PASSWORD,
+        db=0,
+        decode_responses=True,
+    )
+    try:
+        yield cache
+    finally:
+        await cache.client.aclose()
+        cache.client = shared_client
@@ -4,6 +4,7 @@ from libs.db.db import (
     Base,
     get_async_db,
     get_async_db_context,
+    get_task_db_context,
     get_db,
     get_db_context,
     get_sync_db,
@@ -14,6 +15,7 @@ from libs.db.db import (
 from libs.db.mongodb import (
     get_async_mongodb,
     get_async_mongodb_context,
+    get_task_mongodb_context,
     get_sync_mongodb,
     get_sync_mongodb_context,
     get_mongodb,
@@ -27,6 +29,7 @@ __all__ = [
     "get_db_context",
     "get_async_db",
     "get_async_db_context",
+    "get_task_db_context",
     "get_sync_db",
     "get_sync_db_context",
     # MongoDB interface
@@ -34,6 +37,7 @@ __all__ = [
     "get_mongodb_context",
     "get_async_mongodb",
     "get_async_mongodb_context",
+    "get_task_mongodb_context",
     "get_sync_mongodb",
     "get_sync_mongodb_context",
     "get_collection",
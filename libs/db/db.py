@@ -5,6 +5,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 from sqlalchemy.orm.session import Session
+from sqlalchemy.pool import NullPool
 
 from libs import settings
 
@@ -77,6 +78,23 @@ async def get_async_db_context() -> AsyncGenerator[AsyncSession, None]:
             await session.close()
 
 
+@asynccontextmanager
+async def get_task_db_context() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Asynchronous context manager for database sessions on a dedicated engine.
+    Used primarily in Celery tasks, where each task runs its own event loop.
+
+    Yields:
+        AsyncSession: An asynchronous SQLAlchemy session
+    """
+    engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool, future=True)
+    try:
+        async with AsyncSession(engine, autocommit=False, autoflush=False, expire_on_commit=False) as session:
+            yield session
+    finally:
+        await engine.dispose()
+
+
 # Synchronous database session functions
 def get_sync_db() -> Generator[Session, Any, None]:
     """
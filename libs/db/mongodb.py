@@ -47,6 +47,22 @@ async def get_async_mongodb_context() -> AsyncGenerator[AsyncIOMotorDatabase, No
         pass
 
 
+@asynccontextmanager
+async def get_task_mongodb_context() -> AsyncGenerator[AsyncIOMotorDatabase, None]:
+    """
+    Asynchronous context manager for MongoDB database on a dedicated client.
+    Used primarily in Celery tasks, where each task runs its own event loop.
+
+    Yields:
+        AsyncIOMotorDatabase: An asynchronous MongoDB database
+    """
+    client = AsyncIOMotorClient(auth_source)
+    try:
+        yield client[settings.MONGO_DB]
+    finally:
+        client.close()
+
+
 # Sync MongoDB functions
 def get_sync_mongodb() -> Database:
     """
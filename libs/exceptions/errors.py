@@ -49,5 +49,11 @@ class ErrorCode(IntEnum):
     USER_ALREADY_EXISTS = (3015, "User already exists", 409)
     INVALID_PARAMETERS = (3016, "Invalid parameters", 400)
 
+    # Document errors
+    DOCUMENT_NOT_PARSED = (4000, "Document has not been parsed yet", 409)
+    DOCUMENT_PARSE_FAILED = (4001, "Document could not be parsed", 422)
+    DOCUMENT_INVALID = (4002, "Document is not a valid PDF", 422)
+    DOCUMENT_ENCRYPTED = (4003, "Document is password protected", 422)
+
     def __str__(self) -> str:
         return f"Error Code: {self.code}, Message: {self.message}, Status Code: {self.status_code}"
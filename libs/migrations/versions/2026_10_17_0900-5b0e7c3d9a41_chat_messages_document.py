@@ -0,0 +1,49 @@
+"""chat messages document
+
+Revision ID: 5b0e7c3d9a41
+Revises: 8421bd09bb28
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5b0e7c3d9a41"
+down_revision = "8421bd09bb28"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("chat_messages", sa.Column("document_id", sa.String(length=24), nullable=True))
+    op.add_column("chat_messages", sa.Column("conversation_id", sa.UUID(), nullable=True))
+
+    # Built without locking writes to chat_messages, which needs to run outside the migration transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_chat_messages_user_document_timestamp",
+            "chat_messages",
+            ["user_id", "document_id", "timestamp", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_chat_messages_user_timestamp",
+            "chat_messages",
+            ["user_id", "timestamp", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_chat_messages_user_timestamp", table_name="chat_messages", postgresql_concurrently=True)
+        op.drop_index(
+            "ix_chat_messages_user_document_timestamp", table_name="chat_messages", postgresql_concurrently=True
+        )
+    op.drop_column("chat_messages", "conversation_id")
+    op.drop_column("chat_messages", "document_id")
@@ -1,7 +1,7 @@
 from datetime import datetime
 from uuid import uuid4
 
-from sqlalchemy import Column, Integer, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, Boolean, DateTime, ForeignKey, Index, String, Text
 from sqlalchemy.dialects.postgresql import UUID as PostgresUUID
 
 from libs.models.base import Base
@@ -17,6 +17,15 @@ class ChatMessage(Base):
     message = Column(Text, nullable=False)
     is_user = Column(Boolean, default=True, nullable=False)
     timestamp = Column(DateTime, default=datetime.now, nullable=False)
+    # MongoDB ID of the PDF discussed, empty for library chat and messages from before documents were tracked
+    document_id = Column(String(24), nullable=True)
+    conversation_id = Column(PostgresUUID(as_uuid=True), nullable=True)
+
+    __table_args__ = (
+        # Pages of history are read newest first by seeking (timestamp, id) in these indexes
+        Index("ix_chat_messages_user_document_timestamp", "user_id", "document_id", "timestamp", "id"),
+        Index("ix_chat_messages_user_timestamp", "user_id", "timestamp", "id"),
+    )
 
     def __repr__(self) -> str:
         return f"<ChatMessage(id={self.id}, user_id={self.user_id}, is_user={self.is_user})>"
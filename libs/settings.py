@@ -1,3 +1,5 @@
+from typing import Literal, Optional
+
 from pydantic_settings import BaseSettings
 
 
@@ -35,10 +37,74 @@ class Config(BaseSettings):
     RABBITMQ_HOST: str
     RABBITMQ_PORT: int
 
+    # PDF Upload
+    PDF_MAX_UPLOAD_SIZE: int = 200 * 1024 * 1024
+    PDF_UPLOAD_CHUNK_SIZE: int = 255 * 1024
+    PDF_BATCH_UPLOAD_MAX_FILES: int = 50
+    PDF_BATCH_UPLOAD_CONCURRENCY: int = 4
+
+    # PDF Text Extraction
+    PDF_EXTRACT_WORKERS: int = 4
+    PDF_EXTRACT_PAGES_PER_TASK: int = 25
+    PDF_TEXT_MAX_PAGES: int = 100
+    PDF_TEXT_CODEC: str = "zlib"
+    PDF_TEXT_CODEC_LEVEL: Optional[int] = None
+
+    # Chat Retrieval
+    CHAT_PASSAGE_WORDS: int = 200
+    CHAT_PASSAGE_OVERLAP: int = 40
+    CHAT_TOP_K: int = 8
+    CHAT_CONTEXT_TOKENS: int = 6000
+    CHAT_INDEX_CACHE_SIZE: int = 32
+    CHAT_RETRIEVAL_MODE: Literal["bm25", "vector", "hybrid"] = "hybrid"
+
+    # Embeddings
+    EMBEDDING_BACKEND: str = "hashing"
+    EMBEDDING_DIM: int = 512
+    EMBEDDING_DTYPE: str = "float32"
+    EMBEDDING_MODEL: str = "text-embedding-004"
+    EMBEDDING_CACHE_DIR: str = "/tmp/pdf_vectors"
+
     # Gemini AI API
     GEMINI_API_KEY: str
     GEMINI_API_URL: str = "https://generativelanguage.googleapis.com/v1beta"
     GEMINI_MODEL: str = "gemini-2.0-flash"
+    GEMINI_MAX_OUTPUT_TOKENS: int = 2048
+    CHAT_PROMPT_TOKEN_LIMIT: int = 16000
+    GEMINI_CACHE_ENABLED: bool = True
+    GEMINI_CACHE_TTL: int = 3600
+    GEMINI_CACHE_MIN_TOKENS: int = 4096
+    GEMINI_CACHE_MAX_TOKENS: int = 100000
+    GEMINI_CACHE_MAX_ENTRIES: int = 100
+    CHAT_ANSWER_CACHE_ENABLED: bool = True
+    CHAT_ANSWER_CACHE_TTL: int = 86400
+    CHAT_SEMANTIC_CACHE_ENABLED: bool = True
+    CHAT_SEMANTIC_CACHE_THRESHOLD: float = 0.9
+    CHAT_SEMANTIC_CACHE_TTL: int = 3600
+    CHAT_SEMANTIC_CACHE_SIZE: int = 256
+    CHAT_SEMANTIC_CACHE_DOCUMENTS: int = 128
+    CHAT_SINGLEFLIGHT_ENABLED: bool = True
+    CHAT_SINGLEFLIGHT_TIMEOUT: int = 120
+    CHAT_JOB_TTL: int = 3600
+    CHAT_JOB_MAX_WAIT: int = 30
+    CHAT_MEMORY_ENABLED: bool = True
+    CHAT_MEMORY_TURNS: int = 6
+    CHAT_MEMORY_TOKENS: int = 2000
+    CHAT_MEMORY_SUMMARY_TOKENS: int = 400
+    CHAT_HISTORY_WRITE_MODE: str = "redis"
+    CHAT_HISTORY_FLUSH_SIZE: int = 200
+    CHAT_HISTORY_FLUSH_INTERVAL_MS: int = 500
+    GEMINI_POOL_SIZE: int = 100
+    GEMINI_KEEPALIVE_SECONDS: int = 60
+    GEMINI_CONNECT_TIMEOUT: float = 5
+    GEMINI_READ_TIMEOUT: float = 60
+    GEMINI_TOTAL_TIMEOUT: float = 120
+    GEMINI_MAX_RETRIES: int = 3
+    GEMINI_RETRY_BASE_DELAY: float = 0.5
+    GEMINI_RETRY_MAX_DELAY: float = 10
+    GEMINI_BREAKER_FAILURES: int = 5
+    GEMINI_BREAKER_RESET_SECONDS: float = 30
+    GEMINI_DISPATCH_CONCURRENCY: int = 50
 
     # REDIS
     REDIS_PORT: int
@@ -53,6 +119,8 @@ class Config(BaseSettings):
     AUTH_WORKER_NAME: str
     PDF_QUEUE_NAME: str
     PDF_WORKER_NAME: str
+    CHAT_QUEUE_NAME: str = "chat_queue"
+    CHAT_WORKER_CONCURRENCY: int = 4
 
     # Email Settings
     MAIL_HOST: str = "smtp.gmail.com"
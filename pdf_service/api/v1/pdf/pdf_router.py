@@ -1,21 +1,35 @@
-from fastapi import APIRouter, Depends, status, File, UploadFile, Form, Header, Body
+import json
+
+from fastapi import APIRouter, Depends, status, File, UploadFile, Form, Header, Body, Query, Request
 from libs.exceptions.schemas import ExceptionBase
 from libs.exceptions.errors import ErrorCode
+from fastapi.responses import Response, StreamingResponse
 from fastapi_limiter.depends import RateLimiter
-from typing import List, Annotated
+from typing import Any, AsyncIterator, Dict, List, Annotated, Optional, Tuple
+from urllib.parse import quote
 
 from pdf_service.api.v1.pdf.pdf_schemas import (
     PDFUploadMetadata,
     PDFMetadataResponse,
+    PDFBatchUploadItem,
+    PDFBatchUploadResponse,
+    PDFParseStatusResponse,
+    PDFTextResponse,
     ChatRequest,
     ChatResponse,
+    ChatJobResponse,
+    LibraryChatResponse,
     ChatHistoryResponse,
+    AnswerCacheStatsResponse,
+    LLMClientStatsResponse,
 )
 from pdf_service.core.services.pdf_service import PDFService
 from pdf_service.core.services.ai_service import AIService
 from libs.service.auth import AuthService
 from libs.db import get_async_db
 from libs.db.mongodb import get_async_mongodb
+from libs.logger import get_logger
+from libs.settings import settings
 from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(
@@ -23,6 +37,8 @@ router = APIRouter(
     dependencies=[Depends(RateLimiter(times=10, seconds=60))],
 )
 
+logger = get_logger("pdf_service.pdf_router")
+
 
 async def get_pdf_service(db: AsyncSession = Depends(get_async_db)) -> PDFService:
     """Dependency for PDF service with MongoDB connection"""
@@ -35,9 +51,14 @@ def get_auth_service(db: AsyncSession = Depends(get_async_db)) -> AuthService:
     return AuthService(db)
 
 
-def get_ai_service(db: AsyncSession = Depends(get_async_db)) -> AIService:
-    """Dependency for AI service"""
-    return AIService(db)
+def get_ai_service(request: Request, db: AsyncSession = Depends(get_async_db)) -> AIService:
+    """Dependency for AI service sharing the Gemini connection pool, dispatch queue and history writer of the app"""
+    return AIService(
+        db,
+        request.app.state.llm_client,
+        request.app.state.llm_dispatcher,
+        history_writer=request.app.state.chat_history_writer,
+    )
 
 
 @router.post("/pdf-upload", response_model=PDFMetadataResponse, status_code=status.HTTP_201_CREATED)
@@ -72,6 +93,50 @@ async def upload_pdf(
     return await pdf_service.upload_pdf_to_gridfs(file, metadata, user.id)
 
 
+@router.post("/pdf-upload/batch", response_model=PDFBatchUploadResponse, status_code=status.HTTP_207_MULTI_STATUS)
+async def upload_pdfs_batch(
+    files: List[UploadFile] = File(...),
+    titles: List[str] = Form(None),
+    tags: str = Form(None),
+    authorization: Annotated[str | None, Header()] = None,
+    pdf_service: PDFService = Depends(get_pdf_service),
+    auth_service: AuthService = Depends(get_auth_service),
+):
+    """
+    Upload many PDF files in one request, each file succeeds or fails on its own
+    """
+    # One token check for the whole batch
+    user = await auth_service.get_user_from_token(authorization)
+
+    if len(files) > settings.PDF_BATCH_UPLOAD_MAX_FILES:
+        raise ExceptionBase(ErrorCode.PAYLOAD_TOO_LARGE)
+    if titles and len(titles) != len(files):
+        raise ExceptionBase(ErrorCode.BAD_REQUEST)
+
+    # Tags apply to every file of the batch
+    tag_list = tags.split(",") if tags else []
+
+    uploads = []
+    rejected = {}
+    for index, file in enumerate(files):
+        filename = file.filename or f"document-{index + 1}.pdf"
+        if not file.content_type or "pdf" not in file.content_type.lower():
+            rejected[index] = PDFBatchUploadItem(filename=filename, error=ErrorCode.INVALID_FILE_TYPE.message)
+            continue
+        # Titles default to the filename without its extension
+        title = titles[index] if titles else filename.rsplit(".", 1)[0]
+        metadata = PDFUploadMetadata(filename=filename, title=title, tags=tag_list, content_type=file.content_type)
+        uploads.append((file, metadata))
+
+    response = await pdf_service.upload_pdfs_batch(uploads, user.id)
+
+    # Put files rejected here back in their upload position
+    for index in sorted(rejected):
+        response.results.insert(index, rejected[index])
+    response.failed += len(rejected)
+    return response
+
+
 @router.get("/pdf-list", response_model=List[PDFMetadataResponse])
 async def list_pdfs(
     skip: int = 0,
@@ -101,6 +166,117 @@ async def get_pdf_metadata(
     return await pdf_service.get_pdf_metadata(document_id, user.id)
 
 
+@router.get("/pdf/{document_id}/status", response_model=PDFParseStatusResponse)
+async def get_pdf_parse_status(
+    document_id: str,
+    authorization: Annotated[str | None, Header()] = None,
+    pdf_service: PDFService = Depends(get_pdf_service),
+    auth_service: AuthService = Depends(get_auth_service),
+):
+    """
+    Get the text extraction status of a PDF document
+    """
+    user = await auth_service.get_user_from_token(authorization)
+    return await pdf_service.get_parse_status(document_id, user.id)
+
+
+@router.get("/pdf/{document_id}/text", response_model=PDFTextResponse)
+async def get_pdf_text(
+    document_id: str,
+    pages: str = Query(..., pattern=r"^\d+(-\d+)?$", description="Page or inclusive page range, e.g. 10-20"),
+    authorization: Annotated[str | None, Header()] = None,
+    pdf_service: PDFService = Depends(get_pdf_service),
+    auth_service: AuthService = Depends(get_auth_service),
+):
+    """
+    Get the extracted text of a page range of a PDF document
+    """
+    user = await auth_service.get_user_from_token(authorization)
+    first_page, _, last_page = pages.partition("-")
+    return await pdf_service.get_page_text(document_id, user.id, int(first_page), int(last_page or first_page))
+
+
+def _parse_byte_range(range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range `Range: bytes=...` header into an inclusive (start, end) pair
+
+    Returns None when the header should be ignored and the whole file served.
+    Raises ValueError when the range cannot be satisfied.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        # Multiple ranges are not supported, serving the whole file is a valid answer
+        return None
+
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+        else:
+            start = int(first)
+            end = int(last) if last else file_size - 1
+    except ValueError:
+        # Malformed, ignored as the RFC asks
+        return None
+
+    if not first:
+        if length <= 0 or file_size == 0:
+            raise ValueError(range_header)
+        return max(file_size - length, 0), file_size - 1
+    if start >= file_size or end < start:
+        raise ValueError(range_header)
+    return start, min(end, file_size - 1)
+
+
+@router.get("/pdf/{document_id}/file")
+async def download_pdf(
+    document_id: str,
+    range_header: Annotated[str | None, Header(alias="Range")] = None,
+    if_none_match: Annotated[str | None, Header()] = None,
+    authorization: Annotated[str | None, Header()] = None,
+    pdf_service: PDFService = Depends(get_pdf_service),
+    auth_service: AuthService = Depends(get_auth_service),
+):
+    """
+    Stream the original PDF file, supporting byte ranges and conditional requests
+    """
+    user = await auth_service.get_user_from_token(authorization)
+    document, grid_out = await pdf_service.open_pdf_file(document_id, user.id)
+
+    file_size = grid_out.length
+    etag = f'"{document.get("content_hash") or document["grid_fs_id"]}"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "private"}
+
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    start, end = 0, file_size - 1
+    status_code = status.HTTP_200_OK
+    if range_header and file_size > 0:
+        try:
+            byte_range = _parse_byte_range(range_header, file_size)
+        except ValueError:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "Content-Range": f"bytes */{file_size}"},
+            )
+        if byte_range:
+            start, end = byte_range
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+
+    filename = document.get("filename") or f"{document.get('title', document_id)}.pdf"
+    headers["Content-Length"] = str(max(end - start + 1, 0))
+    headers["Content-Disposition"] = f'inline; filename="{quote(filename)}"'
+    return StreamingResponse(
+        pdf_service.iter_file_range(grid_out, start, end),
+        status_code=status_code,
+        media_type=document.get("content_type") or "application/pdf",
+        headers=headers,
+    )
+
+
 @router.delete("/pdf/{document_id}", status_code=status.HTTP_200_OK)
 async def delete_pdf(
     document_id: str,
@@ -115,7 +291,7 @@ async def delete_pdf(
     return await pdf_service.delete_pdf(document_id, user.id)
 
 
-@router.post("/pdf-parse", status_code=status.HTTP_200_OK)
+@router.post("/pdf-parse", response_model=PDFParseStatusResponse, status_code=status.HTTP_202_ACCEPTED)
 async def parse_pdf(
     document_id: str,
     authorization: Annotated[str | None, Header()] = None,
@@ -123,10 +299,10 @@ async def parse_pdf(
     auth_service: AuthService = Depends(get_auth_service),
 ):
     """
-    Extract text content from a PDF document
+    Queue the text extraction of a PDF document on the PDF worker, poll its status for the outcome
     """
     user = await auth_service.get_user_from_token(authorization)
-    return await pdf_service.parse_pdf_text(document_id, user.id)
+    return await pdf_service.request_parse(document_id, user.id)
 
 
 @router.post("/pdf-select", status_code=status.HTTP_200_OK)
@@ -156,32 +332,177 @@ async def chat_with_pdf(
     """
     user = await auth_service.get_user_from_token(authorization)
 
-    # Get the currently selected PDF
+    prepared = await ai_service.prepare_pdf_chat(
+        user.id, chat_request.message, pdf_service, new_conversation=chat_request.new_conversation
+    )
+    if "cached_answer" in prepared:
+        return prepared["cached_answer"]
+
+    # Chat with the PDF
+    return await ai_service.chat_with_pdf(**prepared)
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _single_piece(text: str) -> AsyncIterator[str]:
+    yield text
+
+
+async def _chat_events(first_piece: str, pieces: AsyncIterator[str], pdf_title: str) -> AsyncIterator[str]:
+    """Forward pieces of a response as `token` events, ending with `done` or `error`"""
+    response = [first_piece]
+    yield _sse_event("token", {"text": first_piece})
+    try:
+        async for piece in pieces:
+            response.append(piece)
+            yield _sse_event("token", {"text": piece})
+    except ExceptionBase as error:
+        # The status line is sent already, report the failure in the stream
+        yield _sse_event("error", error.to_dict())
+        return
+    except Exception as error:
+        logger.error("Chat stream failed", error=str(error), exc_info=True)
+        yield _sse_event("error", ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR).to_dict())
+        return
+    yield _sse_event("done", {"response": "".join(response), "pdf_title": pdf_title})
+
+
+@router.post("/pdf-chat/stream")
+async def stream_chat_with_pdf(
+    chat_request: ChatRequest = Body(...),
+    authorization: Annotated[str | None, Header()] = None,
+    pdf_service: PDFService = Depends(get_pdf_service),
+    ai_service: AIService = Depends(get_ai_service),
+    auth_service: AuthService = Depends(get_auth_service),
+):
+    """
+    Send a message to chat with the currently selected PDF, streaming the response as Server-Sent Events
+    """
+    user = await auth_service.get_user_from_token(authorization)
+
+    prepared = await ai_service.prepare_pdf_chat(
+        user.id, chat_request.message, pdf_service, new_conversation=chat_request.new_conversation
+    )
+    if "cached_answer" in prepared:
+        pdf_title = prepared["cached_answer"]["pdf_title"]
+        pieces = _single_piece(prepared["cached_answer"]["response"])
+    else:
+        pdf_title = prepared["pdf_title"]
+        pieces = ai_service.stream_chat_with_pdf(**prepared)
+
+    # Wait for the first piece, so a failure before any output still gets an error status
+    try:
+        first_piece = await anext(pieces)
+    except StopAsyncIteration:
+        raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
+
+    return StreamingResponse(
+        _chat_events(first_piece, pieces, pdf_title),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the events
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/pdf-chat/jobs", response_model=ChatJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_chat_job(
+    chat_request: ChatRequest = Body(...),
+    authorization: Annotated[str | None, Header()] = None,
+    pdf_service: PDFService = Depends(get_pdf_service),
+    ai_service: AIService = Depends(get_ai_service),
+    auth_service: AuthService = Depends(get_auth_service),
+):
+    """
+    Queue a message about the currently selected PDF to be answered in the background
+    """
+    user = await auth_service.get_user_from_token(authorization)
+
+    # The job answers about the PDF selected now, even if another one is selected meanwhile
     selected_pdf = await pdf_service.get_selected_pdf(user.id)
     if not selected_pdf:
         raise ExceptionBase(ErrorCode.BAD_REQUEST)
 
-    # Get the PDF content
-    pdf_content = await pdf_service.get_pdf_text(selected_pdf["document_id"], user.id)
-    if not pdf_content:
-        raise ExceptionBase(ErrorCode.BAD_REQUEST)
+    return await ai_service.create_chat_job(user.id, chat_request.message, selected_pdf, chat_request.new_conversation)
 
-    # Chat with the PDF
-    return await ai_service.chat_with_pdf(
-        user_id=user.id, message=chat_request.message, pdf_content=pdf_content, pdf_title=selected_pdf["title"]
-    )
+
+@router.get("/pdf-chat/jobs/{job_id}", response_model=ChatJobResponse)
+async def get_chat_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, description="Seconds to wait for the job to finish, at most CHAT_JOB_MAX_WAIT"),
+    authorization: Annotated[str | None, Header()] = None,
+    ai_service: AIService = Depends(get_ai_service),
+    auth_service: AuthService = Depends(get_auth_service),
+):
+    """
+    Get the status of a chat job, and its answer once completed
+    """
+    user = await auth_service.get_user_from_token(authorization)
+    # Give the database connection back to the pool instead of holding it while waiting
+    await ai_service.db.close()
+    return await ai_service.get_chat_job(user.id, job_id, wait)
+
+
+@router.post("/pdf-chat/library", response_model=LibraryChatResponse)
+async def chat_with_library(
+    chat_request: ChatRequest = Body(...),
+    authorization: Annotated[str | None, Header()] = None,
+    pdf_service: PDFService = Depends(get_pdf_service),
+    ai_service: AIService = Depends(get_ai_service),
+    auth_service: AuthService = Depends(get_auth_service),
+):
+    """
+    Send a message to chat with all of the user's parsed PDFs at once
+    """
+    user = await auth_service.get_user_from_token(authorization)
+
+    # Get the passages relevant to the message across the whole library
+    sections = await pdf_service.get_library_context(user.id, chat_request.message)
+    if not sections:
+        raise ExceptionBase(ErrorCode.NOT_FOUND)
+
+    return await ai_service.chat_with_library(user_id=user.id, message=chat_request.message, sections=sections)
+
+
+@router.get("/pdf-chat/cache-stats", response_model=AnswerCacheStatsResponse)
+async def get_answer_cache_stats(
+    authorization: Annotated[str | None, Header()] = None,
+    ai_service: AIService = Depends(get_ai_service),
+    auth_service: AuthService = Depends(get_auth_service),
+):
+    """
+    Get the hit and miss counters of the chat answer cache
+    """
+    await auth_service.get_user_from_token(authorization)
+    return await ai_service.get_answer_cache_stats()
+
+
+@router.get("/pdf-chat/llm-stats", response_model=LLMClientStatsResponse)
+async def get_llm_client_stats(
+    authorization: Annotated[str | None, Header()] = None,
+    ai_service: AIService = Depends(get_ai_service),
+    auth_service: AuthService = Depends(get_auth_service),
+):
+    """
+    Get the request, retry, connection and batch counters of the Gemini client of this API process
+    """
+    await auth_service.get_user_from_token(authorization)
+    return {**ai_service.llm.metrics(), "dispatch": ai_service.dispatcher.metrics()}
 
 
 @router.get("/chat-history", response_model=ChatHistoryResponse)
 async def get_chat_history(
-    limit: int = 50,
+    limit: int = Query(50, ge=1, le=200),
+    document_id: Optional[str] = Query(None, description="Only the messages about this PDF document"),
+    before: Optional[str] = Query(None, description="The next_before cursor of the previous page"),
     authorization: Annotated[str | None, Header()] = None,
     ai_service: AIService = Depends(get_ai_service),
     auth_service: AuthService = Depends(get_auth_service),
 ):
     """
-    Get the user's chat history
+    Get the user's chat history, newest first, one page at a time
     """
     user = await auth_service.get_user_from_token(authorization)
-    history = await ai_service.get_chat_history(user.id, limit)
-    return {"history": history}
+    return await ai_service.get_chat_history(user.id, limit, document_id, before)
@@ -1,6 +1,23 @@
 from datetime import datetime
+from enum import Enum
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
+
+
+class ParseStatus(str, Enum):
+    """Lifecycle of the background text extraction for a PDF document"""
+
+    PENDING = "pending"
+    PARSING = "parsing"
+    DONE = "done"
+    FAILED = "failed"
+
+    @classmethod
+    def from_flag(cls, value: Any) -> "ParseStatus":
+        """Map the stored `parsed` flag, including legacy booleans, to a status"""
+        if isinstance(value, bool) or value is None:
+            return cls.DONE if value else cls.PENDING
+        return cls(value)
 
 
 class PDFUploadMetadata(BaseModel):
@@ -36,15 +53,70 @@ class PDFMetadataResponse(BaseModel):
     file_size: int = Field(..., description="Size of the file in bytes")
     upload_date: datetime = Field(..., description="Upload timestamp")
     content_type: str = Field(..., description="Content type of the file")
+    parsed: ParseStatus = Field(ParseStatus.PENDING, description="Text extraction status of the document")
+    page_count: Optional[int] = Field(None, description="Number of pages of the document")
+    pdf_version: Optional[str] = Field(None, description="PDF version declared in the file header")
+    encrypted: Optional[bool] = Field(None, description="Whether the file is encrypted")
+    has_text_layer: Optional[bool] = Field(None, description="Whether the first pages carry extractable text")
+
+    @field_validator("parsed", mode="before")
+    @classmethod
+    def normalize_parsed(cls, value: Any) -> ParseStatus:
+        return ParseStatus.from_flag(value)
+
+
+class PDFBatchUploadItem(BaseModel):
+    """Result of a single file of a batch upload"""
+
+    filename: str = Field(..., description="Original filename of the PDF")
+    document: Optional[PDFMetadataResponse] = Field(None, description="Metadata of the stored document")
+    error: Optional[str] = Field(None, description="Reason the file was rejected")
+
+
+class PDFBatchUploadResponse(BaseModel):
+    """Response model for a batch upload"""
+
+    uploaded: int = Field(..., description="Number of files stored")
+    failed: int = Field(..., description="Number of files rejected")
+    results: List[PDFBatchUploadItem] = Field(default_factory=list, description="Per-file results in upload order")
+
+
+class PDFParseStatusResponse(BaseModel):
+    """Response model for the text extraction status of a PDF"""
+
+    document_id: str = Field(..., description="MongoDB document ID")
+    status: ParseStatus = Field(..., description="Text extraction status of the document")
+    page_count: Optional[int] = Field(None, description="Number of pages, once parsed")
+    error: Optional[str] = Field(None, description="Reason of the last parse failure")
+    parsed_date: Optional[datetime] = Field(None, description="Timestamp of the last successful parse")
+
+
+class PDFPageText(BaseModel):
+    """Extracted text of a single PDF page"""
+
+    page: int = Field(..., description="Page number, 1-based")
+    content: str = Field("", description="Extracted text of the page")
+    char_offset: int = Field(0, description="Offset of the page in the whole document text")
+
+
+class PDFTextResponse(BaseModel):
+    """Response model for a page range of extracted PDF text"""
+
+    document_id: str = Field(..., description="MongoDB document ID")
+    page_count: Optional[int] = Field(None, description="Number of pages of the document")
+    pages: List[PDFPageText] = Field(default_factory=list, description="Text of the requested pages")
 
 
 class ChatRequest(BaseModel):
     """Request model for chat with PDF"""
 
     message: str = Field(..., description="User message to send to the AI")
+    new_conversation: bool = Field(
+        False, description="Start a new conversation about the document, forgetting the earlier turns"
+    )
 
     class Config:
-        json_schema_extra = {"example": {"message": "What is this document about?"}}
+        json_schema_extra = {"example": {"message": "What is this document about?", "new_conversation": False}}
 
 
 class ChatResponse(BaseModel):
@@ -55,6 +127,35 @@ class ChatResponse(BaseModel):
     pdf_title: str = Field(..., description="Title of the PDF document being discussed")
 
 
+class ChatJobResponse(BaseModel):
+    """Response model for a chat message answered in the background"""
+
+    job_id: str = Field(..., description="ID of the chat job")
+    status: str = Field(..., description="queued, running, completed or failed")
+    message: str = Field(..., description="User's original message")
+    result: Optional[ChatResponse] = Field(None, description="The answer, once completed")
+    error: Optional[Dict[str, Any]] = Field(None, description="Why the job failed")
+    created: str = Field(..., description="When the job was queued")
+    updated: str = Field(..., description="When the status last changed")
+
+
+class ChatSource(BaseModel):
+    """Document passage an answer was grounded on"""
+
+    document_id: str = Field(..., description="MongoDB document ID")
+    title: Optional[str] = Field(None, description="Title of the PDF document")
+    page_start: int = Field(..., description="First page of the passage")
+    page_end: int = Field(..., description="Last page of the passage")
+
+
+class LibraryChatResponse(BaseModel):
+    """Response model for chat across all of a user's PDFs"""
+
+    message: str = Field(..., description="User's original message")
+    response: str = Field(..., description="AI response to the user's message")
+    sources: List[ChatSource] = Field(default_factory=list, description="Passages the response was grounded on")
+
+
 class ChatMessageResponse(BaseModel):
     """Model for a single chat message in history"""
 
@@ -64,7 +165,44 @@ class ChatMessageResponse(BaseModel):
     timestamp: str = Field(..., description="Message timestamp in ISO format")
 
 
+class AnswerCacheStatsResponse(BaseModel):
+    """Response model for the counters of the chat answer cache"""
+
+    hits: int = Field(..., description="Messages answered from the cache")
+    misses: int = Field(..., description="Messages not found in the exact cache")
+    semantic_hits: int = Field(0, description="Misses answered from a similar earlier question")
+    hit_rate: float = Field(..., description="Share of messages answered from either cache")
+
+
+class LLMDispatchStatsResponse(BaseModel):
+    """Response model for the counters of the Gemini dispatch queue of an API process"""
+
+    dispatched: int = Field(..., description="Calls sent to Gemini through the queue")
+    sending: int = Field(..., description="Calls being sent now")
+    queued: int = Field(..., description="Calls waiting for a free slot now")
+    max_queued: int = Field(..., description="Most calls waiting for a free slot at once")
+    concurrency: int = Field(..., description="Maximum calls sent at once")
+
+
+class LLMClientStatsResponse(BaseModel):
+    """Response model for the counters of the Gemini client of an API process"""
+
+    requests: int = Field(..., description="Requests sent to Gemini")
+    retries: int = Field(..., description="Attempts repeated after a connection error or retryable status")
+    failures: int = Field(..., description="Attempts that failed, counted by the circuit breaker")
+    rejected: int = Field(..., description="Requests refused while the circuit was open")
+    connections_created: int = Field(..., description="Connections opened")
+    connections_reused: int = Field(..., description="Requests sent on a pooled connection")
+    in_flight: int = Field(..., description="Requests waiting for Gemini now")
+    max_in_flight: int = Field(..., description="Most requests waiting for Gemini at once")
+    pool_size: int = Field(..., description="Maximum connections of the pool")
+    circuit_state: str = Field(..., description="closed, open or half_open")
+    circuit_opened: int = Field(..., description="Times the circuit opened")
+    dispatch: Optional[LLMDispatchStatsResponse] = Field(None, description="Counters of the dispatch queue")
+
+
 class ChatHistoryResponse(BaseModel):
     """Response model for chat history"""
 
     history: List[Dict[str, Any]] = Field(..., description="List of chat messages")
+    next_before: Optional[str] = Field(None, description="Cursor of the next page, empty on the last page")
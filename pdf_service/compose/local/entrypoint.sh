@@ -6,6 +6,14 @@ set -o nounset
 
 export CELERY_PDF_QUEUE_NAME=${PDF_QUEUE_NAME}
 export CELERY_PDF_WORKER_NAME=${PDF_WORKER_NAME}
+export CELERY_CHAT_QUEUE_NAME=${CHAT_QUEUE_NAME:-chat_queue}
+export CELERY_CHAT_WORKER_CONCURRENCY=${CHAT_WORKER_CONCURRENCY:-4}
 
 # Use INFO log level for local development to see more detFITls
-celery -A pdf_service.core.worker.tasks.celery_app worker --loglevel=INFO -E --queues=${CELERY_PDF_QUEUE_NAME} -n ${CELERY_PDF_WORKER_NAME}@%n
+celery -A pdf_service.core.worker.tasks.celery_app worker --loglevel=INFO -E --queues=${CELERY_CHAT_QUEUE_NAME} --concurrency=${CELERY_CHAT_WORKER_CONCURRENCY} -n ${CELERY_PDF_WORKER_NAME}_chat@%n &
+# Parse jobs run one at a time in a non-daemonic process, which spreads the pages of a document over
+# PDF_EXTRACT_WORKERS processes; prefork children are daemonic and may not start them
+celery -A pdf_service.core.worker.tasks.celery_app worker --loglevel=INFO -E --pool=solo --queues=${CELERY_PDF_QUEUE_NAME} -n ${CELERY_PDF_WORKER_NAME}@%n &
+
+# Stop the container as soon as either worker exits
+wait -n
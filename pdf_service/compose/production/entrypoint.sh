@@ -6,5 +6,13 @@ set -o nounset
 
 export CELERY_PDF_QUEUE_NAME=${PDF_QUEUE_NAME}
 export CELERY_PDF_WORKER_NAME=${PDF_WORKER_NAME}
+export CELERY_CHAT_QUEUE_NAME=${CHAT_QUEUE_NAME:-chat_queue}
+export CELERY_CHAT_WORKER_CONCURRENCY=${CHAT_WORKER_CONCURRENCY:-4}
 
-celery -A pdf_service.core.worker.tasks.celery_app worker --loglevel=ERROR -E --queues=${CELERY_PDF_QUEUE_NAME} -n ${CELERY_PDF_WORKER_NAME}@%n
+celery -A pdf_service.core.worker.tasks.celery_app worker --loglevel=ERROR -E --queues=${CELERY_CHAT_QUEUE_NAME} --concurrency=${CELERY_CHAT_WORKER_CONCURRENCY} -n ${CELERY_PDF_WORKER_NAME}_chat@%n &
+# Parse jobs run one at a time in a non-daemonic process, which spreads the pages of a document over
+# PDF_EXTRACT_WORKERS processes; prefork children are daemonic and may not start them
+celery -A pdf_service.core.worker.tasks.celery_app worker --loglevel=ERROR -E --pool=solo --queues=${CELERY_PDF_QUEUE_NAME} -n ${CELERY_PDF_WORKER_NAME}@%n &
+
+# Stop the container as soon as either worker exits
+wait -n
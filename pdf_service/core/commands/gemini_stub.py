@@ -0,0 +1,168 @@
+"""
+Local stand-in for the Gemini API, to run the chat endpoints offline.
+
+Implements generateContent, streamGenerateContent and the cachedContents endpoints in memory. Answers quote
+the size of the prompt instead of generating text, and usageMetadata reports how many tokens were served from
+a cache. Streamed answers are sent a few words at a time, STREAM_DELAY seconds apart.
+
+Usage:
+    python -m pdf_service.core.commands.gemini_stub [--host 127.0.0.1] [--port 8090]
+
+Then point the services at it with GEMINI_API_URL=http://127.0.0.1:8090/v1beta
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+import uvicorn
+from fastapi import Body, FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+
+from pdf_service.core.services.prompt_packer import estimate_tokens
+
+TTL_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)s$")
+
+# Words per streamed chunk and seconds between chunks, roughly the pace of a real model
+STREAM_WORDS = 3
+STREAM_DELAY = 0.05
+
+
+def _text_of(contents: Any) -> str:
+    """Concatenated text parts of a content or a list of contents"""
+    contents = contents if isinstance(contents, list) else [contents]
+    return "\n".join(part.get("text", "") for content in contents if content for part in content.get("parts", []))
+
+
+def _timestamp(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def create_app() -> FastAPI:
+    """Build the stub application, every instance starts with no cached contents"""
+    app = FastAPI(title="Gemini API stub")
+    caches: Dict[str, Dict[str, Any]] = {}
+
+    def parse_ttl(ttl: str) -> float:
+        match = TTL_PATTERN.match(ttl or "")
+        if not match:
+            raise HTTPException(status_code=400, detail="ttl must be a duration like '3600s'")
+        return float(match.group(1))
+
+    def live_cache(name: str) -> Dict[str, Any]:
+        cache = caches.get(name)
+        if cache is None or cache["expires"] <= time.time():
+            caches.pop(name, None)
+            raise HTTPException(status_code=404, detail=f"CachedContent not found: {name}")
+        return cache
+
+    def describe(cache: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "name": cache["name"],
+            "model": cache["model"],
+            "displayName": cache["displayName"],
+            "createTime": _timestamp(cache["created"]),
+            "updateTime": _timestamp(cache["updated"]),
+            "expireTime": _timestamp(cache["expires"]),
+            "usageMetadata": {"totalTokenCount": cache["tokens"]},
+        }
+
+    @app.post("/v1beta/cachedContents")
+    async def create_cached_content(payload: Dict[str, Any] = Body(...)):
+        now = time.time()
+        name = f"cachedContents/{uuid.uuid4().hex[:16]}"
+        text = _text_of(payload.get("systemInstruction")) + _text_of(payload.get("contents", []))
+        caches[name] = {
+            "name": name,
+            "model": payload.get("model", ""),
+            "displayName": payload.get("displayName", ""),
+            "created": now,
+            "updated": now,
+            "expires": now + parse_ttl(payload.get("ttl", "3600s")),
+            "tokens": estimate_tokens(text),
+        }
+        return describe(caches[name])
+
+    @app.get("/v1beta/cachedContents")
+    async def list_cached_contents():
+        return {"cachedContents": [describe(cache) for cache in caches.values() if cache["expires"] > time.time()]}
+
+    @app.get("/v1beta/cachedContents/{cache_id}")
+    async def get_cached_content(cache_id: str):
+        return describe(live_cache(f"cachedContents/{cache_id}"))
+
+    @app.patch("/v1beta/cachedContents/{cache_id}")
+    async def update_cached_content(cache_id: str, payload: Dict[str, Any] = Body(...)):
+        cache = live_cache(f"cachedContents/{cache_id}")
+        cache["updated"] = time.time()
+        cache["expires"] = cache["updated"] + parse_ttl(payload.get("ttl"))
+        return describe(cache)
+
+    @app.delete("/v1beta/cachedContents/{cache_id}")
+    async def delete_cached_content(cache_id: str):
+        live_cache(f"cachedContents/{cache_id}")
+        caches.pop(f"cachedContents/{cache_id}")
+        return {}
+
+    def answer(model: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        cached_tokens = 0
+        if payload.get("cachedContent"):
+            cache = live_cache(payload["cachedContent"])
+            if cache["model"] != f"models/{model}":
+                raise HTTPException(status_code=400, detail="Model of the request and of the cached content differ")
+            cached_tokens = cache["tokens"]
+
+        prompt_tokens = estimate_tokens(_text_of(payload.get("contents", [])))
+        text = f"Stub answer from {model} to a prompt of {prompt_tokens} new and {cached_tokens} cached tokens."
+        return {
+            "text": text,
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens + cached_tokens,
+                "cachedContentTokenCount": cached_tokens,
+                "candidatesTokenCount": estimate_tokens(text),
+            },
+        }
+
+    def candidate(text: str, finished: bool) -> Dict[str, Any]:
+        content = {"content": {"parts": [{"text": text}], "role": "model"}}
+        return {**content, "finishReason": "STOP"} if finished else content
+
+    @app.post("/v1beta/models/{model}:generateContent")
+    async def generate_content(model: str, payload: Dict[str, Any] = Body(...)):
+        result = answer(model, payload)
+        return {"candidates": [candidate(result["text"], True)], "usageMetadata": result["usageMetadata"]}
+
+    @app.post("/v1beta/models/{model}:streamGenerateContent")
+    async def stream_generate_content(model: str, payload: Dict[str, Any] = Body(...), alt: str = "json"):
+        if alt != "sse":
+            raise HTTPException(status_code=400, detail="Only alt=sse is implemented")
+        result = answer(model, payload)
+        words = result["text"].split(" ")
+        chunks = [" ".join(words[i : i + STREAM_WORDS]) + " " for i in range(0, len(words), STREAM_WORDS)]
+
+        async def events():
+            for i, chunk in enumerate(chunks):
+                await asyncio.sleep(STREAM_DELAY)
+                finished = i == len(chunks) - 1
+                data = {"candidates": [candidate(chunk.rstrip() if finished else chunk, finished)]}
+                if finished:
+                    data["usageMetadata"] = result["usageMetadata"]
+                yield f"data: {json.dumps(data)}\r\n\r\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Gemini API")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8090, help="Port to listen on")
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(), host=args.host, port=args.port)
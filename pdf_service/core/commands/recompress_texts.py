@@ -0,0 +1,79 @@
+"""
+Recompress stored PDF text with the configured codec.
+
+Usage:
+    python -m pdf_service.core.commands.recompress_texts [--batch-size 500] [--codec zstd]
+"""
+
+import argparse
+import time
+
+from pymongo import UpdateOne
+
+from libs.db.mongodb import get_sync_mongodb_context
+from libs.logger import configure_logging, get_logger
+from libs.settings import settings
+from pdf_service.core.services.text_codec import decode_content, get_codec
+
+logger = get_logger("pdf_service.commands.recompress_texts")
+
+
+def recompress_texts(codec_name: str, batch_size: int) -> None:
+    """Re-encode every pdf_texts page not yet stored with the target codec, in batches
+
+    Args:
+        codec_name: Name of the target codec
+        batch_size: Number of pages updated per bulk write
+    """
+    codec = get_codec(codec_name)
+    pages = 0
+    raw_bytes = 0
+    stored_bytes = 0
+    decode_seconds = 0.0
+
+    with get_sync_mongodb_context() as mongodb:
+        pdf_texts = mongodb["pdf_texts"]
+        cursor = pdf_texts.find({"codec": {"$ne": codec.name}}, {"content": 1, "codec": 1}, batch_size=batch_size)
+
+        batch = []
+        for document in cursor:
+            text = decode_content(document)
+            encoded = codec.encode(text)
+            batch.append(UpdateOne({"_id": document["_id"]}, {"$set": {"content": encoded, "codec": codec.name}}))
+
+            # Measure what readers will pay to decode the new format
+            started = time.perf_counter()
+            codec.decode(encoded)
+            decode_seconds += time.perf_counter() - started
+
+            pages += 1
+            raw_bytes += len(text.encode("utf-8"))
+            stored_bytes += len(encoded)
+
+            if len(batch) >= batch_size:
+                pdf_texts.bulk_write(batch, ordered=False)
+                batch = []
+                logger.info("Recompressed pdf_texts batch", pages=pages)
+
+        if batch:
+            pdf_texts.bulk_write(batch, ordered=False)
+
+    logger.info(
+        "Recompressed pdf_texts",
+        codec=codec.name,
+        pages=pages,
+        raw_bytes=raw_bytes,
+        stored_bytes=stored_bytes,
+        compression_ratio=round(raw_bytes / stored_bytes, 2) if stored_bytes else None,
+        decode_us_per_page=round(decode_seconds / pages * 1e6, 1) if pages else None,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompress stored PDF text with the configured codec")
+    parser.add_argument("--codec", default=settings.PDF_TEXT_CODEC, help="Target codec (none, zlib or zstd)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Number of pages updated per bulk write")
+    args = parser.parse_args()
+
+    configure_logging("pdf_service", log_level="INFO")
+    recompress_texts(args.codec, args.batch_size)
@@ -1,97 +1,492 @@
+import hashlib
+import json
+import uuid
 from datetime import datetime
-from typing import Dict, Any, List
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Dict, Any, List, Optional, Tuple
 
 import aiohttp
-from sqlalchemy import select, desc
+from sqlalchemy import select, desc, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from libs.exceptions.schemas import ExceptionBase
 from libs.exceptions.errors import ErrorCode
 from libs.logger import get_logger
 from libs.settings import settings
+from libs.db import get_async_db_context
 from libs.models.chat import ChatMessage
+from pdf_service.core.services.answer_cache import AnswerCache, SemanticAnswerCache
+from pdf_service.core.services.chat_history_writer import SYNC, ChatHistoryWriter
+from pdf_service.core.services.chat_jobs import FAILED, ChatJobStore
+from pdf_service.core.services.context_cache import GeminiContextCache
+from pdf_service.core.services.conversation_memory import ConversationMemory
+from pdf_service.core.services.llm_client import RETRY_STATUSES, LLMClient
+from pdf_service.core.services.llm_dispatcher import LLMDispatcher
+from pdf_service.core.services.prompt_packer import PromptPacker
+from pdf_service.core.services.singleflight import SingleFlight
+from pdf_service.core.worker.tasks import chat_pdf_task
+
+if TYPE_CHECKING:
+    from pdf_service.core.services.pdf_service import PDFService
+
+# Instructions cached with the full text of a document, shared by every owner of the same bytes
+DOCUMENT_CACHE_INSTRUCTIONS = """You are an AI assistant helping with questions about the PDF document below.
+Each page of the document is labelled with its page number.
+Use the document to answer the user's questions accurately and cite the pages your answer relies on.
+If the answer cannot be found in the document, politely say so and suggest what might help."""
 
 
 class AIService:
     """Service for interacting with Gemini API and managing chat history"""
 
-    def __init__(self, db: AsyncSession):
+    def __init__(
+        self,
+        db: AsyncSession,
+        llm_client: Optional[LLMClient] = None,
+        dispatcher: Optional[LLMDispatcher] = None,
+        mongodb=None,
+        history_writer: Optional[ChatHistoryWriter] = None,
+    ):
         """Initialize the AI service
 
         Args:
             db: SQL database session
+            llm_client: Gemini client whose connection pool is shared by the process; by default a new one,
+                closed by the caller with `await ai_service.llm.close()`
+            dispatcher: Queue bounding the Gemini calls sent at once by the process, calls are sent directly without it
+            mongodb: MongoDB database connection of the conversation memory, the shared one by default
+            history_writer: Writer of the chat history of the process, messages are committed directly without it
         """
         self.db = db
-        self.api_key = settings.GEMINI_API_KEY
-        self.base_url = settings.GEMINI_API_URL
         self.model = settings.GEMINI_MODEL
+        self.llm = llm_client or LLMClient()
+        self.dispatcher = dispatcher or LLMDispatcher()
+        self.history_writer = history_writer or ChatHistoryWriter(SYNC)
+        self.packer = PromptPacker(self.model)
+        self.context_cache = GeminiContextCache(self.llm)
+        self.answer_cache = AnswerCache()
+        self.semantic_cache = SemanticAnswerCache()
+        self.singleflight = SingleFlight()
+        self.chat_jobs = ChatJobStore()
+        self.memory = ConversationMemory(mongodb, self.llm, self.model)
         self.logger = get_logger("ai_service")
 
-    async def chat_with_pdf(self, user_id: int, message: str, pdf_content: str, pdf_title: str) -> Dict[str, Any]:
+    async def get_cached_answer(
+        self,
+        user_id: int,
+        message: str,
+        document: Dict[str, Any],
+        pdf_title: str,
+        document_id: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Answer a message from the answers already given about the same document, saving it to the chat history
+
+        The exact answer cache is tried first, then the recent questions close enough to the message.
+
+        Args:
+            user_id: ID of the user sending the message
+            message: User's message
+            document: The pdf_metadata document, with its content hash and parse date
+            pdf_title: Title of the PDF document
+            document_id: ID of the PDF document, saved with the exchange
+            conversation_id: ID of the conversation about the document, saved with the exchange
+
+        Returns:
+            Dictionary with the cached AI response and message details, or None on a miss
+        """
+        content_hash = document.get("content_hash")
+        if not content_hash:
+            return None
+        parsed_date = document.get("parsed_date")
+
+        ai_response = None
+        if self.answer_cache.enabled:
+            try:
+                ai_response = await self.answer_cache.get(content_hash, parsed_date, self.model, message)
+            except Exception as e:
+                self.logger.error("Answer cache unavailable", error=str(e))
+        if not ai_response and self.semantic_cache.enabled:
+            match = await self.semantic_cache.lookup(content_hash, parsed_date, self.model, message)
+            if match:
+                ai_response = match["answer"]
+                try:
+                    await self.answer_cache.count_semantic_hit()
+                except Exception as e:
+                    self.logger.error("Answer cache unavailable", error=str(e))
+        if not ai_response:
+            return None
+
+        self.logger.info("Answer served from cache", user_id=user_id, content_hash=content_hash)
+        await self._save_exchange(
+            user_id, message, ai_response, document_id=document_id, conversation_id=conversation_id
+        )
+        return {"message": message, "response": ai_response, "pdf_title": pdf_title}
+
+    async def get_document_cache(
+        self, content_hash: Optional[str], load_text: Callable[[], Awaitable[str]]
+    ) -> Optional[str]:
+        """Get the Gemini cached content holding the full text of a document, creating it on first use
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes, documents from before deduplication are never cached
+            load_text: Loads the page-labelled text of the document, only called when the cache is created
+
+        Returns:
+            Name of the cached content, or None when the document has to be sent as passages
+        """
+        if not content_hash or not self.context_cache.enabled:
+            return None
+        try:
+            return await self.context_cache.get_or_create(
+                content_hash, self.model, DOCUMENT_CACHE_INSTRUCTIONS, load_text
+            )
+        except Exception as e:
+            # Chat works without the cache, only slower
+            self.logger.error("Gemini context cache unavailable", content_hash=content_hash, error=str(e))
+            return None
+
+    async def prepare_pdf_chat(
+        self,
+        user_id: int,
+        message: str,
+        pdf_service: "PDFService",
+        selected_pdf: Optional[Dict[str, Any]] = None,
+        new_conversation: bool = False,
+    ) -> Dict[str, Any]:
+        """Gather what answering a message about the currently selected PDF needs
+
+        Args:
+            user_id: ID of the user sending the message
+            message: User's message
+            pdf_service: PDF service of the request or task
+            selected_pdf: The `document_id` and `title` of the PDF selected when the message was sent,
+                looked up by default
+            new_conversation: Start a new conversation about the document, forgetting the earlier turns
+
+        Returns:
+            Either the `cached_answer`, or the keyword arguments of chat_with_pdf
+        """
+        # Get the currently selected PDF
+        selected_pdf = selected_pdf or await pdf_service.get_selected_pdf(user_id)
+        if not selected_pdf:
+            raise ExceptionBase(ErrorCode.BAD_REQUEST)
+
+        document_id = selected_pdf["document_id"]
+        document = await pdf_service.get_chat_document(document_id, user_id)
+
+        conversation = None
+        if self.memory.enabled:
+            try:
+                if new_conversation:
+                    conversation = await self.memory.start(user_id, document_id)
+                else:
+                    conversation = await self.memory.load(user_id, document_id)
+            except Exception as e:
+                # Answered without the earlier turns
+                self.logger.error("Conversation memory unavailable", error=str(e))
+
+        # The same question about the same document was answered already, unless earlier turns change its meaning
+        if not self.memory.has_history(conversation):
+            cached_answer = await self.get_cached_answer(
+                user_id,
+                message,
+                document,
+                selected_pdf["title"],
+                document_id,
+                conversation["conversation_id"] if conversation else None,
+            )
+            if cached_answer:
+                if conversation is not None:
+                    await self._remember_turn(conversation, message, cached_answer["response"])
+                return {"cached_answer": cached_answer}
+
+        # Documents cached whole at Gemini are only referenced, others send the passages relevant to the message
+        cached_content = await self.get_document_cache(
+            document.get("content_hash"), lambda: pdf_service.get_labelled_text(document_id, user_id)
+        )
+        sections = []
+        if not cached_content:
+            sections = await pdf_service.get_chat_context(document_id, user_id, message)
+            if not sections:
+                raise ExceptionBase(ErrorCode.BAD_REQUEST)
+
+        return {
+            "user_id": user_id,
+            "message": message,
+            "sections": sections,
+            "pdf_title": selected_pdf["title"],
+            "content_hash": document.get("content_hash"),
+            "cached_content": cached_content,
+            "parsed_date": document.get("parsed_date"),
+            "conversation": conversation,
+            "document_id": document_id,
+        }
+
+    async def chat_with_pdf(
+        self,
+        user_id: int,
+        message: str,
+        sections: List[Dict[str, Any]],
+        pdf_title: str,
+        content_hash: Optional[str] = None,
+        cached_content: Optional[str] = None,
+        parsed_date: Optional[datetime] = None,
+        conversation: Optional[Dict[str, Any]] = None,
+        document_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
         """Send a message to Gemini API with PDF context and get a response
 
         Args:
             user_id: ID of the user sending the message
             message: User's message
-            pdf_content: Content of the PDF document
+            sections: Passages of the PDF document relevant to the message, with their `text` and `score`
             pdf_title: Title of the PDF document
+            content_hash: SHA-256 of the PDF bytes
+            cached_content: Name of the Gemini cached content of the document, replaces the passages
+            parsed_date: Timestamp of the parse of the document, versions the cached answer
+            conversation: Conversation of the user about the document, sent as history and extended
+            document_id: ID of the PDF document, saved with the exchange
 
         Returns:
             Dictionary with AI response and message details
         """
+        history = self.memory.history(conversation)
+        saved_with = {"document_id": document_id, "conversation_id": self._conversation_id(conversation)}
+        flight_key = None
+        if content_hash and not history:
+            # The same question about the same parse is one request, whether or not the document cache was ready
+            flight_key = self.answer_cache.key(content_hash, parsed_date, self.model, message)
+
+        if cached_content:
+            ai_response = await self._chat(
+                user_id,
+                message,
+                cached_content=cached_content,
+                content_hash=content_hash,
+                flight_key=flight_key,
+                history=history,
+                **saved_with,
+            )
+        else:
+            system_prompt, history = self._pdf_prompt(message, sections, pdf_title, history)
+            ai_response = await self._chat(
+                user_id, message, system_prompt, flight_key=flight_key, history=history, **saved_with
+            )
+
+        if not history:
+            await self._remember_answer(content_hash, parsed_date, message, ai_response)
+        await self._remember_turn(conversation, message, ai_response)
+        return {"message": message, "response": ai_response, "pdf_title": pdf_title}
+
+    async def stream_chat_with_pdf(
+        self,
+        user_id: int,
+        message: str,
+        sections: List[Dict[str, Any]],
+        pdf_title: str,
+        content_hash: Optional[str] = None,
+        cached_content: Optional[str] = None,
+        parsed_date: Optional[datetime] = None,
+        conversation: Optional[Dict[str, Any]] = None,
+        document_id: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """Send a message to Gemini API with PDF context and stream the response as it is generated
+
+        The assembled response is saved to the chat history once the stream is complete, with a session of
+        its own since the stream outlives the request.
+
+        Args:
+            user_id: ID of the user sending the message
+            message: User's message
+            sections: Passages of the PDF document relevant to the message, with their `text` and `score`
+            pdf_title: Title of the PDF document
+            content_hash: SHA-256 of the PDF bytes
+            cached_content: Name of the Gemini cached content of the document, replaces the passages
+            parsed_date: Timestamp of the parse of the document, versions the cached answer
+            conversation: Conversation of the user about the document, sent as history and extended
+            document_id: ID of the PDF document, saved with the exchange
+
+        Yields:
+            Pieces of text of the AI response
+        """
+        history = self.memory.history(conversation)
+        system_prompt = None
+        if not cached_content:
+            system_prompt, history = self._pdf_prompt(message, sections, pdf_title, history)
+        payload = self._payload(message, system_prompt, cached_content, history)
+        path = f"models/{self.model}:streamGenerateContent?alt=sse"
+
+        pieces = []
         try:
-            # Create system prompt with PDF context
-            system_prompt = f"""You are an AI assistant helping with questions about a PDF document titled '{pdf_title}'.
-            Use the following PDF content to answer the user's questions accurately.
-            If the answer cannot be found in the PDF content, politely say so and suggest what might help.
+            async with self.llm.request("POST", path, payload, stream=True) as response:
+                await self._check_response(response, cached_content, content_hash)
+                async for chunk in self._read_events(response):
+                    piece = self._response_text(chunk)
+                    if piece:
+                        pieces.append(piece)
+                        yield piece
+        except aiohttp.ClientError as e:
+            self.logger.error(f"Gemini API connection error: {str(e)}")
+            raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
+
+        ai_response = "".join(pieces)
+        if not ai_response:
+            raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
+
+        async with get_async_db_context() as db:
+            await self._save_exchange(
+                user_id,
+                message,
+                ai_response,
+                db,
+                document_id=document_id,
+                conversation_id=self._conversation_id(conversation),
+            )
+        if not history:
+            await self._remember_answer(content_hash, parsed_date, message, ai_response)
+        await self._remember_turn(conversation, message, ai_response)
+
+    def _pdf_prompt(
+        self, message: str, sections: List[Dict[str, Any]], pdf_title: str, history: List[Dict[str, str]]
+    ) -> Tuple[str, List[Dict[str, str]]]:
+        """Instructions with the passages of the PDF, and the history, that fit the prompt budget together"""
+        # Create system prompt with PDF context
+        instructions = f"""You are an AI assistant helping with questions about a PDF document titled '{pdf_title}'.
+            Use the following excerpts of the PDF, labelled with their page numbers, to answer the user's questions accurately.
+            If the answer cannot be found in the excerpts, politely say so and suggest what might help.
 
-            PDF CONTENT:
-            {pdf_content}
+            PDF EXCERPTS:
             """
+        packed = self.packer.pack(instructions, message, sections, [turn["text"] for turn in history])
+        # The packer keeps the most recent turns
+        kept_history = history[len(history) - len(packed["history"]) :]
+        return instructions + packed["context"], kept_history
 
-            # Prepare request payload for Gemini API
-            payload = {
-                "contents": [
-                    {"parts": [{"text": system_prompt}], "role": "model"},
-                    {"parts": [{"text": message}], "role": "user"},
-                ]
-            }
+    @staticmethod
+    def _conversation_id(conversation: Optional[Dict[str, Any]]) -> Optional[str]:
+        """ID of a conversation, conversations remembered before it was recorded have none"""
+        return conversation.get("conversation_id") if conversation else None
 
-            # Make API request to Gemini
-            url = f"{self.base_url}/models/{self.model}:generateContent?key={self.api_key}"
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload, headers={"Content-Type": "application/json"}) as response:
-                    if response.status != 200:
-                        self.logger.error("Error from Gemini API", status=response.status)
-                        await response.text()  # Consume response body
-                        raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
-
-                    response_data = await response.json()
-                    ai_response = (
-                        response_data.get("candidates", [{}])[0]
-                        .get("content", {})
-                        .get("parts", [{}])[0]
-                        .get("text", "")
-                    )
+    async def _remember_turn(self, conversation: Optional[Dict[str, Any]], message: str, ai_response: str) -> None:
+        """Add an exchange to the conversation memory"""
+        if conversation is None:
+            return
+        try:
+            await self.memory.remember(conversation, message, ai_response)
+        except Exception as e:
+            self.logger.error("Failed to remember conversation turn", error=str(e))
 
-                    if not ai_response:
-                        raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
+    async def _remember_answer(
+        self, content_hash: Optional[str], parsed_date: Optional[datetime], message: str, ai_response: str
+    ) -> None:
+        """Add an answer about a document to the answer caches"""
+        if not content_hash:
+            return
+        if self.answer_cache.enabled:
+            try:
+                await self.answer_cache.set(content_hash, parsed_date, self.model, message, ai_response)
+            except Exception as e:
+                self.logger.error("Failed to cache answer", error=str(e))
+        if self.semantic_cache.enabled:
+            await self.semantic_cache.add(content_hash, parsed_date, self.model, message, ai_response)
 
-            # Save user message to database
-            user_chat_message = ChatMessage(user_id=user_id, message=message, is_user=True, timestamp=datetime.now())
-            self.db.add(user_chat_message)
+    async def chat_with_library(self, user_id: int, message: str, sections: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Send a message to Gemini API with passages from all of the user's documents and get a response
 
-            # Save AI response to database
-            ai_chat_message = ChatMessage(user_id=user_id, message=ai_response, is_user=False, timestamp=datetime.now())
-            self.db.add(ai_chat_message)
+        Args:
+            user_id: ID of the user sending the message
+            message: User's message
+            sections: Passages relevant to the message, with their `text`, `score` and `source`
 
-            await self.db.commit()
+        Returns:
+            Dictionary with AI response and message details
+        """
+        instructions = """You are an AI assistant helping with questions about the user's library of PDF documents.
+            Use the following excerpts, labelled with their document title and page numbers, to answer the user's questions accurately.
+            Cite the document title and pages your answer relies on.
+            If the answer cannot be found in the excerpts, politely say so and suggest what might help.
+
+            LIBRARY EXCERPTS:
+            """
+        packed = self.packer.pack(instructions, message, sections)
+        ai_response = await self._chat(user_id, message, instructions + packed["context"])
+        sources = [section["source"] for section in packed["sections"]]
+        return {"message": message, "response": ai_response, "sources": sources}
+
+    async def _chat(
+        self,
+        user_id: int,
+        message: str,
+        system_prompt: Optional[str] = None,
+        cached_content: Optional[str] = None,
+        content_hash: Optional[str] = None,
+        flight_key: Optional[str] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+        document_id: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+    ) -> str:
+        """Send a message with a system prompt to Gemini API and save the exchange to the chat history
 
-            return {"message": message, "response": ai_response, "pdf_title": pdf_title}
+        Identical requests in flight at the same time share one Gemini call, each saves its own exchange.
+
+        Args:
+            user_id: ID of the user sending the message
+            message: User's message
+            system_prompt: Instructions and document context for the model
+            cached_content: Name of a Gemini cached content holding the instructions and document instead
+            content_hash: SHA-256 of the PDF bytes in the cached content
+            flight_key: Identifies requests asking the same, defaults to a digest of the request payload
+            history: Summary and earlier turns of the conversation, with their `role` and `text`
+            document_id: ID of the PDF document discussed, saved with the exchange
+            conversation_id: ID of the conversation about the document, saved with the exchange
+
+        Returns:
+            Text of the AI response
+        """
+        payload = self._payload(message, system_prompt, cached_content, history)
+
+        async def generate() -> str:
+            return await self.dispatcher.submit(lambda: self._generate(payload, cached_content, content_hash))
+
+        if self.singleflight.enabled:
+            if not flight_key:
+                request = json.dumps([self.model, payload], sort_keys=True).encode("utf-8")
+                flight_key = f"chat:{hashlib.sha256(request).hexdigest()}"
+            ai_response = await self.singleflight.do(flight_key, generate)
+        else:
+            ai_response = await generate()
+
+        await self._save_exchange(
+            user_id, message, ai_response, document_id=document_id, conversation_id=conversation_id
+        )
+        return ai_response
+
+    async def _generate(
+        self, payload: Dict[str, Any], cached_content: Optional[str], content_hash: Optional[str]
+    ) -> str:
+        """Send a generateContent request to Gemini API and return the text of the response"""
+        try:
+            # Make API request to Gemini over the shared connection pool
+            async with self.llm.request("POST", f"models/{self.model}:generateContent", payload) as response:
+                await self._check_response(response, cached_content, content_hash)
+
+                response_data = await response.json()
+                if cached_content:
+                    self.logger.debug(
+                        "Gemini cache used",
+                        name=cached_content,
+                        cached_tokens=response_data.get("usageMetadata", {}).get("cachedContentTokenCount"),
+                    )
+                ai_response = self._response_text(response_data)
+
+                if not ai_response:
+                    raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
+
+            return ai_response
 
         except aiohttp.ClientError as e:
             self.logger.error(f"Gemini API connection error: {str(e)}")
-            raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR, message="Failed to connect to AI service")
+            raise ExceptionBase(ErrorCode.SERVICE_UNAVAILABLE)
         except ExceptionBase:
             # Re-raise existing ExceptionBase exceptions
             raise
@@ -99,40 +494,216 @@ class AIService:
             self.logger.error(f"Error in chat_with_pdf: {str(e)}")
             raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
 
-    async def get_chat_history(self, user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
-        """Get chat history for a user
+    def _payload(
+        self,
+        message: str,
+        system_prompt: Optional[str],
+        cached_content: Optional[str],
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> Dict[str, Any]:
+        """Request payload of generateContent and streamGenerateContent"""
+        contents = [{"parts": [{"text": turn["text"]}], "role": turn["role"]} for turn in history or []]
+        payload = {
+            "contents": contents + [{"parts": [{"text": message}], "role": "user"}],
+            # The packer reserved room for this many answer tokens
+            "generationConfig": {"maxOutputTokens": settings.GEMINI_MAX_OUTPUT_TOKENS},
+        }
+        if cached_content:
+            payload["cachedContent"] = cached_content
+        else:
+            payload["contents"].insert(0, {"parts": [{"text": system_prompt}], "role": "model"})
+        return payload
+
+    async def _check_response(
+        self, response: aiohttp.ClientResponse, cached_content: Optional[str], content_hash: Optional[str]
+    ) -> None:
+        """Raise on an error status of Gemini API"""
+        if response.status == 200:
+            return
+        self.logger.error("Error from Gemini API", status=response.status)
+        await response.text()  # Consume response body
+        if cached_content and response.status in (403, 404):
+            # The cache is gone at Gemini, create it again on the next message
+            await self.context_cache.forget(content_hash, self.model)
+        if response.status in RETRY_STATUSES:
+            # Still overloaded or rate limited after the retries of the client
+            raise ExceptionBase(ErrorCode.SERVICE_UNAVAILABLE)
+        raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
+
+    @staticmethod
+    def _response_text(response_data: Dict[str, Any]) -> str:
+        """Text of the first candidate of a Gemini response or response chunk"""
+        parts = response_data.get("candidates", [{}])[0].get("content", {}).get("parts", [])
+        return "".join(part.get("text", "") for part in parts)
+
+    @staticmethod
+    async def _read_events(response: aiohttp.ClientResponse) -> AsyncIterator[Dict[str, Any]]:
+        """Parse the Server-Sent Events of a streamGenerateContent response as they arrive"""
+        data_lines = []
+        async for raw_line in response.content:
+            line = raw_line.decode("utf-8").rstrip("\r\n")
+            if line.startswith("data:"):
+                data_lines.append(line[5:].lstrip())
+            elif not line and data_lines:
+                # A blank line ends an event
+                yield json.loads("\n".join(data_lines))
+                data_lines = []
+        if data_lines:
+            yield json.loads("\n".join(data_lines))
+
+    async def _save_exchange(
+        self,
+        user_id: int,
+        message: str,
+        ai_response: str,
+        db: Optional[AsyncSession] = None,
+        document_id: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+    ) -> None:
+        """Save a message and its answer to the chat history, through the history writer of the process
+
+        Args:
+            user_id: ID of the user who sent the message
+            message: User's message
+            ai_response: Text of the AI response
+            db: SQL database session, defaults to the session of the service
+            document_id: ID of the PDF document discussed, None for library chat
+            conversation_id: ID of the conversation about the document
+        """
+        discussed = {
+            "user_id": user_id,
+            "document_id": document_id,
+            "conversation_id": uuid.UUID(conversation_id) if conversation_id else None,
+        }
+        # Timestamps are taken now, the messages keep their order however late they are written
+        await self.history_writer.save(
+            db or self.db,
+            [
+                {"id": uuid.uuid4(), "message": message, "is_user": True, "timestamp": datetime.now(), **discussed},
+                {
+                    "id": uuid.uuid4(),
+                    "message": ai_response,
+                    "is_user": False,
+                    "timestamp": datetime.now(),
+                    **discussed,
+                },
+            ],
+        )
+
+    async def create_chat_job(
+        self, user_id: int, message: str, selected_pdf: Dict[str, Any], new_conversation: bool = False
+    ) -> Dict[str, Any]:
+        """Queue a message about a PDF to be answered by the PDF worker
+
+        Args:
+            user_id: ID of the user sending the message
+            message: User's message
+            selected_pdf: The `document_id` and `title` of the PDF selected for chat
+            new_conversation: Start a new conversation about the document, forgetting the earlier turns
+
+        Returns:
+            The queued job
+        """
+        job = await self.chat_jobs.create(user_id, message)
+        try:
+            chat_pdf_task.delay(
+                job_id=job["job_id"],
+                user_id=user_id,
+                message=message,
+                selected_pdf={"document_id": selected_pdf["document_id"], "title": selected_pdf["title"]},
+                new_conversation=new_conversation,
+            )
+        except Exception as e:
+            self.logger.error("Failed to queue chat job", job_id=job["job_id"], error=str(e))
+            error = ExceptionBase(ErrorCode.SERVICE_UNAVAILABLE)
+            await self.chat_jobs.update(job["job_id"], status=FAILED, error=error.to_dict())
+            raise error
+        return job
+
+    async def get_chat_job(self, user_id: int, job_id: str, wait: float = 0) -> Dict[str, Any]:
+        """Get a chat job of a user, waiting for it to finish when asked to
+
+        Args:
+            user_id: ID of the user who sent the message
+            job_id: ID of the job
+            wait: Seconds to wait for the job to finish, at most CHAT_JOB_MAX_WAIT
+
+        Returns:
+            The job with its status, and its result or error once finished
+        """
+        job = await self.chat_jobs.wait(job_id, min(wait, settings.CHAT_JOB_MAX_WAIT))
+        if job is None or job["user_id"] != user_id:
+            raise ExceptionBase(ErrorCode.NOT_FOUND)
+        return job
+
+    async def get_answer_cache_stats(self) -> Dict[str, Any]:
+        """Get the hit and miss counters of the answer cache
+
+        Returns:
+            Dictionary with hits, misses and hit rate
+        """
+        try:
+            return await self.answer_cache.stats()
+        except Exception as e:
+            self.logger.error(f"Error retrieving answer cache stats: {str(e)}")
+            raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
+
+    async def get_chat_history(
+        self, user_id: int, limit: int = 50, document_id: Optional[str] = None, before: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Get a page of the chat history of a user, newest messages first
+
+        Pages are read by keyset over (timestamp, id): each page continues strictly before the last message of
+        the previous one, so reading deep into a long history costs the same as reading its first page.
 
         Args:
             user_id: ID of the user
             limit: Maximum number of messages to return
+            document_id: Only return the messages about this PDF document
+            before: Cursor of the page to read, the `next_before` of the previous page
 
         Returns:
-            List of chat messages
+            Dictionary with the `history` of chat messages, and the `next_before` cursor of the next page,
+            None once the history is exhausted
         """
+        query = select(ChatMessage).where(ChatMessage.user_id == user_id)
+        if document_id:
+            query = query.where(ChatMessage.document_id == document_id)
+        if before:
+            query = query.where(tuple_(ChatMessage.timestamp, ChatMessage.id) < tuple_(*self._parse_cursor(before)))
+
         try:
-            # Query chat messages for the user, ordered by timestamp
             result = await self.db.execute(
-                select(ChatMessage)
-                .where(ChatMessage.user_id == user_id)
-                .order_by(desc(ChatMessage.timestamp))
-                .limit(limit)
+                query.order_by(desc(ChatMessage.timestamp), desc(ChatMessage.id)).limit(limit)
             )
-
             messages = result.scalars().all()
+        except Exception as e:
+            self.logger.error(f"Error retrieving chat history: {str(e)}")
+            raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
 
-            # Convert to list of dictionaries
-            history = [
-                {
-                    "id": str(msg.id),
-                    "message": msg.message,
-                    "is_user": msg.is_user,
-                    "timestamp": msg.timestamp.isoformat(),
-                }
-                for msg in messages
-            ]
+        # Convert to list of dictionaries
+        history = [
+            {
+                "id": str(msg.id),
+                "message": msg.message,
+                "is_user": msg.is_user,
+                "timestamp": msg.timestamp.isoformat(),
+                "document_id": msg.document_id,
+                "conversation_id": str(msg.conversation_id) if msg.conversation_id else None,
+            }
+            for msg in messages
+        ]
 
-            return history
+        next_before = None
+        if len(messages) == limit:
+            next_before = f"{messages[-1].timestamp.isoformat()},{messages[-1].id}"
+        return {"history": history, "next_before": next_before}
 
-        except Exception as e:
-            self.logger.error(f"Error retrieving chat history: {str(e)}")
-            raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR, message="Failed to retrieve chat history")
+    @staticmethod
+    def _parse_cursor(before: str) -> Tuple[datetime, uuid.UUID]:
+        """Timestamp and ID of the message a history cursor points at"""
+        try:
+            timestamp, message_id = before.rsplit(",", 1)
+            return datetime.fromisoformat(timestamp), uuid.UUID(message_id)
+        except ValueError:
+            raise ExceptionBase(ErrorCode.BAD_REQUEST)
@@ -0,0 +1,315 @@
+import hashlib
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, List, Optional
+
+import numpy as np
+
+from libs.cache.redis import CacheService
+from libs.logger import get_logger
+from libs.settings import settings
+from pdf_service.core.services.embeddings import get_embedding_backend
+from pdf_service.core.services.passage_index import TOKEN_PATTERN, tokenize
+
+# Redis keys of the cached answers and counters, relative to REDIS_PREFIX
+KEY_PREFIX = "answer_cache:"
+HITS_KEY = f"{KEY_PREFIX}stats:hits"
+MISSES_KEY = f"{KEY_PREFIX}stats:misses"
+SEMANTIC_HITS_KEY = f"{KEY_PREFIX}stats:semantic_hits"
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Punctuation closing a question that does not change what is asked
+TRAILING_PUNCTUATION = "?!.;: "
+
+# Words of a question that say how to ask, not what is asked
+QUESTION_FILLER = frozenset(
+    "can could would please tell me give show explain describe list about doc document pdf file paper text whats "
+    "do does did how much many any some all here".split()
+)
+
+# Suffixes folded so that the inflections of a word ("summary", "summarize", "summarised") compare equal,
+# longest first; a stem keeps at least MIN_STEM_LENGTH letters
+SUFFIXES = (
+    "izations isations ization isation ations ation ments ment ness ings ing ions ion ised ized ises izes ise ize "
+    "ies ied ers er ed es s y e"
+).split()
+MIN_STEM_LENGTH = 3
+
+# Words that flip or pin down the meaning of two otherwise similar questions, which must then agree on them;
+# stopwords drop "no" and "not", so they are looked for on their own
+NUMBER_PATTERN = re.compile(r"\d+")
+NEGATIONS = frozenset("no not never none nor without except neither".split())
+
+
+def stem(word: str) -> str:
+    """Strip the inflection of a word, a light suffix stripper good enough to match the words of short questions"""
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM_LENGTH:
+            return word[: -len(suffix)]
+    return word
+
+
+def normalize_question(question: str) -> str:
+    """Fold the differences between two spellings of the same question: case, spacing and closing punctuation"""
+    question = unicodedata.normalize("NFKC", question).casefold()
+    return WHITESPACE_PATTERN.sub(" ", question).strip().rstrip(TRAILING_PUNCTUATION)
+
+
+class AnswerCache:
+    """Answers of Gemini to questions about a document, shared by every user owning the same bytes
+
+    Answers are keyed by content hash, parse date, model and normalized question. A new parse of the content
+    changes its parse date, so answers about the previous text are never served again and expire by TTL.
+    """
+
+    def __init__(self):
+        self.cache = CacheService()
+        self.logger = get_logger("pdf_service.answer_cache")
+
+    @property
+    def enabled(self) -> bool:
+        return settings.CHAT_ANSWER_CACHE_ENABLED
+
+    @staticmethod
+    def key(content_hash: str, parsed_date: Optional[datetime], model: str, question: str) -> str:
+        """Cache key of a question about a parsed document"""
+        digest = hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()[:32]
+        return f"{KEY_PREFIX}{document_key(content_hash, parsed_date, model)}:{digest}"
+
+    async def get(self, content_hash: str, parsed_date: Optional[datetime], model: str, question: str) -> Optional[str]:
+        """
+        Get the cached answer to a question, counting the hit or miss
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+            parsed_date: Timestamp of the parse of the content
+            model: Gemini model that answered
+            question: Message of the user
+
+        Returns:
+            The cached answer, or None
+        """
+        answer = await self.cache.get_cache(self.key(content_hash, parsed_date, model, question))
+        await self.cache.client.incr(f"{self.cache.prefix}{HITS_KEY if answer else MISSES_KEY}")
+        return answer
+
+    async def count_semantic_hit(self) -> None:
+        """Count a miss of the exact cache answered by the semantic cache"""
+        await self.cache.client.incr(f"{self.cache.prefix}{SEMANTIC_HITS_KEY}")
+
+    async def set(
+        self, content_hash: str, parsed_date: Optional[datetime], model: str, question: str, answer: str
+    ) -> None:
+        """
+        Cache the answer to a question for CHAT_ANSWER_CACHE_TTL seconds
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+            parsed_date: Timestamp of the parse of the content
+            model: Gemini model that answered
+            question: Message of the user
+            answer: Answer of the model
+        """
+        await self.cache.set_cache(
+            self.key(content_hash, parsed_date, model, question), answer, settings.CHAT_ANSWER_CACHE_TTL
+        )
+
+    async def invalidate(self, content_hash: str) -> None:
+        """
+        Delete every cached answer about some content
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+        """
+        deleted = 0
+        async for key in self.cache.client.scan_iter(match=f"{self.cache.prefix}{KEY_PREFIX}{content_hash}:*"):
+            deleted += await self.cache.client.delete(key)
+        self.logger.debug("Cached answers deleted", content_hash=content_hash, answers=deleted)
+
+    async def stats(self) -> Dict[str, float]:
+        """Hits and misses counted since the counters were created, semantic hits are part of the misses"""
+        counters = await self.cache.client.mget(
+            f"{self.cache.prefix}{HITS_KEY}",
+            f"{self.cache.prefix}{MISSES_KEY}",
+            f"{self.cache.prefix}{SEMANTIC_HITS_KEY}",
+        )
+        hits, misses, semantic_hits = (int(counter or 0) for counter in counters)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "semantic_hits": semantic_hits,
+            "hit_rate": (hits + semantic_hits) / (hits + misses) if hits + misses else 0.0,
+        }
+
+
+def document_key(content_hash: str, parsed_date: Optional[datetime], model: str) -> str:
+    """Key of the answers of a model about one parse of some content"""
+    version = int(parsed_date.timestamp()) if parsed_date else 0
+    return f"{content_hash}:{version}:{model}"
+
+
+class _RecentQuestions:
+    """Questions recently answered about one document, with their vectors stacked in a matrix"""
+
+    def __init__(self, dim: int):
+        self.matrix = np.empty((0, dim), dtype=np.float32)
+        self.questions: List[str] = []
+        self.guards: List[FrozenSet[str]] = []
+        self.answers: List[str] = []
+        self.created = np.empty(0, dtype=np.float64)
+        self.used = np.empty(0, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.answers)
+
+    def add(self, vector: np.ndarray, question: str, guard: FrozenSet[str], answer: str, now: float) -> None:
+        self.matrix = np.vstack([self.matrix, vector[np.newaxis, :]])
+        self.questions.append(question)
+        self.guards.append(guard)
+        self.answers.append(answer)
+        self.created = np.append(self.created, now)
+        self.used = np.append(self.used, now)
+
+    def keep(self, rows: np.ndarray) -> None:
+        """Keep only the given rows, in order"""
+        self.matrix = self.matrix[rows]
+        self.questions = [self.questions[row] for row in rows]
+        self.guards = [self.guards[row] for row in rows]
+        self.answers = [self.answers[row] for row in rows]
+        self.created = self.created[rows]
+        self.used = self.used[rows]
+
+
+class SemanticAnswerCache:
+    """Answers reused for questions phrased differently from one already answered about the same document
+
+    Questions are embedded with the local hashing vectorizer and compared with one matrix product against the
+    recent questions of the document. Questions expire after CHAT_SEMANTIC_CACHE_TTL seconds; beyond
+    CHAT_SEMANTIC_CACHE_SIZE questions per document and CHAT_SEMANTIC_CACHE_DOCUMENTS documents, the least
+    recently used are evicted. The cache lives in the memory of each process.
+    """
+
+    _documents: "OrderedDict[str, _RecentQuestions]" = OrderedDict()
+
+    def __init__(self):
+        self.embedding = get_embedding_backend("hashing")
+        self.logger = get_logger("pdf_service.answer_cache")
+
+    @property
+    def enabled(self) -> bool:
+        return settings.CHAT_SEMANTIC_CACHE_ENABLED
+
+    async def lookup(
+        self, content_hash: str, parsed_date: Optional[datetime], model: str, question: str
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Find the answer to the most similar recent question about a document
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+            parsed_date: Timestamp of the parse of the content
+            model: Gemini model that answered
+            question: Message of the user
+
+        Returns:
+            The `answer`, the `question` it answered and their similarity `score`, or None below the threshold
+        """
+        key = document_key(content_hash, parsed_date, model)
+        recent = self._documents.get(key)
+        if recent is None:
+            return None
+        now = time.time()
+        self._expire(recent, now)
+        if not len(recent):
+            del self._documents[key]
+            return None
+        self._documents.move_to_end(key)
+
+        vector = await self._embed(question)
+        scores = recent.matrix @ vector
+        # Questions differing in a content word, a number or a negation ask something else ("tenant" and
+        # "landlord", "before" and "after"), however close their vectors
+        guard = self._guard(question)
+        scores[[row for row, row_guard in enumerate(recent.guards) if row_guard != guard]] = -1.0
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+
+        threshold = settings.CHAT_SEMANTIC_CACHE_THRESHOLD
+        self.logger.info(
+            "Semantic cache lookup",
+            content_hash=content_hash,
+            score=round(score, 4),
+            threshold=threshold,
+            hit=score >= threshold,
+            # Questions are user text, only a digest telling them apart is logged
+            matched_question=hashlib.sha256(recent.questions[best].encode("utf-8")).hexdigest()[:12],
+        )
+        if score < threshold:
+            return None
+        recent.used[best] = now
+        return {"answer": recent.answers[best], "question": recent.questions[best], "score": score}
+
+    async def add(
+        self, content_hash: str, parsed_date: Optional[datetime], model: str, question: str, answer: str
+    ) -> None:
+        """
+        Remember the answer to a question about a document
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+            parsed_date: Timestamp of the parse of the content
+            model: Gemini model that answered
+            question: Message of the user
+            answer: Answer of the model
+        """
+        vector = await self._embed(question)
+        key = document_key(content_hash, parsed_date, model)
+        recent = self._documents.get(key)
+        if recent is None:
+            recent = self._documents[key] = _RecentQuestions(self.embedding.dim)
+        self._documents.move_to_end(key)
+
+        now = time.time()
+        self._expire(recent, now)
+        if len(recent) >= settings.CHAT_SEMANTIC_CACHE_SIZE:
+            # Drop the least recently used questions to make room
+            keep = np.sort(np.argsort(recent.used)[len(recent) - settings.CHAT_SEMANTIC_CACHE_SIZE + 1 :])
+            recent.keep(keep)
+        recent.add(vector, question, self._guard(question), answer, now)
+
+        while len(self._documents) > settings.CHAT_SEMANTIC_CACHE_DOCUMENTS:
+            self._documents.popitem(last=False)
+
+    @staticmethod
+    def forget(content_hash: str) -> None:
+        """Drop the questions about some content from the memory of this process"""
+        for key in [key for key in SemanticAnswerCache._documents if key.startswith(f"{content_hash}:")]:
+            del SemanticAnswerCache._documents[key]
+
+    @staticmethod
+    def _terms(question: str) -> List[str]:
+        # Only the words saying what is asked count, in any of their inflections
+        return [stem(term) for term in tokenize(normalize_question(question)) if term not in QUESTION_FILLER]
+
+    async def _embed(self, question: str) -> np.ndarray:
+        return (await self.embedding.embed([" ".join(self._terms(question))]))[0]
+
+    @classmethod
+    def _guard(cls, question: str) -> FrozenSet[str]:
+        """Content stems, numbers and negations of a question, which a question reusing its answer must share"""
+        words = TOKEN_PATTERN.findall(normalize_question(question))
+        return (
+            frozenset(cls._terms(question))
+            | frozenset(NUMBER_PATTERN.findall(question))
+            | NEGATIONS.intersection(words)
+        )
+
+    @staticmethod
+    def _expire(recent: _RecentQuestions, now: float) -> None:
+        fresh = np.flatnonzero(recent.created > now - settings.CHAT_SEMANTIC_CACHE_TTL)
+        if len(fresh) < len(recent):
+            recent.keep(fresh)
@@ -0,0 +1,393 @@
+import asyncio
+import json
+import os
+import socket
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from redis.exceptions import ResponseError
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from libs.cache.redis import CacheService
+from libs.db import get_async_db_context
+from libs.logger import get_logger
+from libs.models.chat import ChatMessage
+from libs.settings import settings
+
+# Durability modes of the chat history, from the most to the least durable
+SYNC = "sync"
+REDIS = "redis"
+MEMORY = "memory"
+MODES = (SYNC, REDIS, MEMORY)
+
+# Redis stream of the messages waiting to be written, relative to REDIS_PREFIX, and the group of its writers
+STREAM_KEY = "chat_history"
+STREAM_GROUP = "chat_history_writers"
+
+# Stream of the messages Postgres rejects, relative to REDIS_PREFIX, kept to be inspected and replayed
+DEAD_LETTER_KEY = "chat_history_dead"
+
+# Deliveries of an entry before it is moved to the dead-letter stream, whatever made its writes fail
+MAX_DELIVERIES = 10
+
+# Entries left unacknowledged this long by a writer are taken over by another, the first one likely stopped
+CLAIM_IDLE_MS = 60000
+
+# Messages kept at most in memory while Postgres is unavailable, in flushes
+MAX_BUFFERED_FLUSHES = 10
+
+
+class ChatHistoryWriter:
+    """Writes chat messages to Postgres behind the requests saving them, shared by all requests of a process
+
+    In `sync` mode each exchange is committed before the answer is returned, as before. Otherwise messages are
+    queued and written in multi-row inserts of up to CHAT_HISTORY_FLUSH_SIZE, at least every
+    CHAT_HISTORY_FLUSH_INTERVAL_MS milliseconds, so answers no longer wait for a commit:
+
+    - `redis` queues them in a Redis stream, encrypted. They survive a crash of the process: entries left
+      unacknowledged are taken over by another writer after a minute, and inserts ignore messages already written.
+      Messages Postgres rejects, or that failed MAX_DELIVERIES times, are moved to a dead-letter stream.
+    - `memory` queues them in the process. Messages of the last interval are lost if the process crashes, and
+      messages Postgres rejects are dropped.
+
+    A rejected batch is written again one message at a time, so a single bad message does not hold back the others.
+
+    Both flush what is queued on graceful shutdown. Messages are only found in the chat history once flushed.
+    """
+
+    def __init__(
+        self, mode: Optional[str] = None, flush_size: Optional[int] = None, flush_interval_ms: Optional[int] = None
+    ):
+        """Initialize the writer, messages are written directly until it is started
+
+        Args:
+            mode: Durability mode, `sync`, `redis` or `memory`, defaults to CHAT_HISTORY_WRITE_MODE
+            flush_size: Messages written at most per insert, defaults to CHAT_HISTORY_FLUSH_SIZE
+            flush_interval_ms: Milliseconds between flushes, defaults to CHAT_HISTORY_FLUSH_INTERVAL_MS
+        """
+        self.mode = mode or settings.CHAT_HISTORY_WRITE_MODE
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown chat history write mode: {self.mode}")
+        self.flush_size = flush_size or settings.CHAT_HISTORY_FLUSH_SIZE
+        interval_ms = flush_interval_ms if flush_interval_ms is not None else settings.CHAT_HISTORY_FLUSH_INTERVAL_MS
+        self.interval = interval_ms / 1000
+        self.logger = get_logger("pdf_service.chat_history_writer")
+        self._buffer: List[Dict[str, Any]] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._counters = {"queued": 0, "written": 0, "flushes": 0, "failures": 0, "dropped": 0, "dead_lettered": 0}
+
+    async def start(self) -> None:
+        """Start writing queued messages in the background"""
+        if self.mode == SYNC or self._runner is not None:
+            return
+        if self.mode == REDIS:
+            self.cache = CacheService()
+            self.stream = f"{self.cache.prefix}{STREAM_KEY}"
+            self.dead_letter_stream = f"{self.cache.prefix}{DEAD_LETTER_KEY}"
+            self.consumer = f"{socket.gethostname()}:{os.getpid()}"
+            try:
+                await self.cache.client.xgroup_create(self.stream, STREAM_GROUP, id="0", mkstream=True)
+            except ResponseError as e:
+                # Created by another process
+                if "BUSYGROUP" not in str(e):
+                    raise
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._runner = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop writing in the background and flush the messages still queued"""
+        if self._runner is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._runner
+        self._runner = None
+
+        if self.mode == MEMORY:
+            while self._buffer and await self._flush_buffer():
+                pass
+            if self._buffer:
+                self.logger.error("Chat messages lost on shutdown", count=len(self._buffer))
+        else:
+            try:
+                # Entries of this writer first, then the ones nobody read yet
+                await self._flush_pending()
+                while await self._flush_new():
+                    pass
+            except Exception as e:
+                # Still in the stream, another writer or the next start takes them over
+                self.logger.error("Failed to flush chat messages on shutdown", error=self._describe(e))
+
+    async def save(self, db: AsyncSession, messages: List[Dict[str, Any]]) -> None:
+        """
+        Save chat messages, committed before returning in `sync` mode or when the writer is not running
+
+        Args:
+            db: SQL database session of the caller, used when the messages are written directly
+            messages: Values of the ChatMessage rows, with their `id` and `timestamp`
+        """
+        if self._runner is None or self._stopping:
+            await self._insert(db, messages)
+            await db.commit()
+            return
+
+        if self.mode == REDIS:
+            try:
+                async with self.cache.client.pipeline(transaction=False) as pipe:
+                    for message in messages:
+                        row = self.cache.fernet.encrypt(json.dumps(message, default=str).encode()).decode()
+                        pipe.xadd(self.stream, {"row": row})
+                    await pipe.execute()
+            except Exception as e:
+                self.logger.error("Chat history stream unavailable, writing directly", error=self._describe(e))
+                await self._insert(db, messages)
+                await db.commit()
+                return
+        else:
+            self._buffer.extend(messages)
+            if len(self._buffer) >= self.flush_size:
+                self._wake.set()
+        self._counters["queued"] += len(messages)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Counters of the queued and written messages, and the messages waiting in this process"""
+        return {**self._counters, "mode": self.mode, "buffered": len(self._buffer)}
+
+    async def _run(self) -> None:
+        # Entries a stopped writer left unacknowledged are taken over when starting, then every minute
+        next_claim = 0.0
+        # Entries of a failed flush are read again after this delay, doubled at each failure in a row
+        retry_delay = self.interval
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            written = 0
+            try:
+                if self.mode == MEMORY:
+                    written = await self._flush_buffer()
+                else:
+                    if loop.time() >= next_claim:
+                        next_claim = loop.time() + CLAIM_IDLE_MS / 1000
+                        await self._claim()
+                        await self._flush_pending()
+                        retry_delay = self.interval
+                    written = await self._flush_new()
+            except Exception as e:
+                self._counters["failures"] += 1
+                self.logger.error("Failed to flush chat messages", mode=self.mode, error=self._describe(e))
+                next_claim = min(next_claim, loop.time() + retry_delay)
+                retry_delay = min(2 * retry_delay, CLAIM_IDLE_MS / 1000)
+
+            # A full flush means more are waiting, otherwise messages are gathered for an interval
+            if written < self.flush_size:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _flush_buffer(self) -> int:
+        """Write the oldest messages of the buffer, keeping them when Postgres fails"""
+        messages = self._buffer[: self.flush_size]
+        if not messages:
+            return 0
+        del self._buffer[: len(messages)]
+        try:
+            rejected = await self._write_batch(messages)
+        except Exception as e:
+            self._counters["failures"] += 1
+            self.logger.error(
+                "Failed to flush chat messages", mode=self.mode, count=len(messages), error=self._describe(e)
+            )
+            self._buffer[:0] = messages
+            excess = len(self._buffer) - MAX_BUFFERED_FLUSHES * self.flush_size
+            if excess > 0:
+                # The oldest go first, memory has to stay bounded while Postgres is down
+                del self._buffer[:excess]
+                self._counters["dropped"] += excess
+                self.logger.error("Chat messages dropped", count=excess)
+            return 0
+        if rejected:
+            self._counters["dropped"] += len(rejected)
+            self.logger.error(
+                "Chat messages rejected by Postgres dropped", count=len(rejected), error=self._describe(rejected[0][1])
+            )
+        return len(messages)
+
+    async def _flush_pending(self) -> None:
+        """Write the entries this writer read but did not acknowledge, after a failed flush or a takeover"""
+        start = "0"
+        while True:
+            entries = await self._read(start)
+            if not entries:
+                return
+            pending = await self.cache.client.xpending_range(
+                self.stream,
+                STREAM_GROUP,
+                min=entries[0][0],
+                max=entries[-1][0],
+                count=len(entries),
+                consumername=self.consumer,
+            )
+            deliveries = {item["message_id"]: item["times_delivered"] for item in pending}
+            exhausted = [
+                (entry_id, fields) for entry_id, fields in entries if deliveries.get(entry_id, 0) > MAX_DELIVERIES
+            ]
+            if exhausted:
+                await self._dead_letter(
+                    [
+                        (entry_id, fields, f"Not written after {MAX_DELIVERIES} deliveries")
+                        for entry_id, fields in exhausted
+                    ]
+                )
+            await self._flush_entries([entry for entry in entries if deliveries.get(entry[0], 0) <= MAX_DELIVERIES])
+            # Read on from the last entry, the ones of this batch are acknowledged or moved
+            start = entries[-1][0]
+
+    async def _flush_new(self) -> int:
+        """Write the next entries of the stream nobody read yet"""
+        entries = await self._read(">")
+        await self._flush_entries(entries)
+        return len(entries)
+
+    async def _read(self, start: str) -> List[Tuple[str, Dict[str, str]]]:
+        """Read entries of the stream for this writer, its unacknowledged ones after `start` unless it is `>`"""
+        response = await self.cache.client.xreadgroup(
+            STREAM_GROUP,
+            self.consumer,
+            {self.stream: start},
+            count=self.flush_size,
+            block=None if start != ">" or self._stopping else max(1, int(self.interval * 1000)),
+        )
+        return response[0][1] if response else []
+
+    async def _flush_entries(self, entries: List[Tuple[str, Dict[str, str]]]) -> None:
+        """Write entries of the stream and acknowledge them, moving those Postgres rejects to the dead-letter stream"""
+        if not entries:
+            return
+        dead: List[Tuple[str, Dict[str, str], Any]] = []
+        written: List[Tuple[str, Dict[str, str]]] = []
+        messages = []
+        for entry_id, fields in entries:
+            # Entries deleted before being acknowledged come back empty
+            if not fields:
+                continue
+            try:
+                messages.append(self._decode(fields["row"]))
+                written.append((entry_id, fields))
+            except Exception as e:
+                dead.append((entry_id, fields, e))
+        if messages:
+            for index, error in await self._write_batch(messages):
+                dead.append((*written[index], error))
+        if dead:
+            await self._dead_letter(dead)
+
+        ids = [entry_id for entry_id, _ in entries]
+        await self.cache.client.xack(self.stream, STREAM_GROUP, *ids)
+        await self.cache.client.xdel(self.stream, *ids)
+
+    async def _dead_letter(self, dead: List[Tuple[str, Dict[str, str], Any]]) -> None:
+        """Move entries to the dead-letter stream, still encrypted, with the reason they were not written"""
+        async with self.cache.client.pipeline(transaction=False) as pipe:
+            for entry_id, fields, error in dead:
+                pipe.xadd(
+                    self.dead_letter_stream,
+                    {"entry": entry_id, "row": fields.get("row", ""), "error": self._describe(error)},
+                )
+                pipe.xack(self.stream, STREAM_GROUP, entry_id)
+                pipe.xdel(self.stream, entry_id)
+            await pipe.execute()
+        self._counters["dead_lettered"] += len(dead)
+        self.logger.error(
+            "Chat messages moved to the dead-letter stream",
+            count=len(dead),
+            stream=self.dead_letter_stream,
+            error=self._describe(dead[0][2]),
+        )
+
+    async def _claim(self) -> None:
+        """Take over the entries other writers read but did not acknowledge for a while"""
+        start = "0-0"
+        while True:
+            start, claimed, *_ = await self.cache.client.xautoclaim(
+                self.stream, STREAM_GROUP, self.consumer, CLAIM_IDLE_MS, start_id=start, count=self.flush_size
+            )
+            if claimed:
+                self.logger.warning("Chat messages of a stopped writer taken over", count=len(claimed))
+            if start == "0-0":
+                return
+
+    async def _write_batch(self, messages: List[Dict[str, Any]]) -> List[Tuple[int, Exception]]:
+        """
+        Write messages in one insert, or one at a time when Postgres rejects the insert
+
+        Args:
+            messages: Values of the ChatMessage rows
+
+        Returns:
+            Position and error of the messages Postgres rejects, raises when Postgres is unavailable
+        """
+        try:
+            await self._write(messages)
+            return []
+        except Exception as e:
+            if self._unavailable(e):
+                raise
+            if len(messages) == 1:
+                return [(0, e)]
+
+        rejected = []
+        for index, message in enumerate(messages):
+            try:
+                await self._write([message])
+            except Exception as e:
+                if self._unavailable(e):
+                    raise
+                rejected.append((index, e))
+        return rejected
+
+    async def _write(self, messages: List[Dict[str, Any]]) -> None:
+        async with get_async_db_context() as db:
+            await self._insert(db, messages)
+            await db.commit()
+        self._counters["written"] += len(messages)
+        self._counters["flushes"] += 1
+        self.logger.debug("Chat messages flushed", mode=self.mode, count=len(messages))
+
+    async def _insert(self, db: AsyncSession, messages: List[Dict[str, Any]]) -> None:
+        """Insert messages in one statement per flush, skipping those already written by an earlier attempt"""
+        for start in range(0, len(messages), self.flush_size):
+            statement = insert(ChatMessage).values(messages[start : start + self.flush_size])
+            await db.execute(statement.on_conflict_do_nothing(index_elements=[ChatMessage.id]))
+
+    def _decode(self, row: str) -> Dict[str, Any]:
+        """Values of a ChatMessage row from a stream entry"""
+        values = json.loads(self.cache.fernet.decrypt(row.encode()).decode())
+        conversation_id = values.get("conversation_id")
+        return {
+            **values,
+            "id": uuid.UUID(values["id"]),
+            "timestamp": datetime.fromisoformat(values["timestamp"]),
+            "conversation_id": uuid.UUID(conversation_id) if conversation_id else None,
+        }
+
+    @staticmethod
+    def _unavailable(error: Exception) -> bool:
+        """Whether an error means Postgres cannot be reached, rather than that it rejects the messages"""
+        if not isinstance(error, DBAPIError):
+            return True
+        return error.connection_invalidated or isinstance(error, (OperationalError, InterfaceError))
+
+    @staticmethod
+    def _describe(error: Any) -> str:
+        """Error of the driver, without the statement and its parameters holding the messages"""
+        if isinstance(error, str):
+            return error
+        error = getattr(error, "orig", None) or error
+        return f"{type(error).__name__}: {error}"[:500]
@@ -0,0 +1,124 @@
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from libs.cache.redis import CacheService
+from libs.logger import get_logger
+from libs.settings import settings
+
+# Redis keys and channels of the chat jobs, relative to REDIS_PREFIX
+KEY_PREFIX = "chat_job:"
+
+# Statuses of a job, the last two are final
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+FINISHED = frozenset({COMPLETED, FAILED})
+
+
+class ChatJobStore:
+    """Status and result of chat messages answered by the PDF worker, kept in Redis for CHAT_JOB_TTL seconds
+
+    Jobs are stored encrypted like every cached value, since they hold the message and answer. Finishing a
+    job announces it on a channel, so clients long-polling the job are answered as soon as it is done.
+    """
+
+    def __init__(self):
+        self.cache = CacheService()
+        self.logger = get_logger("pdf_service.chat_jobs")
+
+    async def create(self, user_id: int, message: str) -> Dict[str, Any]:
+        """
+        Record a new queued job
+
+        Args:
+            user_id: ID of the user sending the message
+            message: User's message
+
+        Returns:
+            The job, with its `job_id`
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "message": message,
+            "status": QUEUED,
+            "result": None,
+            "error": None,
+            "created": now,
+            "updated": now,
+        }
+        await self._save(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a job
+
+        Args:
+            job_id: ID of the job
+
+        Returns:
+            The job, or None if it does not exist or expired
+        """
+        value = await self.cache.get_cache(f"{KEY_PREFIX}{job_id}")
+        return json.loads(value) if value else None
+
+    async def update(self, job_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+        """
+        Change the status, result or error of a job, announcing it when it finishes
+
+        Args:
+            job_id: ID of the job
+            **fields: Fields of the job to set
+
+        Returns:
+            The updated job, or None if it expired meanwhile
+        """
+        job = await self.get(job_id)
+        if job is None:
+            self.logger.warning("Chat job expired before it was updated", job_id=job_id)
+            return None
+        job.update(fields, updated=datetime.now(timezone.utc).isoformat())
+        await self._save(job)
+        if job["status"] in FINISHED:
+            await self.cache.client.publish(f"{self.cache.prefix}{KEY_PREFIX}{job_id}", job["status"])
+        return job
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Get a job once it is finished, or as it is when the timeout runs out
+
+        Args:
+            job_id: ID of the job
+            timeout: Seconds to wait for the job to finish
+
+        Returns:
+            The job, or None if it does not exist or expired
+        """
+        job = await self.get(job_id)
+        if job is None or job["status"] in FINISHED or timeout <= 0:
+            return job
+
+        deadline = time.monotonic() + timeout
+        pubsub = self.cache.client.pubsub()
+        try:
+            await pubsub.subscribe(f"{self.cache.prefix}{KEY_PREFIX}{job_id}")
+            # The job may have finished before the subscription
+            job = await self.get(job_id)
+            while job is not None and job["status"] not in FINISHED:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining):
+                    job = await self.get(job_id)
+            return job
+        finally:
+            await pubsub.aclose()
+
+    async def _save(self, job: Dict[str, Any]) -> None:
+        await self.cache.set_cache(f"{KEY_PREFIX}{job['job_id']}", json.dumps(job, default=str), settings.CHAT_JOB_TTL)
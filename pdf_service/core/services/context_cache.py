@@ -0,0 +1,225 @@
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import aiohttp
+
+from libs.cache.redis import CacheService
+from libs.exceptions.schemas import ExceptionBase
+from libs.logger import get_logger
+from libs.settings import settings
+from pdf_service.core.services.llm_client import LLMClient
+from pdf_service.core.services.prompt_packer import PromptPacker, estimate_tokens
+
+# Redis keys of the cache entries, relative to REDIS_PREFIX
+KEY_PREFIX = "gemini_cache:"
+ENTRIES_KEY = f"{KEY_PREFIX}entries"
+
+# Seconds an entry is forgotten before Gemini expires it, so a request never references an expired cache
+EXPIRY_MARGIN = 60
+
+# Seconds another process may take to create the cache of a document before it is tried again
+CREATE_LOCK_SECONDS = 60
+
+
+class GeminiContextCache:
+    """Gemini cached contents holding the full text of documents, tracked in Redis
+
+    A document is cached once per (content hash, model) and shared by every user owning the same bytes.
+    Redis remembers the name and expiry of each cache, refreshes the TTL of caches in use and deletes the
+    least recently used caches beyond GEMINI_CACHE_MAX_ENTRIES, since Gemini bills cache storage by the hour.
+
+    Only documents that fit the prompt budget with room for the conversation history are cached, since the
+    whole cache is part of the input of every message. Larger documents are answered from retrieved passages.
+    """
+
+    def __init__(self, llm_client: Optional[LLMClient] = None):
+        """Initialize the context cache
+
+        Args:
+            llm_client: Gemini client to send requests with, a short-lived one per request by default
+        """
+        self.llm = llm_client
+        self.cache = CacheService()
+        self.logger = get_logger("pdf_service.context_cache")
+
+    @property
+    def enabled(self) -> bool:
+        return settings.GEMINI_CACHE_ENABLED
+
+    async def get_or_create(
+        self, content_hash: str, model: str, system_instruction: str, load_text: Callable[[], Awaitable[str]]
+    ) -> Optional[str]:
+        """
+        Get the cached content of a document, creating it on first use
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+            model: Gemini model the cache is for
+            system_instruction: Instructions stored with the document
+            load_text: Loads the text of the document, only called when the cache has to be created
+
+        Returns:
+            Name of the cached content, or None when the document is not cached and its text has to be sent
+        """
+        entry_id = f"{model}:{content_hash}"
+        entry = await self._get_entry(entry_id)
+        if entry is not None:
+            if entry["name"] is None:
+                # Too small or too large to cache, remembered so its text is not loaded on every turn
+                return None
+            if entry.get("tokens", float("inf")) <= self.max_tokens(model):
+                await self._touch(entry_id, entry)
+                return entry["name"]
+            # Cached under a larger budget, the passages are cheaper to send now
+            await self._delete(entry_id)
+
+        # One process creates the cache, the others answer without it meanwhile
+        lock_key = f"{self.cache.prefix}{KEY_PREFIX}{entry_id}:lock"
+        if not await self.cache.client.set(lock_key, "1", nx=True, ex=CREATE_LOCK_SECONDS):
+            return None
+        try:
+            return await self._create(entry_id, content_hash, model, system_instruction, await load_text())
+        finally:
+            await self.cache.client.delete(lock_key)
+
+    @staticmethod
+    def max_tokens(model: str) -> int:
+        """Largest document cached for a model: the prompt budget less the conversation history sent with it"""
+        budget = PromptPacker(model).input_budget
+        if settings.CHAT_MEMORY_ENABLED:
+            budget -= settings.CHAT_MEMORY_TOKENS
+        return min(settings.GEMINI_CACHE_MAX_TOKENS, budget)
+
+    async def forget(self, content_hash: str, model: str) -> None:
+        """
+        Forget the cache of a document, e.g. after Gemini reported it missing
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+            model: Gemini model the cache is for
+        """
+        entry_id = f"{model}:{content_hash}"
+        await self.cache.delete_cache(f"{KEY_PREFIX}{entry_id}")
+        await self.cache.client.zrem(self._entries_key, entry_id)
+
+    async def evict(self, content_hash: str) -> None:
+        """
+        Delete the caches of a document for every model
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+        """
+        entry_ids = [
+            entry_id
+            for entry_id in await self.cache.client.zrange(self._entries_key, 0, -1)
+            if entry_id.endswith(f":{content_hash}")
+        ]
+        for entry_id in entry_ids:
+            await self._delete(entry_id)
+
+    @property
+    def _entries_key(self) -> str:
+        # Entry IDs scored by last use, for least recently used eviction
+        return f"{self.cache.prefix}{ENTRIES_KEY}"
+
+    async def _get_entry(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        value = await self.cache.get_cache(f"{KEY_PREFIX}{entry_id}")
+        return json.loads(value) if value else None
+
+    async def _set_entry(self, entry_id: str, entry: Dict[str, Any], expiration: int) -> None:
+        await self.cache.set_cache(f"{KEY_PREFIX}{entry_id}", json.dumps(entry), max(1, expiration))
+
+    async def _create(
+        self, entry_id: str, content_hash: str, model: str, system_instruction: str, text: str
+    ) -> Optional[str]:
+        ttl = settings.GEMINI_CACHE_TTL
+        token_count = estimate_tokens(system_instruction) + estimate_tokens(text)
+        if not settings.GEMINI_CACHE_MIN_TOKENS <= token_count <= self.max_tokens(model):
+            self.logger.debug("Document not cached", content_hash=content_hash, model=model, tokens=token_count)
+            await self._set_entry(entry_id, {"name": None}, ttl)
+            return None
+
+        payload = {
+            "model": f"models/{model.removeprefix('models/')}",
+            "displayName": content_hash[:32],
+            "systemInstruction": {"parts": [{"text": system_instruction}]},
+            "contents": [{"parts": [{"text": text}], "role": "user"}],
+            "ttl": f"{ttl}s",
+        }
+        created = time.time()
+        try:
+            data = await self._request("POST", "cachedContents", payload)
+        except (aiohttp.ClientError, ExceptionBase) as e:
+            self.logger.warning("Failed to create Gemini cache", content_hash=content_hash, model=model, error=str(e))
+            return None
+
+        # Expiry measured from before the request, never later than the one Gemini tracks
+        entry = {"name": data["name"], "expires": created + ttl, "tokens": token_count}
+        await self._set_entry(entry_id, entry, ttl - EXPIRY_MARGIN)
+        await self.cache.client.zadd(self._entries_key, {entry_id: created})
+        self.logger.info(
+            "Gemini cache created",
+            content_hash=content_hash,
+            model=model,
+            name=data["name"],
+            tokens=data.get("usageMetadata", {}).get("totalTokenCount", token_count),
+        )
+
+        await self._evict_least_recently_used()
+        return entry["name"]
+
+    async def _touch(self, entry_id: str, entry: Dict[str, Any]) -> None:
+        now = time.time()
+        await self.cache.client.zadd(self._entries_key, {entry_id: now})
+
+        # Extend caches in use once half of their TTL has passed, idle caches expire on their own
+        ttl = settings.GEMINI_CACHE_TTL
+        if entry["expires"] - now > ttl / 2:
+            return
+        try:
+            await self._request("PATCH", f"{entry['name']}?updateMask=ttl", {"ttl": f"{ttl}s"})
+        except (aiohttp.ClientError, ExceptionBase) as e:
+            self.logger.warning("Failed to extend Gemini cache", name=entry["name"], error=str(e))
+            return
+        entry["expires"] = now + ttl
+        await self._set_entry(entry_id, entry, ttl - EXPIRY_MARGIN)
+
+    async def _evict_least_recently_used(self) -> None:
+        client = self.cache.client
+        # Entries unused for a whole TTL have expired at Gemini already
+        await client.zremrangebyscore(self._entries_key, "-inf", time.time() - settings.GEMINI_CACHE_TTL)
+
+        excess = await client.zcard(self._entries_key) - settings.GEMINI_CACHE_MAX_ENTRIES
+        if excess <= 0:
+            return
+        for entry_id, _ in await client.zpopmin(self._entries_key, excess):
+            await self._delete(entry_id)
+
+    async def _delete(self, entry_id: str) -> None:
+        entry = await self._get_entry(entry_id)
+        await self.cache.delete_cache(f"{KEY_PREFIX}{entry_id}")
+        await self.cache.client.zrem(self._entries_key, entry_id)
+        if not entry or not entry["name"]:
+            return
+        try:
+            await self._request("DELETE", entry["name"])
+        except (aiohttp.ClientError, ExceptionBase) as e:
+            # It expires at Gemini by itself
+            self.logger.warning("Failed to delete Gemini cache", name=entry["name"], error=str(e))
+            return
+        self.logger.info("Gemini cache deleted", name=entry["name"])
+
+    async def _request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if self.llm is None:
+            async with LLMClient() as llm:
+                return await self._send(llm, method, path, payload)
+        return await self._send(self.llm, method, path, payload)
+
+    @staticmethod
+    async def _send(llm: LLMClient, method: str, path: str, payload: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        async with llm.request(method, path, payload) as response:
+            if response.status == 404 and method == "DELETE":
+                return {}
+            response.raise_for_status()
+            return await response.json()
@@ -0,0 +1,266 @@
+import asyncio
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from libs.db.mongodb import get_async_mongodb
+from libs.logger import get_logger
+from libs.settings import settings
+from pdf_service.core.services.llm_client import LLMClient
+from pdf_service.core.services.prompt_packer import estimate_tokens
+
+# Stored turns at most per conversation, in case summarizing keeps failing
+MAX_STORED_TURNS_FACTOR = 4
+
+SUMMARY_INSTRUCTIONS = """You maintain the memory of a conversation between a user and an assistant about a PDF document.
+Update the summary with the new turns below. Keep the facts, names, numbers and page references that were
+discussed, what the user is trying to achieve, and any question left open. Drop small talk. Answer with the
+updated summary only, in at most {words} words."""
+
+
+class ConversationMemory:
+    """Memory of the conversation of a user about a document: a running summary and the latest turns verbatim
+
+    The last CHAT_MEMORY_TURNS exchanges are kept as they were said. Once twice as many have accumulated, the
+    older half is folded into the summary by Gemini, so summarizing runs once every CHAT_MEMORY_TURNS exchanges
+    and updates the summary instead of rewriting it from the whole conversation. Folding runs in the background,
+    no answer waits for it. The history sent with a message is capped at CHAT_MEMORY_TOKENS, dropping the oldest
+    turns first.
+    """
+
+    # Folds running in the background, by conversation
+    _folds: Dict[str, asyncio.Task] = {}
+
+    def __init__(self, mongodb=None, llm_client: Optional[LLMClient] = None, model: Optional[str] = None):
+        """Initialize the conversation memory
+
+        Args:
+            mongodb: MongoDB database connection, the shared one by default
+            llm_client: Gemini client to summarize with, a short-lived one by default
+            model: Gemini model summarizing, defaults to GEMINI_MODEL
+        """
+        self.mongodb = mongodb
+        self.llm = llm_client
+        self.model = model or settings.GEMINI_MODEL
+        self.logger = get_logger("pdf_service.conversation_memory")
+
+    @property
+    def enabled(self) -> bool:
+        return settings.CHAT_MEMORY_ENABLED
+
+    async def load(self, user_id: int, document_id: str) -> Dict[str, Any]:
+        """
+        Load the conversation of a user about a document
+
+        Args:
+            user_id: ID of the user
+            document_id: ID of the PDF document
+
+        Returns:
+            The conversation with its `summary`, `turns` and `conversation_id`, empty if it has not started
+        """
+        collection = await self._collection()
+        conversation = await collection.find_one({"_id": self._id(user_id, document_id)})
+        return conversation or self._new(user_id, document_id)
+
+    async def start(self, user_id: int, document_id: str) -> Dict[str, Any]:
+        """
+        Start a new conversation of a user about a document, forgetting the earlier one
+
+        Args:
+            user_id: ID of the user
+            document_id: ID of the PDF document
+
+        Returns:
+            The new, empty conversation
+        """
+        collection = await self._collection()
+        await collection.delete_one({"_id": self._id(user_id, document_id)})
+        return self._new(user_id, document_id)
+
+    @staticmethod
+    def has_history(conversation: Optional[Dict[str, Any]]) -> bool:
+        """Whether earlier turns of a conversation can change the meaning of its next message"""
+        return bool(conversation and (conversation["summary"] or conversation["turns"]))
+
+    def history(self, conversation: Optional[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """
+        History to send with the next message: the summary, then the latest turns, within CHAT_MEMORY_TOKENS
+
+        Args:
+            conversation: The conversation, as loaded
+
+        Returns:
+            Entries with the `role` (user or model) and `text` of each turn, oldest first
+        """
+        if not self.has_history(conversation):
+            return []
+
+        remaining = settings.CHAT_MEMORY_TOKENS
+        summary = None
+        if conversation["summary"]:
+            summary = {"role": "user", "text": f"Summary of our conversation so far:\n{conversation['summary']}"}
+            remaining -= estimate_tokens(summary["text"])
+
+        # Recent turns matter most, keep them first
+        turns: List[Dict[str, str]] = []
+        for turn in reversed(conversation["turns"]):
+            turn_tokens = estimate_tokens(turn["text"])
+            if turn_tokens > remaining:
+                break
+            turns.insert(0, turn)
+            remaining -= turn_tokens
+        return ([summary] if summary else []) + turns
+
+    async def remember(self, conversation: Dict[str, Any], message: str, answer: str) -> None:
+        """
+        Add an exchange to a conversation, folding the older turns into the summary when enough accumulated
+
+        Args:
+            conversation: The conversation, as loaded
+            message: User's message
+            answer: Answer of the model
+        """
+        collection = await self._collection()
+        keep = 2 * settings.CHAT_MEMORY_TURNS
+        stored = await collection.find_one_and_update(
+            {"_id": conversation["_id"]},
+            {
+                "$push": {
+                    "turns": {
+                        "$each": [{"role": "user", "text": message}, {"role": "model", "text": answer}],
+                        "$slice": -MAX_STORED_TURNS_FACTOR * keep,
+                    }
+                },
+                "$set": {
+                    "user_id": conversation["user_id"],
+                    "document_id": conversation["document_id"],
+                    "updated_date": datetime.utcnow(),
+                },
+                "$setOnInsert": {"summary": "", "conversation_id": conversation.get("conversation_id")},
+                "$inc": {"version": 1},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if len(stored["turns"]) >= 2 * keep and stored["_id"] not in self._folds:
+            task = asyncio.create_task(self._fold(stored, len(stored["turns"]) - keep))
+            self._folds[stored["_id"]] = task
+            task.add_done_callback(self._fold_done)
+
+    @classmethod
+    async def drain(cls) -> None:
+        """Wait for the folds running in the background, before their event loop or Gemini client goes away"""
+        if cls._folds:
+            await asyncio.gather(*cls._folds.values(), return_exceptions=True)
+
+    async def forget_document(self, document_id: str) -> None:
+        """
+        Delete every conversation about a document
+
+        Args:
+            document_id: ID of the PDF document
+        """
+        collection = await self._collection()
+        await collection.delete_many({"document_id": document_id})
+
+    @staticmethod
+    async def ensure_indexes(mongodb) -> None:
+        """
+        Create the MongoDB indexes used by the conversation memory
+
+        Args:
+            mongodb: MongoDB database connection
+        """
+        await mongodb["conversation_memory"].create_index([("document_id", 1)])
+
+    async def _fold(self, conversation: Dict[str, Any], count: int) -> None:
+        """Fold the oldest turns of a conversation into its summary"""
+        try:
+            summary = await self._summarize(conversation["summary"], conversation["turns"][:count])
+        except Exception as e:
+            # The turns stay verbatim, folding is tried again after the next exchange
+            self.logger.warning("Failed to summarize conversation", conversation=conversation["_id"], error=str(e))
+            return
+
+        collection = await self._collection()
+        result = await collection.update_one(
+            # Turns stored while summarizing are kept. A conversation started over, trimmed or folded meanwhile
+            # no longer has this summary and first turn, and is left as it is
+            {"_id": conversation["_id"], "summary": conversation["summary"], "turns.0": conversation["turns"][0]},
+            [
+                {
+                    "$set": {
+                        "summary": summary,
+                        "turns": {"$slice": ["$turns", count, {"$size": "$turns"}]},
+                        "version": {"$add": ["$version", 1]},
+                    }
+                }
+            ],
+        )
+        self.logger.info(
+            "Conversation summarized",
+            conversation=conversation["_id"],
+            folded_turns=count,
+            summary_tokens=estimate_tokens(summary),
+            stored=result.modified_count == 1,
+        )
+
+    async def _summarize(self, summary: str, turns: List[Dict[str, str]]) -> str:
+        transcript = "\n\n".join(
+            f"{'User' if turn['role'] == 'user' else 'Assistant'}: {turn['text']}" for turn in turns
+        )
+        # About three quarters of a word per token
+        instructions = SUMMARY_INSTRUCTIONS.format(words=settings.CHAT_MEMORY_SUMMARY_TOKENS * 3 // 4)
+        payload = {
+            "systemInstruction": {"parts": [{"text": instructions}]},
+            "contents": [
+                {
+                    "parts": [{"text": f"CURRENT SUMMARY:\n{summary or '(none)'}\n\nNEW TURNS:\n{transcript}"}],
+                    "role": "user",
+                }
+            ],
+            "generationConfig": {"maxOutputTokens": settings.CHAT_MEMORY_SUMMARY_TOKENS},
+        }
+        if self.llm is None:
+            async with LLMClient() as llm:
+                return await self._generate(llm, payload)
+        return await self._generate(self.llm, payload)
+
+    async def _generate(self, llm: LLMClient, payload: Dict[str, Any]) -> str:
+        async with llm.request("POST", f"models/{self.model}:generateContent", payload) as response:
+            response.raise_for_status()
+            data = await response.json()
+        parts = data.get("candidates", [{}])[0].get("content", {}).get("parts", [])
+        text = "".join(part.get("text", "") for part in parts).strip()
+        if not text:
+            raise ValueError("Empty summary")
+        return text
+
+    def _fold_done(self, task: asyncio.Task) -> None:
+        for conversation_id, fold in list(self._folds.items()):
+            if fold is task:
+                del self._folds[conversation_id]
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.warning("Failed to fold conversation", error=str(task.exception()))
+
+    async def _collection(self):
+        mongodb = self.mongodb if self.mongodb is not None else await get_async_mongodb()
+        return mongodb["conversation_memory"]
+
+    def _new(self, user_id: int, document_id: str) -> Dict[str, Any]:
+        return {
+            "_id": self._id(user_id, document_id),
+            "user_id": user_id,
+            "document_id": document_id,
+            "conversation_id": str(uuid.uuid4()),
+            "summary": "",
+            "turns": [],
+            "version": 0,
+        }
+
+    @staticmethod
+    def _id(user_id: int, document_id: str) -> str:
+        return f"{user_id}:{document_id}"
@@ -0,0 +1,155 @@
+import asyncio
+import math
+from abc import ABC, abstractmethod
+import zlib
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from libs.settings import settings
+from pdf_service.core.services.llm_client import LLMClient
+from pdf_service.core.services.passage_index import tokenize
+
+# Weight of the character trigrams of a word relative to the word itself
+TRIGRAM_WEIGHT = 0.5
+
+
+class EmbeddingBackend(ABC):
+    """Turn passages of text into L2-normalized float32 vectors"""
+
+    name = ""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    @property
+    def key(self) -> str:
+        """Identifier of the vector space, vectors of different keys cannot be compared"""
+        return f"{self.name}-{self.dim}"
+
+    @abstractmethod
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            Matrix of one normalized float32 row per text
+        """
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return (vectors / norms).astype(np.float32, copy=False)
+
+
+@lru_cache(maxsize=200_000)
+def _word_features(word: str, dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Hashed buckets and signed weights of a word and of its character trigrams"""
+    padded = f"<{word}>"
+    features = [(word, 1.0)] + [(padded[i : i + 3], TRIGRAM_WEIGHT) for i in range(len(padded) - 2)]
+    buckets = np.empty(len(features), dtype=np.int64)
+    weights = np.empty(len(features), dtype=np.float32)
+    for i, (feature, weight) in enumerate(features):
+        digest = zlib.crc32(feature.encode("utf-8"))
+        buckets[i] = digest % dim
+        # One hash bit picks the sign so colliding features cancel out instead of piling up
+        weights[i] = weight if digest & 0x80000000 else -weight
+    return buckets, weights
+
+
+class HashingEmbedding(EmbeddingBackend):
+    """Local CPU embedding hashing words and their character trigrams into a fixed number of dimensions
+
+    Signed feature hashing is a sparse random projection of the bag of words, needing no model and no network.
+    Trigrams let inflected forms of a word ("parse", "parsing", "parsed") land close to each other.
+    """
+
+    name = "hashing"
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        return await asyncio.to_thread(self._embed, texts)
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word, count in Counter(tokenize(text)).items():
+                buckets, weights = _word_features(word, self.dim)
+                # Sublinear term frequency keeps repeated words from dominating
+                np.add.at(vectors[row], buckets, weights * (1 + math.log(count)))
+        return self.normalize(vectors)
+
+
+class GeminiEmbedding(EmbeddingBackend):
+    """Embedding through the Gemini batchEmbedContents API
+
+    Requests go through an LLMClient, with its timeouts, retries and circuit breaker. The API process sets
+    `llm_client` to the client it shares with chat; elsewhere every call opens a short-lived one.
+    """
+
+    name = "gemini"
+
+    # Largest number of texts accepted by one batchEmbedContents request
+    BATCH_SIZE = 100
+
+    # Gemini client shared by the process, set by the app for its lifetime
+    llm_client: Optional[LLMClient] = None
+
+    def __init__(self, dim: int, model: Optional[str] = None):
+        super().__init__(dim)
+        self.model = model or settings.EMBEDDING_MODEL
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}-{self.model}-{self.dim}"
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        if self.llm_client is None:
+            async with LLMClient() as llm:
+                return await self._embed(llm, texts)
+        return await self._embed(self.llm_client, texts)
+
+    async def _embed(self, llm: LLMClient, texts: List[str]) -> np.ndarray:
+        rows = []
+        for start in range(0, len(texts), self.BATCH_SIZE):
+            payload = {
+                "requests": [
+                    {
+                        "model": f"models/{self.model}",
+                        "content": {"parts": [{"text": text}]},
+                        "outputDimensionality": self.dim,
+                    }
+                    for text in texts[start : start + self.BATCH_SIZE]
+                ]
+            }
+            async with llm.request("POST", f"models/{self.model}:batchEmbedContents", payload) as response:
+                response.raise_for_status()
+                data = await response.json()
+            rows.extend(embedding["values"] for embedding in data["embeddings"])
+        return self.normalize(np.asarray(rows, dtype=np.float32).reshape(len(texts), self.dim))
+
+
+EMBEDDING_BACKENDS = {backend.name: backend for backend in (HashingEmbedding, GeminiEmbedding)}
+
+_instances: Dict[str, EmbeddingBackend] = {}
+
+
+def get_embedding_backend(name: Optional[str] = None) -> EmbeddingBackend:
+    """Get an embedding backend by name, defaulting to the configured EMBEDDING_BACKEND
+
+    Args:
+        name: Name of the backend (hashing or gemini)
+
+    Returns:
+        Shared backend instance
+    """
+    name = name or settings.EMBEDDING_BACKEND
+    if name not in _instances:
+        if name not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown embedding backend: {name}")
+        _instances[name] = EMBEDDING_BACKENDS[name](settings.EMBEDDING_DIM)
+    return _instances[name]
@@ -0,0 +1,267 @@
+import math
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import InsertOne
+from pymongo.errors import DuplicateKeyError
+
+from libs.logger import get_logger
+from libs.settings import settings
+from pdf_service.core.services.passage_index import tokenize
+from pdf_service.core.services.retrieval_service import RetrievalService
+
+# Number of term postings written to library_postings per bulk write
+POSTING_WRITE_BATCH_SIZE = 1000
+
+# Seconds after which a backfill queued but never finished is queued again
+BACKFILL_REQUEUE_SECONDS = 600
+
+
+class LibraryIndex:
+    """Per-user BM25 index merging the passages of every parsed document a user owns
+
+    Postings are stored one document per (user_id, term, document_id), so a query only reads the postings of
+    its own terms and adding or removing a document touches only that document's postings.
+    """
+
+    def __init__(self, mongodb):
+        """Initialize the library index
+
+        Args:
+            mongodb: MongoDB database connection
+        """
+        self.mongodb = mongodb
+        self.logger = get_logger("pdf_service.library")
+
+    async def add_document(self, user_id: int, document_id: str, content_hash: str, title: str) -> None:
+        """
+        Merge the passages of a parsed document into the library of its owner
+
+        Args:
+            user_id: ID of the user owning the document
+            document_id: ID of the PDF document
+            content_hash: SHA-256 of the PDF bytes
+            title: Title of the PDF document
+        """
+        documents = self.mongodb["library_documents"]
+        existing = await documents.find_one({"_id": document_id}, {"content_hash": 1})
+        if existing and existing["content_hash"] == content_hash:
+            return
+        if existing:
+            await self.remove_document(user_id, document_id)
+
+        index = await RetrievalService(self.mongodb).load_index(content_hash)
+        if index is None:
+            return
+
+        # Claim the document first, a concurrent add of the same document stops here
+        passage_count = index.passage_count
+        total_length = sum(index.lengths)
+        try:
+            await documents.insert_one(
+                {
+                    "_id": document_id,
+                    "user_id": user_id,
+                    "content_hash": content_hash,
+                    "title": title,
+                    "passage_count": passage_count,
+                    "total_length": total_length,
+                    "indexed_date": datetime.utcnow(),
+                }
+            )
+        except DuplicateKeyError:
+            return
+
+        postings = self.mongodb["library_postings"]
+        batch = []
+        for term, (start, end) in index.terms.items():
+            ids = index.ids[start:end]
+            batch.append(
+                InsertOne(
+                    {
+                        "user_id": user_id,
+                        "term": term,
+                        "document_id": document_id,
+                        "content_hash": content_hash,
+                        "passages": list(ids),
+                        "frequencies": list(index.frequencies[start:end]),
+                        "lengths": [index.lengths[passage_id] for passage_id in ids],
+                    }
+                )
+            )
+            if len(batch) >= POSTING_WRITE_BATCH_SIZE:
+                await postings.bulk_write(batch, ordered=False)
+                batch = []
+        if batch:
+            await postings.bulk_write(batch, ordered=False)
+
+        await self.mongodb["library_stats"].update_one(
+            {"_id": user_id},
+            {"$inc": {"document_count": 1, "passage_count": passage_count, "total_length": total_length}},
+            upsert=True,
+        )
+        self.logger.info("Document added to library index", user_id=user_id, document_id=document_id)
+
+    async def remove_document(self, user_id: int, document_id: str) -> None:
+        """
+        Remove a document from the library of its owner
+
+        Args:
+            user_id: ID of the user owning the document
+            document_id: ID of the PDF document
+        """
+        document = await self.mongodb["library_documents"].find_one_and_delete({"_id": document_id, "user_id": user_id})
+        if document is None:
+            return
+
+        await self.mongodb["library_postings"].delete_many({"user_id": user_id, "document_id": document_id})
+        await self.mongodb["library_stats"].update_one(
+            {"_id": user_id},
+            {
+                "$inc": {
+                    "document_count": -1,
+                    "passage_count": -document["passage_count"],
+                    "total_length": -document["total_length"],
+                }
+            },
+        )
+        self.logger.info("Document removed from library index", user_id=user_id, document_id=document_id)
+
+    async def search(
+        self, user_id: int, query: str, top_k: Optional[int] = None, token_budget: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Get the passages across a user's library that best match a query and fit a token budget
+
+        Args:
+            user_id: ID of the user
+            query: Question of the user
+            top_k: Maximum number of passages, defaults to CHAT_TOP_K
+            token_budget: Maximum estimated tokens of all passages, defaults to CHAT_CONTEXT_TOKENS
+
+        Returns:
+            Passages with their document ID, title, pages, text and score, best first
+        """
+        top_k = top_k or settings.CHAT_TOP_K
+        token_budget = token_budget or settings.CHAT_CONTEXT_TOKENS
+        started = time.perf_counter()
+
+        stats = await self.mongodb["library_stats"].find_one({"_id": user_id})
+        terms = list(set(tokenize(query)))
+        if not stats or not stats.get("passage_count") or not terms:
+            return []
+
+        passage_count = stats["passage_count"]
+        average_length = stats["total_length"] / passage_count or 1
+        k1, b = 1.2, 0.75
+
+        # Only the postings of the query terms are read, whatever the size of the library
+        term_postings: Dict[str, List[Dict[str, Any]]] = {}
+        cursor = self.mongodb["library_postings"].find(
+            {"user_id": user_id, "term": {"$in": terms}}, {"_id": 0, "user_id": 0}
+        )
+        async for posting in cursor:
+            term_postings.setdefault(posting["term"], []).append(posting)
+
+        scores: Dict[tuple, float] = {}
+        content_hashes: Dict[str, str] = {}
+        for term, postings in term_postings.items():
+            document_frequency = sum(len(posting["passages"]) for posting in postings)
+            idf = math.log(1 + (passage_count - document_frequency + 0.5) / (document_frequency + 0.5))
+            for posting in postings:
+                document_id = posting["document_id"]
+                content_hashes[document_id] = posting["content_hash"]
+                for passage_id, frequency, length in zip(
+                    posting["passages"], posting["frequencies"], posting["lengths"]
+                ):
+                    norm = k1 * (1 - b + b * length / average_length)
+                    key = (document_id, passage_id)
+                    scores[key] = scores.get(key, 0.0) + idf * frequency * (k1 + 1) / (frequency + norm)
+        search_ms = (time.perf_counter() - started) * 1000
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+        # Read the passages of each document, then spend the budget best first across documents
+        retrieval = RetrievalService(self.mongodb)
+        by_document: Dict[str, List] = {}
+        for (document_id, passage_id), score in ranked:
+            by_document.setdefault(document_id, []).append((passage_id, score))
+        candidates = []
+        for document_id, document_ranked in by_document.items():
+            passages, _ = await retrieval.fetch_passages(content_hashes[document_id], document_ranked, token_budget)
+            candidates.extend({**passage, "document_id": document_id} for passage in passages)
+
+        titles = {}
+        if candidates:
+            cursor = self.mongodb["library_documents"].find({"_id": {"$in": list(by_document)}}, {"title": 1})
+            titles = {document["_id"]: document.get("title") async for document in cursor}
+
+        selected = []
+        used_tokens = 0
+        for passage in sorted(candidates, key=lambda passage: passage["score"], reverse=True):
+            if used_tokens + passage["token_count"] > token_budget:
+                continue
+            used_tokens += passage["token_count"]
+            selected.append({**passage, "title": titles.get(passage["document_id"])})
+
+        self.logger.info(
+            "Library passages retrieved",
+            user_id=user_id,
+            documents=stats.get("document_count"),
+            passages=len(selected),
+            tokens=used_tokens,
+            search_ms=round(search_ms, 2),
+            total_ms=round((time.perf_counter() - started) * 1000, 2),
+        )
+        return selected
+
+    async def is_backfilled(self, user_id: int) -> bool:
+        """Whether the documents a user parsed before the library index existed were merged into it"""
+        stats = await self.mongodb["library_stats"].find_one({"_id": user_id}, {"backfilled": 1})
+        return bool(stats and stats.get("backfilled"))
+
+    async def claim_backfill(self, user_id: int) -> bool:
+        """
+        Record that the backfill of a user is being queued, unless it is done or was queued recently
+
+        Args:
+            user_id: ID of the user
+
+        Returns:
+            Whether the caller has to queue the backfill
+        """
+        now = datetime.utcnow()
+        try:
+            result = await self.mongodb["library_stats"].update_one(
+                {
+                    "_id": user_id,
+                    "backfilled": {"$ne": True},
+                    "$or": [
+                        {"backfill_queued": {"$exists": False}},
+                        {"backfill_queued": {"$lt": now - timedelta(seconds=BACKFILL_REQUEUE_SECONDS)}},
+                    ],
+                },
+                {"$set": {"backfill_queued": now}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # The user has stats that did not match: backfilled already, or queued recently
+            return False
+        return result.modified_count == 1 or result.upserted_id is not None
+
+    async def mark_backfilled(self, user_id: int) -> None:
+        """Record that the library of a user holds all of their parsed documents"""
+        await self.mongodb["library_stats"].update_one({"_id": user_id}, {"$set": {"backfilled": True}}, upsert=True)
+
+    @staticmethod
+    async def ensure_indexes(mongodb) -> None:
+        """
+        Create the MongoDB indexes used by the library index
+
+        Args:
+            mongodb: MongoDB database connection
+        """
+        await mongodb["library_postings"].create_index([("user_id", 1), ("term", 1)])
+        await mongodb["library_postings"].create_index([("user_id", 1), ("document_id", 1)])
+        await mongodb["library_documents"].create_index([("user_id", 1)])
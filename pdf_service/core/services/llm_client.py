@@ -0,0 +1,255 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Dict, Optional
+
+import aiohttp
+
+from libs.exceptions.errors import ErrorCode
+from libs.exceptions.schemas import ExceptionBase
+from libs.logger import get_logger
+from libs.settings import settings
+
+# Statuses of Gemini API worth retrying: rate limited, overloaded or briefly down
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitBreaker:
+    """Stop calling a failing dependency for a while instead of making every caller wait for its timeouts
+
+    After `failure_threshold` consecutive failures the circuit opens and calls fail fast. Once `reset_timeout`
+    seconds have passed, a single trial call is let through: its success closes the circuit, its failure
+    opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_count = 0
+        self._trial_running = False
+
+    def allow(self) -> bool:
+        """Whether a call may be made now"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_running = False
+
+    def release_trial(self) -> None:
+        """End a trial call that got no answer, cancelled for instance, so that the next call is tried instead"""
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_running = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.open_count += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class LLMClient:
+    """HTTP client of Gemini API shared by all requests of a process
+
+    One connection pool is kept alive for the lifetime of the app, so requests skip DNS, TCP and TLS setup.
+    Requests get connect and read timeouts, are retried with jittered exponential backoff on connection
+    errors and on retryable statuses (honoring Retry-After), and fail fast while the circuit breaker is open.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, api_key: Optional[str] = None):
+        """Initialize the client, the connection pool is created on first use
+
+        Args:
+            base_url: Gemini API URL, defaults to GEMINI_API_URL
+            api_key: Gemini API key, defaults to GEMINI_API_KEY
+        """
+        self.base_url = base_url or settings.GEMINI_API_URL
+        self.api_key = api_key or settings.GEMINI_API_KEY
+        self.breaker = CircuitBreaker(settings.GEMINI_BREAKER_FAILURES, settings.GEMINI_BREAKER_RESET_SECONDS)
+        self.logger = get_logger("pdf_service.llm_client")
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._counters = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "rejected": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+        }
+        self._in_flight = 0
+        self._max_in_flight = 0
+
+    async def start(self) -> None:
+        """Create the connection pool"""
+        if self._session is not None and not self._session.closed:
+            return
+
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(self._count("connections_created"))
+        trace.on_connection_reuseconn.append(self._count("connections_reused"))
+        connector = aiohttp.TCPConnector(
+            limit=settings.GEMINI_POOL_SIZE,
+            ttl_dns_cache=300,
+            keepalive_timeout=settings.GEMINI_KEEPALIVE_SECONDS,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=settings.GEMINI_TOTAL_TIMEOUT,
+                connect=settings.GEMINI_CONNECT_TIMEOUT,
+                sock_read=settings.GEMINI_READ_TIMEOUT,
+            ),
+            headers={"x-goog-api-key": self.api_key},
+            trace_configs=[trace],
+        )
+
+    async def close(self) -> None:
+        """Close the connection pool"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> "LLMClient":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    @asynccontextmanager
+    async def request(
+        self, method: str, path: str, payload: Optional[Dict[str, Any]] = None, stream: bool = False
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        Send a request to Gemini API, retrying until it gets an answer worth handing to the caller
+
+        Args:
+            method: HTTP method
+            path: Path relative to GEMINI_API_URL, with its query string
+            payload: JSON body
+            stream: Whether the body is read as a stream, which lifts the total timeout
+
+        Yields:
+            The response, whose status the caller checks; after all retries it may still be a retryable status
+
+        Raises:
+            ExceptionBase: If the circuit is open, or the connection kept failing or timing out
+        """
+        await self.start()
+        url = f"{self.base_url}/{path}"
+        options = {"json": payload}
+        if stream:
+            # A stream lasts as long as the generation, only the wait for each chunk is bounded
+            options["timeout"] = aiohttp.ClientTimeout(
+                total=None, connect=settings.GEMINI_CONNECT_TIMEOUT, sock_read=settings.GEMINI_READ_TIMEOUT
+            )
+        self._counters["requests"] += 1
+        self._in_flight += 1
+        self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        try:
+            response = await self._send(method, url, path.split("?")[0], options)
+            try:
+                yield response
+            finally:
+                response.release()
+        finally:
+            self._in_flight -= 1
+
+    async def _send(self, method: str, url: str, endpoint: str, options: Dict[str, Any]) -> aiohttp.ClientResponse:
+        """Send a request until it gets an answer worth handing to the caller, see `request`"""
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._counters["rejected"] += 1
+                self.logger.warning("Gemini circuit open, failing fast", path=endpoint)
+                raise ExceptionBase(ErrorCode.SERVICE_UNAVAILABLE)
+
+            delay = None
+            try:
+                response = await self._session.request(method, url, **options)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._record_failure()
+                if attempt >= settings.GEMINI_MAX_RETRIES:
+                    self.logger.error("Gemini request failed", path=endpoint, error=repr(e))
+                    timed_out = isinstance(e, asyncio.TimeoutError)
+                    raise ExceptionBase(ErrorCode.TIMEOUT if timed_out else ErrorCode.SERVICE_UNAVAILABLE)
+            except BaseException:
+                # Cancelled before Gemini answered, a trial call would otherwise keep the circuit half open
+                self.breaker.release_trial()
+                raise
+            else:
+                if response.status not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return response
+                self._record_failure()
+                delay = self._retry_after(response)
+                if attempt >= settings.GEMINI_MAX_RETRIES or (delay or 0) > settings.GEMINI_RETRY_MAX_DELAY:
+                    # Out of retries or asked to wait too long, let the caller report the status
+                    return response
+                response.release()
+
+            if delay is None:
+                # Full jitter keeps clients that failed together from retrying together
+                delay = random.uniform(
+                    0, min(settings.GEMINI_RETRY_MAX_DELAY, settings.GEMINI_RETRY_BASE_DELAY * 2**attempt)
+                )
+            attempt += 1
+            self._counters["retries"] += 1
+            self.logger.info("Retrying Gemini request", path=endpoint, attempt=attempt, delay=round(delay, 2))
+            await asyncio.sleep(delay)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Counters of requests, retries and connections, and the state of the pool and circuit breaker"""
+        return {
+            **self._counters,
+            "in_flight": self._in_flight,
+            "max_in_flight": self._max_in_flight,
+            "pool_size": settings.GEMINI_POOL_SIZE,
+            "circuit_state": self.breaker.state,
+            "circuit_opened": self.breaker.open_count,
+        }
+
+    def _record_failure(self) -> None:
+        self._counters["failures"] += 1
+        self.breaker.record_failure()
+
+    def _count(self, counter: str):
+        async def on_event(session, context, params) -> None:
+            self._counters[counter] += 1
+
+        return on_event
+
+    @staticmethod
+    def _retry_after(response: aiohttp.ClientResponse) -> Optional[float]:
+        """Seconds to wait asked by a Retry-After header, in seconds or as an HTTP date"""
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
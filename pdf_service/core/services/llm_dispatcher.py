@@ -0,0 +1,116 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple, TypeVar
+
+from libs.exceptions.errors import ErrorCode
+from libs.exceptions.schemas import ExceptionBase
+from libs.logger import get_logger
+from libs.settings import settings
+
+T = TypeVar("T")
+
+
+class LLMDispatcher:
+    """Queue of Gemini calls sent with bounded concurrency, shared by all requests of a process
+
+    At most GEMINI_DISPATCH_CONCURRENCY calls are sent to Gemini at once. The others wait in the queue, in
+    arrival order, until a call being sent finishes, so a burst is served at the rate Gemini answers instead
+    of piling up requests that all time out. A call arriving while a slot is free is sent at once. Each caller
+    awaits the result of its own call.
+    """
+
+    def __init__(self, concurrency: Optional[int] = None):
+        """Initialize the dispatcher, calls are made directly until it is started
+
+        Args:
+            concurrency: Calls sent to Gemini at once, defaults to GEMINI_DISPATCH_CONCURRENCY
+        """
+        self.concurrency = concurrency or settings.GEMINI_DISPATCH_CONCURRENCY
+        self.logger = get_logger("pdf_service.llm_dispatcher")
+        self._queue: Optional["asyncio.Queue[Tuple[Callable[[], Awaitable[Any]], asyncio.Future]]"] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._calls: Set[asyncio.Task] = set()
+        self._counters = {"dispatched": 0, "sending": 0, "max_queued": 0}
+
+    async def start(self) -> None:
+        """Start dispatching calls"""
+        if self._runner is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._runner = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop dispatching, fail the calls still queued and wait for the calls being sent"""
+        if self._runner is None:
+            return
+        self._runner.cancel()
+        try:
+            await self._runner
+        except asyncio.CancelledError:
+            pass
+        self._runner = None
+
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(ExceptionBase(ErrorCode.SERVICE_UNAVAILABLE))
+        if self._calls:
+            await asyncio.gather(*self._calls, return_exceptions=True)
+
+    async def submit(self, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Queue a call to Gemini and wait for its result
+
+        Args:
+            call: Sends the request to Gemini and returns the result
+
+        Returns:
+            Result of the call
+        """
+        if self._runner is None:
+            return await call()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((call, future))
+        self._counters["max_queued"] = max(self._counters["max_queued"], self._queue.qsize())
+        return await future
+
+    def metrics(self) -> Dict[str, Any]:
+        """Counters of the dispatched calls, and the calls sent and waiting for a slot now"""
+        return {
+            **self._counters,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "concurrency": self.concurrency,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            # Calls stay queued until a slot is free, so the queue shows how far behind Gemini the process is
+            await self._semaphore.acquire()
+            try:
+                call, future = await self._queue.get()
+            except asyncio.CancelledError:
+                self._semaphore.release()
+                raise
+            if future.done():
+                # The caller went away while the call was queued
+                self._semaphore.release()
+                continue
+            task = asyncio.create_task(self._send(call, future))
+            self._calls.add(task)
+            task.add_done_callback(self._calls.discard)
+
+    async def _send(self, call: Callable[[], Awaitable[Any]], future: asyncio.Future) -> None:
+        self._counters["dispatched"] += 1
+        self._counters["sending"] += 1
+        try:
+            result = await call()
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self._counters["sending"] -= 1
+            self._semaphore.release()
@@ -0,0 +1,225 @@
+import heapq
+import json
+import math
+import re
+from array import array
+from collections import Counter
+from typing import Dict, List, Tuple
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# Words too common to tell passages apart
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in into is it its me my no not of on or our "
+    "she so than that the their them then there these they this to was we were what when where which who why "
+    "will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase index terms, dropping stopwords and single characters"""
+    return [term for term in TOKEN_PATTERN.findall(text.lower()) if len(term) > 1 and term not in STOPWORDS]
+
+
+class PassageBuilder:
+    """Cut a stream of pages into overlapping passages of words that remember their pages"""
+
+    def __init__(self, size: int, overlap: int):
+        """Initialize the builder
+
+        Args:
+            size: Number of words per passage
+            overlap: Number of words shared by consecutive passages
+        """
+        self.size = max(1, size)
+        self.overlap = min(max(0, overlap), self.size - 1)
+        self._words: List[Tuple[str, int]] = []
+        self._fresh = 0
+        self._count = 0
+
+    def add_page(self, page: int, text: str) -> List[Dict]:
+        """Add the text of the next page
+
+        Args:
+            page: Page number, 1-based
+            text: Text of the page
+
+        Returns:
+            Passages completed by this page
+        """
+        words = text.split()
+        self._words.extend((word, page) for word in words)
+        self._fresh += len(words)
+
+        passages = []
+        while len(self._words) >= self.size:
+            passages.append(self._emit(self.size))
+            self._words = self._words[self.size - self.overlap :]
+            self._fresh = len(self._words) - self.overlap
+        return passages
+
+    def finish(self) -> List[Dict]:
+        """Flush the words left after the last page
+
+        Returns:
+            The last passage, if any words were not emitted yet
+        """
+        passages = [self._emit(len(self._words))] if self._fresh > 0 else []
+        self._words, self._fresh = [], 0
+        return passages
+
+    def _emit(self, length: int) -> Dict:
+        words = self._words[:length]
+        passage = {
+            "passage": self._count,
+            "page_start": words[0][1],
+            "page_end": words[-1][1],
+            "text": " ".join(word for word, _ in words),
+        }
+        self._count += 1
+        return passage
+
+
+class BM25IndexBuilder:
+    """Collect the postings of the passages of one document"""
+
+    def __init__(self):
+        self.postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self.lengths: List[int] = []
+
+    def add(self, passage_id: int, terms: List[str]) -> None:
+        """Index the terms of the next passage, passage IDs must be consecutive from 0"""
+        self.lengths.append(len(terms))
+        for term, frequency in Counter(terms).items():
+            ids, frequencies = self.postings.setdefault(term, ([], []))
+            ids.append(passage_id)
+            frequencies.append(frequency)
+
+    def build(self) -> "BM25Index":
+        """Pack the postings into a searchable index"""
+        terms = {}
+        ids = array("I")
+        frequencies = array("H")
+        for term, (term_ids, term_frequencies) in self.postings.items():
+            terms[term] = (len(ids), len(ids) + len(term_ids))
+            ids.extend(term_ids)
+            frequencies.extend(term_frequencies)
+        return BM25Index(terms, ids, frequencies, array("H", self.lengths))
+
+
+class BM25Index:
+    """Okapi BM25 inverted index over the passages of one document
+
+    Postings of all terms are packed in two flat arrays, so the index loads from bytes without building
+    a Python object per posting.
+    """
+
+    def __init__(
+        self,
+        terms: Dict[str, Tuple[int, int]],
+        ids: array,
+        frequencies: array,
+        lengths: array,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ):
+        """Initialize the index
+
+        Args:
+            terms: Slice of the posting arrays of each term
+            ids: Passage IDs of the postings
+            frequencies: Term frequencies of the postings
+            lengths: Number of terms of each passage
+            k1: Term frequency saturation
+            b: Passage length normalization
+        """
+        self.terms = terms
+        self.ids = ids
+        self.frequencies = frequencies
+        self.lengths = lengths
+        self.k1 = k1
+        self.b = b
+
+        # Length normalization of each passage, computed once instead of per posting
+        average_length = (sum(lengths) / len(lengths) if lengths else 0) or 1
+        self._norms = [k1 * (1 - b + b * length / average_length) for length in lengths]
+
+    @property
+    def passage_count(self) -> int:
+        return len(self.lengths)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        """Rank passages against a query
+
+        Args:
+            query: Free text query
+            top_k: Maximum number of passages to return
+
+        Returns:
+            Passage IDs and scores, best first
+        """
+        passage_count = self.passage_count
+        norms = self._norms
+        boost = self.k1 + 1
+
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            if term not in self.terms:
+                continue
+            start, end = self.terms[term]
+            idf = math.log(1 + (passage_count - (end - start) + 0.5) / (end - start + 0.5))
+            for passage_id, frequency in zip(self.ids[start:end], self.frequencies[start:end]):
+                scores[passage_id] = scores.get(passage_id, 0.0) + idf * frequency * boost / (
+                    frequency + norms[passage_id]
+                )
+
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def to_bytes(self) -> bytes:
+        """Serialize the index"""
+        header = json.dumps(
+            {
+                "k1": self.k1,
+                "b": self.b,
+                "terms": list(self.terms),
+                "postings": len(self.ids),
+                "passages": self.passage_count,
+            },
+            separators=(",", ":"),
+        ).encode("utf-8")
+        offsets = array("I", (start for start, _ in self.terms.values()))
+        return b"".join(
+            [
+                len(header).to_bytes(4, "little"),
+                header,
+                offsets.tobytes(),
+                self.ids.tobytes(),
+                self.frequencies.tobytes(),
+                self.lengths.tobytes(),
+            ]
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BM25Index":
+        """Deserialize an index written by to_bytes"""
+        view = memoryview(data)
+        header_size = int.from_bytes(view[:4], "little")
+        header = json.loads(bytes(view[4 : 4 + header_size]))
+        position = 4 + header_size
+
+        def read(typecode: str, count: int) -> array:
+            nonlocal position
+            values = array(typecode)
+            size = count * values.itemsize
+            values.frombytes(view[position : position + size])
+            position += size
+            return values
+
+        offsets = read("I", len(header["terms"]))
+        ids = read("I", header["postings"])
+        frequencies = read("H", header["postings"])
+        lengths = read("H", header["passages"])
+
+        ends = list(offsets[1:]) + [header["postings"]]
+        terms = {term: (start, end) for term, start, end in zip(header["terms"], offsets, ends)}
+        return cls(terms, ids, frequencies, lengths, header["k1"], header["b"])
@@ -0,0 +1,192 @@
+import asyncio
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterator, BinaryIO, Dict, List, Optional, Tuple
+
+import PyPDF2
+from PyPDF2 import PasswordType
+
+from libs.logger import get_logger
+from libs.settings import settings
+
+
+def _count_pages(path: str) -> int:
+    """Read the page count of a PDF file (runs in a worker process)"""
+    # Given an open file, the reader seeks to the objects it needs instead of loading the whole file
+    with open(path, "rb") as stream:
+        return len(PyPDF2.PdfReader(stream).pages)
+
+
+def _extract_page_range(path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end) of a PDF file (runs in a worker process)
+
+    Pages that fail to extract yield an empty string so one bad page does not fail the document.
+    """
+    texts = []
+    with open(path, "rb") as stream:
+        reader = PyPDF2.PdfReader(stream)
+        for page_num in range(start, end):
+            try:
+                texts.append(reader.pages[page_num].extract_text() or "")
+            except Exception:
+                texts.append("")
+    return texts
+
+
+def inspect_pdf(stream: BinaryIO, sample_pages: int = 3) -> Dict[str, Any]:
+    """Read the structure of a PDF without extracting any text
+
+    Only the trailer, the cross-reference table, the catalog and the resources of the first pages are
+    read, so this stays cheap whatever the size of the document.
+
+    Args:
+        stream: Seekable binary stream of the PDF file
+        sample_pages: Number of leading pages checked for fonts
+
+    Returns:
+        page_count, pdf_version, encrypted, decryptable and has_text_layer of the document,
+        page_count and has_text_layer are None when the file cannot be decrypted
+
+    Raises:
+        PyPDF2.errors.PdfReadError: If the file is not a readable PDF
+    """
+    reader = PyPDF2.PdfReader(stream)
+    encrypted = reader.is_encrypted
+    decryptable = not encrypted
+    if encrypted:
+        # Many PDFs are encrypted only to carry permissions and open with an empty password
+        try:
+            decryptable = reader.decrypt("") != PasswordType.NOT_DECRYPTED
+        except Exception:
+            decryptable = False
+
+    info = {
+        "page_count": None,
+        "pdf_version": (reader.pdf_header or "").removeprefix("%PDF-") or None,
+        "encrypted": encrypted,
+        "decryptable": decryptable,
+        "has_text_layer": None,
+    }
+    if not decryptable:
+        # Objects of a password protected file cannot be read
+        return info
+
+    info["page_count"] = int(reader.trailer["/Root"]["/Pages"]["/Count"])
+
+    # Text can only be extracted when some page uses fonts, scanned documents have none
+    info["has_text_layer"] = False
+    for page in reader.pages[:sample_pages]:
+        resources = page.get("/Resources")
+        if resources is not None and "/Font" in resources.get_object():
+            info["has_text_layer"] = True
+            break
+    return info
+
+
+class PDFExtractor:
+    """Page-parallel PDF text extraction on a bounded, shared process pool"""
+
+    _executor: Optional[ProcessPoolExecutor] = None
+    _pool_unavailable: bool = False
+
+    def __init__(self, max_workers: Optional[int] = None, pages_per_task: Optional[int] = None):
+        """Initialize the extractor
+
+        Args:
+            max_workers: Size of the process pool, 0 extracts in a thread of the current process
+            pages_per_task: Number of pages extracted by a single pool task
+        """
+        self.max_workers = settings.PDF_EXTRACT_WORKERS if max_workers is None else max_workers
+        self.pages_per_task = max(1, pages_per_task or settings.PDF_EXTRACT_PAGES_PER_TASK)
+        self.logger = get_logger("pdf_service.extractor")
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        """Get the shared process pool, creating it on first use"""
+        if self.max_workers <= 0 or PDFExtractor._pool_unavailable:
+            return None
+        if PDFExtractor._executor is None:
+            # Spawned workers do not inherit the event loop or driver threads of the API process
+            PDFExtractor._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            self.logger.info("PDF extraction pool started", max_workers=self.max_workers)
+        return PDFExtractor._executor
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """Shut down the shared process pool"""
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=False, cancel_futures=True)
+            cls._executor = None
+
+    def page_ranges(self, page_count: int) -> List[Tuple[int, int]]:
+        """Split a document into [start, end) page ranges of at most pages_per_task pages"""
+        return [
+            (start, min(start + self.pages_per_task, page_count)) for start in range(0, page_count, self.pages_per_task)
+        ]
+
+    async def iter_pages(self, path: str) -> AsyncIterator[Tuple[int, str]]:
+        """Lazily extract the pages of a PDF file without blocking the event loop
+
+        Page ranges are extracted in parallel with a bounded number in flight and yielded in page order,
+        so the first pages are available before the whole document is parsed.
+
+        Args:
+            path: Path of the PDF file on local disk
+
+        Yields:
+            Page number (1-based) and text of each page
+        """
+        executor = self._get_executor()
+        if executor is not None:
+            yielded = False
+            try:
+                async for page in self._iter_pages_in_pool(executor, path):
+                    yielded = True
+                    yield page
+                return
+            except AssertionError as e:
+                if yielded:
+                    raise
+                # Daemonic processes (e.g. prefork Celery children) are not allowed to start a pool, the parse
+                # queue is consumed by a solo worker for that reason
+                self.logger.warning(
+                    "PDF extraction pool unavailable, pages are extracted one range at a time in this process",
+                    error=str(e),
+                    impact="no page parallelism, run the worker consuming the parse queue with --pool=solo",
+                )
+                self.shutdown()
+                PDFExtractor._pool_unavailable = True
+
+        page_count = await asyncio.to_thread(_count_pages, path)
+        for start, end in self.page_ranges(page_count):
+            texts = await asyncio.to_thread(_extract_page_range, path, start, end)
+            for offset, text in enumerate(texts):
+                yield start + offset + 1, text
+
+    async def _iter_pages_in_pool(self, executor: ProcessPoolExecutor, path: str) -> AsyncIterator[Tuple[int, str]]:
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        try:
+            page_count = await loop.run_in_executor(executor, _count_pages, path)
+            ranges = deque(self.page_ranges(page_count))
+            window = self.max_workers + 1
+
+            while ranges or pending:
+                # Keep every worker busy while holding at most a window of extracted ranges
+                while ranges and len(pending) < window:
+                    start, end = ranges.popleft()
+                    pending.append((start, loop.run_in_executor(executor, _extract_page_range, path, start, end)))
+
+                start, future = pending.popleft()
+                for offset, text in enumerate(await future):
+                    yield start + offset + 1, text
+        except BrokenProcessPool:
+            # A crashed worker poisons the pool, start a fresh one for the next document
+            self.shutdown()
+            raise
+        finally:
+            for _, future in pending:
+                future.cancel()
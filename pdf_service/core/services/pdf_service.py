@@ -1,19 +1,45 @@
-import io
+import asyncio
+import hashlib
+import tempfile
 from datetime import datetime
-from typing import List, Dict, Any
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Tuple
 
 from bson import ObjectId
-import PyPDF2
+from celery import group
 from fastapi import UploadFile
-from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket, AsyncIOMotorGridOut
+from pymongo import ReplaceOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from libs.db.mongodb import get_async_mongodb
 from libs.logger import get_logger
-from pdf_service.api.v1.pdf.pdf_schemas import PDFUploadMetadata, PDFMetadataResponse
+from libs.settings import settings
+from pdf_service.api.v1.pdf.pdf_schemas import (
+    PDFUploadMetadata,
+    PDFMetadataResponse,
+    PDFBatchUploadItem,
+    PDFBatchUploadResponse,
+    PDFParseStatusResponse,
+    PDFPageText,
+    PDFTextResponse,
+    ParseStatus,
+)
+from pdf_service.core.services.pdf_extractor import PDFExtractor, inspect_pdf
+from pdf_service.core.services.answer_cache import AnswerCache, SemanticAnswerCache
+from pdf_service.core.services.context_cache import GeminiContextCache
+from pdf_service.core.services.conversation_memory import ConversationMemory
+from pdf_service.core.services.library_index import LibraryIndex
+from pdf_service.core.services.retrieval_service import PassageIndexer, RetrievalService
+from pdf_service.core.services.text_codec import decode_content, get_codec
+from pdf_service.core.worker.tasks import backfill_library_task, parse_pdf_task
 from libs.exceptions.schemas import ExceptionBase
 from libs.exceptions.errors import ErrorCode
 
+# Number of pages written to pdf_texts per insert_many
+PAGE_WRITE_BATCH_SIZE = 500
+
 
 class PDFService:
     """Service for managing PDF documents with MongoDB GridFS"""
@@ -57,10 +83,119 @@ class PDFService:
         # Create GridFS bucket
         fs = AsyncIOMotorGridFSBucket(mongodb)
 
-        # Read file content
-        content = await file.read()
-        file_size = len(content)
-        self.logger.debug("Read file content", actual_file_size=file_size)
+        pdf_metadata = await self._store_upload(mongodb, fs, file, metadata, user_id)
+
+        # Insert metadata into the pdf_metadata collection
+        metadata_collection = mongodb["pdf_metadata"]
+        try:
+            result = await metadata_collection.insert_one(pdf_metadata)
+        except Exception as e:
+            self.logger.error("Failed to insert PDF metadata", filename=metadata.filename, error=str(e))
+            # Give back the reference taken on the stored content
+            await self._release_blob(mongodb, fs, pdf_metadata)
+            raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
+
+        # Get the inserted metadata document
+        inserted_metadata = await metadata_collection.find_one({"_id": result.inserted_id})
+
+        # Convert ObjectId to string for response
+        inserted_metadata["id"] = str(inserted_metadata.pop("_id"))
+
+        # Hand text extraction over to the PDF worker
+        if inserted_metadata["parsed"] == ParseStatus.PENDING.value:
+            self.enqueue_parse(inserted_metadata["id"], user_id)
+        else:
+            await self._add_to_library(mongodb, inserted_metadata["id"], inserted_metadata)
+
+        return PDFMetadataResponse(**inserted_metadata)
+
+    async def upload_pdfs_batch(
+        self, uploads: List[Tuple[UploadFile, PDFUploadMetadata]], user_id: int
+    ) -> PDFBatchUploadResponse:
+        """
+        Upload many PDF files to GridFS concurrently, allowing individual files to fail
+
+        Args:
+            uploads: The uploaded PDF files with their metadata
+            user_id: ID of the user uploading the files
+
+        Returns:
+            Per-file results in upload order
+        """
+        self.logger.info("Uploading PDF batch to GridFS", file_count=len(uploads), user_id=user_id)
+
+        # Get MongoDB connection (can't use 'or' operator with MongoDB objects)
+        mongodb = self.mongodb if self.mongodb is not None else await get_async_mongodb()
+        fs = AsyncIOMotorGridFSBucket(mongodb)
+
+        # Bound the number of files streamed into GridFS at once
+        semaphore = asyncio.Semaphore(max(1, settings.PDF_BATCH_UPLOAD_CONCURRENCY))
+
+        async def store(file: UploadFile, metadata: PDFUploadMetadata) -> Dict[str, Any]:
+            async with semaphore:
+                return await self._store_upload(mongodb, fs, file, metadata, user_id)
+
+        stored = await asyncio.gather(*(store(file, metadata) for file, metadata in uploads), return_exceptions=True)
+
+        # One round trip for the metadata of every stored file
+        documents = [document for document in stored if not isinstance(document, BaseException)]
+        if documents:
+            try:
+                await mongodb["pdf_metadata"].insert_many(documents)
+            except Exception as e:
+                self.logger.error("Failed to insert PDF batch metadata", error=str(e))
+                # Give back the references taken on the stored content
+                for document in documents:
+                    await self._release_blob(mongodb, fs, document)
+                raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
+
+        results = []
+        to_parse = []
+        for (file, metadata), document in zip(uploads, stored):
+            if isinstance(document, BaseException):
+                if not isinstance(document, ExceptionBase):
+                    self.logger.error("Failed to upload PDF in batch", filename=metadata.filename, error=str(document))
+                    document = ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
+                results.append(PDFBatchUploadItem(filename=metadata.filename, error=document.message))
+                continue
+
+            # insert_many sets the _id of each inserted document in place
+            document["id"] = str(document.pop("_id"))
+            if document["parsed"] == ParseStatus.PENDING.value:
+                to_parse.append(document["id"])
+            else:
+                await self._add_to_library(mongodb, document["id"], document)
+            results.append(PDFBatchUploadItem(filename=metadata.filename, document=PDFMetadataResponse(**document)))
+
+        # Hand text extraction for the whole batch over to the PDF worker at once
+        self.enqueue_parses(to_parse, user_id)
+
+        uploaded = len(documents)
+        self.logger.info("PDF batch uploaded", uploaded=uploaded, failed=len(uploads) - uploaded, user_id=user_id)
+        return PDFBatchUploadResponse(uploaded=uploaded, failed=len(uploads) - uploaded, results=results)
+
+    async def _store_upload(
+        self, mongodb, fs, file: UploadFile, metadata: PDFUploadMetadata, user_id: int
+    ) -> Dict[str, Any]:
+        """
+        Stream one uploaded file into GridFS and build its pdf_metadata document
+
+        Args:
+            mongodb: MongoDB database connection
+            fs: GridFS bucket
+            file: The uploaded PDF file
+            metadata: Metadata for the PDF file
+            user_id: ID of the user uploading the file
+
+        Returns:
+            The pdf_metadata document, not inserted yet
+        """
+        # Reject early when the client already told us the upload is too large
+        if file.size is not None and file.size > settings.PDF_MAX_UPLOAD_SIZE:
+            raise ExceptionBase(ErrorCode.PAYLOAD_TOO_LARGE)
+
+        # Read the PDF structure before storing anything, so broken files are rejected right away
+        inspection = await self._inspect_upload(file, metadata.filename)
 
         # Prepare file metadata
         file_metadata = {
@@ -75,43 +210,295 @@ class PDFService:
             },
         }
 
+        # Stream the upload into GridFS chunk by chunk so memory stays constant
+        chunk_size = settings.PDF_UPLOAD_CHUNK_SIZE
+        grid_in = fs.open_upload_stream(metadata.filename, chunk_size_bytes=chunk_size, metadata=file_metadata)
+        content_hash = hashlib.sha256()
+        file_size = 0
+
         try:
-            # Upload file to GridFS
-            grid_id = await fs.upload_from_stream(
-                filename=metadata.filename,
-                source=io.BytesIO(content),
-                metadata=file_metadata,
+            while chunk := await file.read(chunk_size):
+                file_size += len(chunk)
+                if file_size > settings.PDF_MAX_UPLOAD_SIZE:
+                    self.logger.warning(
+                        "PDF upload exceeds size limit",
+                        filename=metadata.filename,
+                        max_size=settings.PDF_MAX_UPLOAD_SIZE,
+                    )
+                    await grid_in.abort()
+                    raise ExceptionBase(ErrorCode.PAYLOAD_TOO_LARGE)
+
+                content_hash.update(chunk)
+                await grid_in.write(chunk)
+
+            await grid_in.close()
+            self.logger.debug("File uploaded to GridFS", grid_id=str(grid_in._id), file_size=file_size)
+        except ExceptionBase:
+            raise
+        except Exception as e:
+            self.logger.error("Failed to upload file to GridFS", error=str(e))
+            await grid_in.abort()
+            raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
+
+        # Share one GridFS file between identical uploads
+        blob = await self._register_blob(mongodb, fs, content_hash.hexdigest(), grid_in._id, file_size)
+
+        pdf_metadata = {
+            "grid_fs_id": blob["grid_fs_id"],
+            "filename": metadata.filename,
+            "title": metadata.title,
+            "description": metadata.description,
+            "user_id": user_id,
+            "file_size": file_size,
+            "content_hash": blob["_id"],
+            "upload_date": datetime.utcnow(),
+            "parsed": ParseStatus.PENDING.value,
+            "text_content": None,
+            "content_type": metadata.content_type,
+            "page_count": inspection["page_count"],
+            "pdf_version": inspection["pdf_version"],
+            "encrypted": inspection["encrypted"],
+            "has_text_layer": inspection["has_text_layer"],
+        }
+
+        # Identical bytes were parsed before, reuse the cached text
+        if blob.get("parsed_date") is not None:
+            pdf_metadata.update(
+                {
+                    "parsed": ParseStatus.DONE.value,
+                    "page_count": blob["page_count"],
+                    "char_count": blob["char_count"],
+                    "parsed_date": blob["parsed_date"],
+                }
             )
-            self.logger.debug("File uploaded to GridFS", grid_id=str(grid_id))
 
-            # Create metadata document in the PDF metadata collection
-            pdf_metadata = {
+        return pdf_metadata
+
+    async def _inspect_upload(self, file: UploadFile, filename: str) -> Dict[str, Any]:
+        """
+        Inspect the structure of an uploaded PDF, rejecting files the parser cannot process
+
+        Args:
+            file: The uploaded PDF file
+            filename: Original filename, for logging
+
+        Returns:
+            Page count, PDF version, encryption and text layer of the file
+
+        Raises:
+            ExceptionBase: If the file is not a readable PDF or needs a password
+        """
+        await file.seek(0)
+        try:
+            inspection = await asyncio.to_thread(inspect_pdf, file.file)
+        except Exception as e:
+            self.logger.warning("Rejected invalid PDF upload", filename=filename, error=str(e))
+            raise ExceptionBase(ErrorCode.DOCUMENT_INVALID)
+        finally:
+            await file.seek(0)
+
+        if not inspection["decryptable"]:
+            self.logger.warning("Rejected password protected PDF upload", filename=filename)
+            raise ExceptionBase(ErrorCode.DOCUMENT_ENCRYPTED)
+
+        self.logger.debug("PDF upload inspected", filename=filename, **inspection)
+        return inspection
+
+    async def _register_blob(self, mongodb, fs, content_hash: str, grid_id: ObjectId, file_size: int) -> Dict[str, Any]:
+        """
+        Reference a GridFS file by content hash, reusing an identical file when one exists
+
+        Args:
+            mongodb: MongoDB database connection
+            fs: GridFS bucket
+            content_hash: SHA-256 of the uploaded bytes
+            grid_id: ID of the freshly uploaded GridFS file
+            file_size: Size of the file in bytes
+
+        Returns:
+            The pdf_blobs document now referencing the content
+        """
+        blobs = mongodb["pdf_blobs"]
+        for _ in range(2):
+            blob = await blobs.find_one_and_update(
+                {"_id": content_hash}, {"$inc": {"ref_count": 1}}, return_document=ReturnDocument.AFTER
+            )
+            if blob:
+                # Identical content is already stored, drop the duplicate upload
+                await fs.delete(grid_id)
+                self.logger.info("Deduplicated PDF upload", content_hash=content_hash, ref_count=blob["ref_count"])
+                return blob
+
+            blob = {
+                "_id": content_hash,
                 "grid_fs_id": grid_id,
-                "filename": metadata.filename,
-                "title": metadata.title,
-                "description": metadata.description,
-                "user_id": user_id,
+                "ref_count": 1,
                 "file_size": file_size,
-                "upload_date": datetime.utcnow(),
-                "parsed": False,
-                "text_content": None,
-                "content_type": metadata.content_type,
+                "created_date": datetime.utcnow(),
             }
+            try:
+                await blobs.insert_one(blob)
+                return blob
+            except DuplicateKeyError:
+                # A concurrent upload of the same bytes registered first, reference it instead
+                continue
+
+        # Neither referenced nor registered, nothing else will clean up the upload
+        await fs.delete(grid_id)
+        raise ExceptionBase(ErrorCode.CONFLICT)
+
+    async def _release_blob(self, mongodb, fs, document: Dict[str, Any]) -> None:
+        """
+        Drop one reference to the content of a document, deleting it with the last reference
+
+        Args:
+            mongodb: MongoDB database connection
+            fs: GridFS bucket
+            document: The pdf_metadata document being deleted
+        """
+        content_hash = document.get("content_hash")
+        blobs = mongodb["pdf_blobs"]
+        blob = None
+        if content_hash:
+            # Match the file too, documents from before deduplication never took a reference
+            blob = await blobs.find_one_and_update(
+                {"_id": content_hash, "grid_fs_id": document["grid_fs_id"]},
+                {"$inc": {"ref_count": -1}},
+                return_document=ReturnDocument.AFTER,
+            )
+
+        if blob is None:
+            # Unshared document from before deduplication, it owns its file outright
+            await fs.delete(document["grid_fs_id"])
+            shared_text = content_hash and await mongodb["pdf_metadata"].count_documents(
+                {"content_hash": content_hash, "_id": {"$ne": document["_id"]}}, limit=1
+            )
+            if not shared_text:
+                await mongodb["pdf_texts"].delete_many(self._text_filter(document))
+                if content_hash:
+                    await self._delete_derived_data(mongodb, content_hash)
+            return
+
+        if blob["ref_count"] > 0:
+            self.logger.debug("PDF content still referenced", content_hash=content_hash, ref_count=blob["ref_count"])
+            return
+
+        # Only the caller that removes the blob deletes the content, a concurrent upload may have revived it
+        result = await blobs.delete_one({"_id": content_hash, "ref_count": {"$lte": 0}})
+        if result.deleted_count:
+            await fs.delete(blob["grid_fs_id"])
+            await mongodb["pdf_texts"].delete_many({"content_hash": content_hash})
+            await self._delete_derived_data(mongodb, content_hash)
+            self.logger.debug("PDF content deleted", content_hash=content_hash)
+
+    async def _delete_derived_data(self, mongodb, content_hash: str) -> None:
+        """
+        Delete what was built from the text of some content: retrieval indexes, Gemini caches and cached answers
+
+        Args:
+            mongodb: MongoDB database connection
+            content_hash: SHA-256 of the PDF bytes
+        """
+        await RetrievalService.delete_index(mongodb, content_hash)
+        SemanticAnswerCache.forget(content_hash)
+        try:
+            await GeminiContextCache().evict(content_hash)
+            await AnswerCache().invalidate(content_hash)
         except Exception as e:
-            self.logger.error("Failed to upload file to GridFS", error=str(e))
-            raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
+            # Unused caches expire by themselves
+            self.logger.error("Failed to evict cached chat data", content_hash=content_hash, error=str(e))
 
-        # Insert metadata into the pdf_metadata collection
-        metadata_collection = mongodb["pdf_metadata"]
-        result = await metadata_collection.insert_one(pdf_metadata)
+    async def _add_to_library(self, mongodb, document_id: str, document: Dict[str, Any]) -> None:
+        """
+        Merge a parsed document into the library index of its owner
 
-        # Get the inserted metadata document
-        inserted_metadata = await metadata_collection.find_one({"_id": result.inserted_id})
+        Args:
+            mongodb: MongoDB database connection
+            document_id: ID of the PDF document
+            document: The pdf_metadata document
+        """
+        try:
+            await LibraryIndex(mongodb).add_document(
+                document["user_id"], document_id, document["content_hash"], document["title"]
+            )
+        except Exception as e:
+            # Single document chat does not depend on the library index
+            self.logger.error("Failed to add PDF to library index", document_id=document_id, error=str(e))
 
-        # Convert ObjectId to string for response
-        inserted_metadata["id"] = str(inserted_metadata.pop("_id"))
+    def enqueue_parse(self, document_id: str, user_id: int) -> None:
+        """
+        Enqueue background text extraction for a PDF document
 
-        return PDFMetadataResponse(**inserted_metadata)
+        Args:
+            document_id: ID of the PDF document to parse
+            user_id: ID of the user owning the document
+        """
+        try:
+            parse_pdf_task.delay(document_id=document_id, user_id=user_id)
+            self.logger.debug("PDF parse task enqueued", document_id=document_id)
+        except Exception as e:
+            # The document stays pending and its parse can be requested again through /pdf-parse
+            self.logger.error("Failed to enqueue PDF parse task", document_id=document_id, error=str(e))
+
+    def enqueue_library_backfill(self, user_id: int) -> None:
+        """
+        Enqueue the merge of the documents a user parsed before the library index existed
+
+        Args:
+            user_id: ID of the user
+        """
+        try:
+            backfill_library_task.delay(user_id=user_id)
+            self.logger.debug("Library backfill task enqueued", user_id=user_id)
+        except Exception as e:
+            # Queued again by a library question once the claim is stale
+            self.logger.error("Failed to enqueue library backfill task", user_id=user_id, error=str(e))
+
+    async def backfill_library(self, user_id: int) -> int:
+        """
+        Merge the documents a user parsed before the library index existed into it
+
+        Args:
+            user_id: ID of the user
+
+        Returns:
+            Number of documents merged
+        """
+        # Get MongoDB connection (can't use 'or' operator with MongoDB objects)
+        mongodb = self.mongodb if self.mongodb is not None else await get_async_mongodb()
+        cursor = mongodb["pdf_metadata"].find(
+            {
+                "user_id": user_id,
+                "parsed": {"$in": [ParseStatus.DONE.value, True]},
+                "content_hash": {"$exists": True},
+            },
+            {"user_id": 1, "title": 1, "content_hash": 1},
+        )
+        count = 0
+        async for document in cursor:
+            await self._add_to_library(mongodb, str(document["_id"]), document)
+            count += 1
+        await LibraryIndex(mongodb).mark_backfilled(user_id)
+        return count
+
+    def enqueue_parses(self, document_ids: List[str], user_id: int) -> None:
+        """
+        Enqueue background text extraction for many PDF documents in one go
+
+        Args:
+            document_ids: IDs of the PDF documents to parse
+            user_id: ID of the user owning the documents
+        """
+        if not document_ids:
+            return
+        try:
+            group(
+                parse_pdf_task.s(document_id=document_id, user_id=user_id) for document_id in document_ids
+            ).apply_async()
+            self.logger.debug("PDF parse tasks enqueued", document_count=len(document_ids))
+        except Exception as e:
+            # The documents stay pending and their parse can be requested again through /pdf-parse
+            self.logger.error("Failed to enqueue PDF parse tasks", document_count=len(document_ids), error=str(e))
 
     async def get_pdf_metadata(self, document_id: str, user_id: int) -> PDFMetadataResponse:
         """
@@ -242,9 +629,11 @@ class PDFService:
         fs = AsyncIOMotorGridFSBucket(mongodb)
 
         try:
-            # Delete file from GridFS
-            await fs.delete(document["grid_fs_id"])
-            self.logger.debug("File deleted from GridFS", grid_id=str(document["grid_fs_id"]))
+            await LibraryIndex(mongodb).remove_document(user_id, document_id)
+            await ConversationMemory(mongodb).forget_document(document_id)
+
+            # Release the shared GridFS file and cached text, deleted with their last reference
+            await self._release_blob(mongodb, fs, document)
 
             # Delete metadata from MongoDB collection
             result = await metadata_collection.delete_one({"_id": ObjectId(document_id)})
@@ -260,20 +649,112 @@ class PDFService:
             self.logger.error("Error deleting PDF document", document_id=document_id, error=str(e))
             raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
 
-    async def parse_pdf_text(self, document_id: str, user_id: int) -> bool:
+    async def open_pdf_file(self, document_id: str, user_id: int) -> Tuple[Dict[str, Any], AsyncIOMotorGridOut]:
+        """
+        Open the original file of a PDF document for streaming from GridFS
+
+        Args:
+            document_id: ID of the PDF document
+            user_id: ID of the user
+
+        Returns:
+            The pdf_metadata document and an open GridFS download stream
+
+        Raises:
+            ExceptionBase: If the document is not found or doesn't belong to the user
         """
-        Parse text content from a PDF document and store it in the metadata
+        # Get MongoDB connection (can't use 'or' operator with MongoDB objects)
+        mongodb = self.mongodb if self.mongodb is not None else await get_async_mongodb()
+
+        try:
+            # Convert string ID to ObjectId
+            obj_id = ObjectId(document_id)
+        except Exception:
+            raise ExceptionBase(ErrorCode.BAD_REQUEST)
+
+        document = await mongodb["pdf_metadata"].find_one(
+            {"_id": obj_id, "user_id": user_id},
+            {"grid_fs_id": 1, "filename": 1, "title": 1, "content_type": 1, "content_hash": 1},
+        )
+        if not document:
+            raise ExceptionBase(ErrorCode.NOT_FOUND)
+
+        fs = AsyncIOMotorGridFSBucket(mongodb)
+        grid_out = await fs.open_download_stream(document["grid_fs_id"])
+        return document, grid_out
+
+    async def iter_file_range(self, grid_out: AsyncIOMotorGridOut, start: int, end: int) -> AsyncIterator[bytes]:
+        """
+        Stream an inclusive byte range of a GridFS file, one GridFS chunk at a time
+
+        Args:
+            grid_out: Open GridFS download stream
+            start: First byte of the range
+            end: Last byte of the range, inclusive
+
+        Yields:
+            Consecutive pieces of the range, at most one GridFS chunk each
+        """
+        # Seeking lands on the GridFS chunk holding the first byte, earlier chunks are never read
+        grid_out.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await grid_out.readchunk()
+            if not chunk:
+                break
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            yield chunk
+
+    async def request_parse(self, document_id: str, user_id: int) -> PDFParseStatusResponse:
+        """
+        Mark a PDF document pending and hand its text extraction to the PDF worker
+
+        A document being parsed is left alone, its parse status is returned as is.
 
         Args:
             document_id: ID of the PDF document to parse
             user_id: ID of the user requesting the parsing
 
         Returns:
-            True if the document was parsed successfully
+            Parse status of the PDF document
 
         Raises:
             ExceptionBase: If the document is not found or doesn't belong to the user
         """
+        # Get MongoDB connection
+        mongodb = self.mongodb if self.mongodb is not None else await get_async_mongodb()
+
+        try:
+            # Convert string ID to ObjectId
+            obj_id = ObjectId(document_id)
+        except Exception:
+            raise ExceptionBase(ErrorCode.BAD_REQUEST)
+
+        result = await mongodb["pdf_metadata"].update_one(
+            {"_id": obj_id, "user_id": user_id, "parsed": {"$ne": ParseStatus.PARSING.value}},
+            {"$set": {"parsed": ParseStatus.PENDING.value}, "$unset": {"parse_error": ""}},
+        )
+        if result.matched_count:
+            self.enqueue_parse(document_id, user_id)
+        return await self.get_parse_status(document_id, user_id)
+
+    async def parse_pdf_text(self, document_id: str, user_id: int) -> Dict[str, Any]:
+        """
+        Parse text content from a PDF document and store it in the pdf_texts collection
+
+        The `parsed` flag of the document moves through parsing and then done or failed.
+
+        Args:
+            document_id: ID of the PDF document to parse
+            user_id: ID of the user requesting the parsing
+
+        Returns:
+            Dictionary with the document ID, title, page and character counts and parse status
+
+        Raises:
+            ExceptionBase: If the document is not found, doesn't belong to the user or cannot be parsed
+        """
         self.logger.info("Parsing PDF text", document_id=document_id, user_id=user_id)
 
         # Get MongoDB connection
@@ -292,48 +773,289 @@ class PDFService:
         if not document:
             raise ExceptionBase(ErrorCode.NOT_FOUND)
 
-        # Get GridFS bucket
-        fs = AsyncIOMotorGridFSBucket(mongodb)
-
-        # Download file from GridFS
-        grid_out = await fs.open_download_stream(document["grid_fs_id"])
-        content = await grid_out.read()
+        await metadata_collection.update_one(
+            {"_id": obj_id}, {"$set": {"parsed": ParseStatus.PARSING.value}, "$unset": {"parse_error": ""}}
+        )
 
-        # Parse PDF content using PyPDF2
-        pdf_content = ""
-        try:
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
-            num_pages = len(pdf_reader.pages)
-
-            for page_num in range(num_pages):
-                page = pdf_reader.pages[page_num]
-                try:
-                    page_text = page.extract_text()
-                    if page_text:
-                        pdf_content += page_text + "\n"
-                    else:
-                        self.logger.warning(f"Empty text extracted from page {page_num + 1}")
-                except Exception as e:
-                    self.logger.error(f"Error extracting text from page {page_num + 1}: {str(e)}")
-                    # Continue with next page instead of failing completely
-
-            # Update metadata with page count if not already set
-            if "page_count" not in document or not document["page_count"]:
-                await metadata_collection.update_one({"_id": obj_id}, {"$set": {"page_count": num_pages}})
-
-            # Save the extracted text to the pdf_texts collection
-            pdf_texts = mongodb["pdf_texts"]
-            await pdf_texts.update_one(
-                {"document_id": document_id, "user_id": user_id},
-                {"$set": {"content": pdf_content, "parsed_date": datetime.utcnow()}},
-                upsert=True,
+        blobs = mongodb["pdf_blobs"]
+        content_hash = document.get("content_hash")
+        blob = await blobs.find_one({"_id": content_hash}) if content_hash else None
+
+        if blob and blob.get("parsed_date"):
+            # Identical bytes were parsed before, the text is a lookup
+            num_pages, char_count, parsed_date = blob["page_count"], blob["char_count"], blob["parsed_date"]
+            self.logger.info("Reusing cached PDF text", document_id=document_id, content_hash=content_hash)
+        else:
+            num_pages, char_count, parsed_date, content_hash = await self._extract_and_store(
+                mongodb, document, metadata_collection
             )
+            await blobs.update_one(
+                {"_id": content_hash},
+                {"$set": {"page_count": num_pages, "char_count": char_count, "parsed_date": parsed_date}},
+            )
+
+        # Mark the document as parsed and record its page count
+        await metadata_collection.update_one(
+            {"_id": obj_id},
+            {
+                "$set": {
+                    "parsed": ParseStatus.DONE.value,
+                    "content_hash": content_hash,
+                    "page_count": num_pages,
+                    "char_count": char_count,
+                    "parsed_date": parsed_date,
+                }
+            },
+        )
+        self.logger.info("PDF text parsed", document_id=document_id, page_count=num_pages, char_count=char_count)
+
+        await self._add_to_library(mongodb, document_id, {**document, "content_hash": content_hash})
+
+        return {
+            "document_id": document_id,
+            "title": document["title"],
+            "page_count": num_pages,
+            "char_count": char_count,
+            "status": ParseStatus.DONE,
+        }
+
+    async def _extract_and_store(self, mongodb, document: Dict[str, Any], metadata_collection):
+        """
+        Extract the text of a document and store its pages under the content hash
 
+        Args:
+            mongodb: MongoDB database connection
+            document: The pdf_metadata document to parse
+            metadata_collection: The pdf_metadata collection
+
+        Returns:
+            Page count, character count, parse timestamp and content hash of the document
+
+        Raises:
+            ExceptionBase: If the document cannot be parsed
+        """
+        parsed_date = datetime.utcnow()
+
+        # Parse PDF content on the extraction pool, storing pages as they are extracted
+        try:
+            async with self._spool_grid_file(mongodb, document) as (path, content_hash):
+                num_pages, char_count = await self._store_pages(
+                    mongodb, content_hash, PDFExtractor().iter_pages(path), parsed_date
+                )
         except Exception as e:
             self.logger.error(f"Error parsing PDF: {str(e)}")
-            raise ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR)
+            await metadata_collection.update_one(
+                {"_id": document["_id"]}, {"$set": {"parsed": ParseStatus.FAILED.value, "parse_error": str(e)}}
+            )
+            raise ExceptionBase(ErrorCode.DOCUMENT_PARSE_FAILED)
+
+        return num_pages, char_count, parsed_date, content_hash
+
+    @asynccontextmanager
+    async def _spool_grid_file(self, mongodb, document: Dict[str, Any]) -> AsyncIterator[Tuple[str, str]]:
+        """
+        Stream the GridFS file of a document chunk by chunk to a temporary file on local disk
+
+        Args:
+            mongodb: MongoDB database connection
+            document: The pdf_metadata document
+
+        Yields:
+            Path of the temporary file, readable by the extraction pool, and the SHA-256 of its content
+        """
+        fs = AsyncIOMotorGridFSBucket(mongodb)
+        grid_out = await fs.open_download_stream(document["grid_fs_id"])
+        content_hash = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as spool:
+            while chunk := await grid_out.readchunk():
+                content_hash.update(chunk)
+                spool.write(chunk)
+            spool.flush()
+            yield spool.name, content_hash.hexdigest()
+
+    async def iter_pages(self, document_id: str, user_id: int) -> AsyncIterator[Tuple[int, str]]:
+        """
+        Lazily extract the text of a PDF document, one page at a time
+
+        The file is streamed from GridFS to local disk and pages are yielded as soon as they are extracted,
+        so memory stays bounded and the first page is available before the whole document is parsed.
+
+        Args:
+            document_id: ID of the PDF document
+            user_id: ID of the user
+
+        Yields:
+            Page number (1-based) and text of each page
+
+        Raises:
+            ExceptionBase: If the document is not found or doesn't belong to the user
+        """
+        # Get MongoDB connection (can't use 'or' operator with MongoDB objects)
+        mongodb = self.mongodb if self.mongodb is not None else await get_async_mongodb()
+
+        try:
+            # Convert string ID to ObjectId
+            obj_id = ObjectId(document_id)
+        except Exception:
+            raise ExceptionBase(ErrorCode.BAD_REQUEST)
 
-        return {"document_id": document_id, "title": document["title"], "page_count": num_pages, "content": pdf_content}
+        document = await mongodb["pdf_metadata"].find_one({"_id": obj_id, "user_id": user_id}, {"grid_fs_id": 1})
+        if not document:
+            raise ExceptionBase(ErrorCode.NOT_FOUND)
+
+        async with self._spool_grid_file(mongodb, document) as (path, _):
+            async for page in PDFExtractor().iter_pages(path):
+                yield page
+
+    async def _store_pages(
+        self, mongodb, content_hash: str, pages: AsyncIterator[Tuple[int, str]], parsed_date: datetime
+    ) -> Tuple[int, int]:
+        """
+        Store a stream of pages as one pdf_texts document per page, keyed by content hash
+
+        Pages are written in batches as they arrive and chunked into indexed passages for chat retrieval.
+        Writes are idempotent upserts, so concurrent parses of identical bytes converge.
+
+        Args:
+            mongodb: MongoDB database connection
+            content_hash: SHA-256 of the PDF bytes
+            pages: Page number and text of each page, in page order
+            parsed_date: Timestamp of the parse
+
+        Returns:
+            Number of pages and number of characters of the whole document text
+        """
+        pdf_texts = mongodb["pdf_texts"]
+        codec = get_codec()
+        indexer = PassageIndexer(mongodb, content_hash, parsed_date)
+
+        batch = []
+        page_count = 0
+        empty_pages = 0
+        char_offset = 0
+        async for page_no, page_text in pages:
+            page = {
+                "content_hash": content_hash,
+                "page": page_no,
+                "content": codec.encode(page_text),
+                "codec": codec.name,
+                "char_offset": char_offset,
+                "parsed_date": parsed_date,
+            }
+            batch.append(ReplaceOne({"content_hash": content_hash, "page": page_no}, page, upsert=True))
+            await indexer.add_page(page_no, page_text)
+            page_count = page_no
+            # Pages are joined with a newline, empty pages are skipped
+            if page_text:
+                char_offset += len(page_text) + 1
+            else:
+                empty_pages += 1
+
+            if len(batch) >= PAGE_WRITE_BATCH_SIZE:
+                await pdf_texts.bulk_write(batch, ordered=False)
+                batch = []
+
+        if batch:
+            await pdf_texts.bulk_write(batch, ordered=False)
+
+        # Drop pages left over from an earlier parse of a longer text
+        await pdf_texts.delete_many({"content_hash": content_hash, "page": {"$gt": page_count}})
+        passage_count = await indexer.finish()
+        self.logger.debug("PDF passages indexed", content_hash=content_hash, passage_count=passage_count)
+
+        if empty_pages:
+            self.logger.warning("Empty text extracted from pages", content_hash=content_hash, empty_pages=empty_pages)
+
+        return page_count, char_offset
+
+    @staticmethod
+    def _text_filter(document: Dict[str, Any]) -> Dict[str, Any]:
+        """Filter selecting the pdf_texts pages of a pdf_metadata document"""
+        if document.get("content_hash"):
+            return {"content_hash": document["content_hash"]}
+        # Documents parsed before deduplication keep their text under the document ID
+        return {"document_id": str(document["_id"]), "user_id": document["user_id"]}
+
+    async def _get_parsed_document(self, mongodb, document_id: str, user_id: int) -> Dict[str, Any]:
+        """
+        Get the metadata of a document whose text is ready to read
+
+        Args:
+            mongodb: MongoDB database connection
+            document_id: ID of the PDF document
+            user_id: ID of the user
+
+        Returns:
+            The pdf_metadata document
+
+        Raises:
+            ExceptionBase: If the document is not found, not parsed yet or its parsing failed
+        """
+        try:
+            # Convert string ID to ObjectId
+            obj_id = ObjectId(document_id)
+        except Exception:
+            raise ExceptionBase(ErrorCode.BAD_REQUEST)
+
+        document = await mongodb["pdf_metadata"].find_one(
+            {"_id": obj_id, "user_id": user_id},
+            {
+                "user_id": 1,
+                "title": 1,
+                "parsed": 1,
+                "page_count": 1,
+                "char_count": 1,
+                "content_hash": 1,
+                "parsed_date": 1,
+            },
+        )
+        if not document:
+            raise ExceptionBase(ErrorCode.NOT_FOUND)
+
+        status = ParseStatus.from_flag(document.get("parsed"))
+        if status == ParseStatus.FAILED:
+            raise ExceptionBase(ErrorCode.DOCUMENT_PARSE_FAILED)
+        if status != ParseStatus.DONE:
+            raise ExceptionBase(ErrorCode.DOCUMENT_NOT_PARSED)
+        return document
+
+    async def get_parse_status(self, document_id: str, user_id: int) -> PDFParseStatusResponse:
+        """
+        Get the text extraction status of a PDF document
+
+        Args:
+            document_id: ID of the PDF document
+            user_id: ID of the user
+
+        Returns:
+            Parse status of the PDF document
+
+        Raises:
+            ExceptionBase: If the document is not found or doesn't belong to the user
+        """
+        # Get MongoDB connection
+        mongodb = self.mongodb if self.mongodb is not None else await get_async_mongodb()
+
+        try:
+            # Convert string ID to ObjectId
+            obj_id = ObjectId(document_id)
+        except Exception:
+            raise ExceptionBase(ErrorCode.BAD_REQUEST)
+
+        document = await mongodb["pdf_metadata"].find_one(
+            {"_id": obj_id, "user_id": user_id},
+            {"parsed": 1, "page_count": 1, "parse_error": 1, "parsed_date": 1},
+        )
+        if not document:
+            raise ExceptionBase(ErrorCode.NOT_FOUND)
+
+        return PDFParseStatusResponse(
+            document_id=document_id,
+            status=ParseStatus.from_flag(document.get("parsed")),
+            page_count=document.get("page_count"),
+            error=document.get("parse_error"),
+            parsed_date=document.get("parsed_date"),
+        )
 
     async def select_pdf_for_chat(self, document_id: str, user_id: int) -> Dict[str, Any]:
         """
@@ -401,25 +1123,198 @@ class PDFService:
         """
         Get the text content of a PDF document
 
+        Text is extracted by the PDF worker, this never parses on the request path.
+
         Args:
             document_id: ID of the PDF document
             user_id: ID of the user
 
         Returns:
-            Text content of the PDF or empty string if not parsed
+            Text content of the PDF
+
+        Raises:
+            ExceptionBase: If the document is not parsed yet or its parsing failed
         """
         # Get MongoDB connection (can't use 'or' operator with MongoDB objects)
         mongodb = self.mongodb if self.mongodb is not None else await get_async_mongodb()
-        pdf_texts = mongodb["pdf_texts"]
+        document = await self._get_parsed_document(mongodb, document_id, user_id)
 
-        # Check if the PDF has been parsed
-        text_doc = await pdf_texts.find_one({"document_id": document_id, "user_id": user_id})
-        if not text_doc or "content" not in text_doc:
-            # If not parsed, try to parse it now
-            try:
-                parse_result = await self.parse_pdf_text(document_id, user_id)
-                return parse_result.get("content", "")
-            except Exception:
-                return ""
+        # Assemble the document from its pages
+        cursor = mongodb["pdf_texts"].find(self._text_filter(document), {"_id": 0, "content": 1, "codec": 1})
+        cursor.sort("page", 1)
+        page_texts = [decode_content(doc) async for doc in cursor]
+        return "".join(page_text + "\n" for page_text in page_texts if page_text)
+
+    async def get_chat_document(self, document_id: str, user_id: int) -> Dict[str, Any]:
+        """
+        Get the metadata of a PDF document to chat with
+
+        Args:
+            document_id: ID of the PDF document
+            user_id: ID of the user
+
+        Returns:
+            The pdf_metadata document, with its title and content hash
+
+        Raises:
+            ExceptionBase: If the document is not parsed yet or its parsing failed
+        """
+        # Get MongoDB connection (can't use 'or' operator with MongoDB objects)
+        mongodb = self.mongodb if self.mongodb is not None else await get_async_mongodb()
+        return await self._get_parsed_document(mongodb, document_id, user_id)
+
+    async def get_labelled_text(self, document_id: str, user_id: int) -> str:
+        """
+        Get the full text of a PDF document with every page labelled by its number
+
+        Args:
+            document_id: ID of the PDF document
+            user_id: ID of the user
+
+        Returns:
+            Text of the pages in order
+
+        Raises:
+            ExceptionBase: If the document is not parsed yet or its parsing failed
+        """
+        # Get MongoDB connection (can't use 'or' operator with MongoDB objects)
+        mongodb = self.mongodb if self.mongodb is not None else await get_async_mongodb()
+        document = await self._get_parsed_document(mongodb, document_id, user_id)
+
+        cursor = mongodb["pdf_texts"].find(self._text_filter(document), {"_id": 0, "page": 1, "content": 1, "codec": 1})
+        cursor.sort("page", 1)
+        return "\n\n".join([f"[Page {doc['page']}]\n{decode_content(doc)}" async for doc in cursor])
+
+    async def get_chat_context(self, document_id: str, user_id: int, question: str) -> List[Dict[str, Any]]:
+        """
+        Get the passages of a PDF document relevant to a chat question
+
+        Args:
+            document_id: ID of the PDF document
+            user_id: ID of the user
+            question: Message of the user
+
+        Returns:
+            The best matching passages in document order, with their `text` labelled by pages and `score`
+
+        Raises:
+            ExceptionBase: If the document is not parsed yet or its parsing failed
+        """
+        # Get MongoDB connection (can't use 'or' operator with MongoDB objects)
+        mongodb = self.mongodb if self.mongodb is not None else await get_async_mongodb()
+        document = await self._get_parsed_document(mongodb, document_id, user_id)
+
+        if not document.get("content_hash"):
+            # Documents parsed before deduplication have no passages, offer their pages with the first ones preferred
+            cursor = mongodb["pdf_texts"].find(
+                self._text_filter(document), {"_id": 0, "page": 1, "content": 1, "codec": 1}
+            )
+            cursor.sort("page", 1)
+            return [
+                {"text": f"[Page {doc['page']}]\n{decode_content(doc)}", "score": -doc["page"]} async for doc in cursor
+            ]
+
+        passages = await RetrievalService(mongodb).search(document["content_hash"], question)
+        return [
+            {
+                "text": f"[Pages {passage['page_start']}-{passage['page_end']}]\n{passage['text']}"
+                if passage["page_start"] != passage["page_end"]
+                else f"[Page {passage['page_start']}]\n{passage['text']}",
+                "score": passage["score"],
+            }
+            for passage in passages
+        ]
+
+    async def get_library_context(self, user_id: int, question: str) -> List[Dict[str, Any]]:
+        """
+        Get the passages across all parsed documents of a user relevant to a chat question
+
+        Args:
+            user_id: ID of the user
+            question: Message of the user
+
+        Returns:
+            The best matching passages, best first, with their `text` labelled by document and pages, `score`
+            and `source`
+        """
+        # Get MongoDB connection (can't use 'or' operator with MongoDB objects)
+        mongodb = self.mongodb if self.mongodb is not None else await get_async_mongodb()
+        library = LibraryIndex(mongodb)
+
+        if not await library.is_backfilled(user_id) and await library.claim_backfill(user_id):
+            # Documents parsed before the library index existed are merged in by the worker, the question is
+            # answered from the documents indexed already
+            self.enqueue_library_backfill(user_id)
+
+        passages = await library.search(user_id, question)
 
-        return text_doc["content"]
+        return [
+            {
+                "text": f"[Document '{passage['title']}', pages {passage['page_start']}-{passage['page_end']}]\n"
+                f"{passage['text']}"
+                if passage["page_start"] != passage["page_end"]
+                else f"[Document '{passage['title']}', page {passage['page_start']}]\n{passage['text']}",
+                "score": passage["score"],
+                "source": {
+                    "document_id": passage["document_id"],
+                    "title": passage["title"],
+                    "page_start": passage["page_start"],
+                    "page_end": passage["page_end"],
+                },
+            }
+            for passage in passages
+        ]
+
+    async def get_page_text(self, document_id: str, user_id: int, first_page: int, last_page: int) -> PDFTextResponse:
+        """
+        Get the text of a page range of a PDF document
+
+        Args:
+            document_id: ID of the PDF document
+            user_id: ID of the user
+            first_page: First page of the range, 1-based
+            last_page: Last page of the range, inclusive
+
+        Returns:
+            Text of the requested pages with their character offsets
+
+        Raises:
+            ExceptionBase: If the document is not found, not parsed yet or the range is invalid
+        """
+        if first_page < 1 or last_page < first_page or last_page - first_page >= settings.PDF_TEXT_MAX_PAGES:
+            raise ExceptionBase(ErrorCode.INVALID_PARAMETERS)
+
+        # Get MongoDB connection (can't use 'or' operator with MongoDB objects)
+        mongodb = self.mongodb if self.mongodb is not None else await get_async_mongodb()
+        document = await self._get_parsed_document(mongodb, document_id, user_id)
+
+        cursor = mongodb["pdf_texts"].find(
+            {**self._text_filter(document), "page": {"$gte": first_page, "$lte": last_page}},
+            {"_id": 0, "page": 1, "content": 1, "codec": 1, "char_offset": 1},
+        )
+        cursor.sort("page", 1)
+        pages = [
+            PDFPageText(page=doc["page"], content=decode_content(doc), char_offset=doc.get("char_offset", 0))
+            async for doc in cursor
+        ]
+
+        return PDFTextResponse(document_id=document_id, page_count=document.get("page_count"), pages=pages)
+
+    @staticmethod
+    async def ensure_indexes(mongodb) -> None:
+        """
+        Create the MongoDB indexes used by the PDF service
+
+        Args:
+            mongodb: MongoDB database connection
+        """
+        await mongodb["pdf_metadata"].create_index([("user_id", 1), ("upload_date", -1)])
+        await mongodb["pdf_texts"].create_index([("document_id", 1), ("page", 1)])
+        await mongodb["pdf_texts"].create_index(
+            [("content_hash", 1), ("page", 1)],
+            unique=True,
+            partialFilterExpression={"content_hash": {"$exists": True}},
+        )
+        await mongodb["pdf_passages"].create_index([("content_hash", 1), ("passage", 1)], unique=True)
+        await LibraryIndex.ensure_indexes(mongodb)
+        await ConversationMemory.ensure_indexes(mongodb)
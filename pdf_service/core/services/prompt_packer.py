@@ -0,0 +1,123 @@
+import re
+from typing import Any, Dict, List, Optional
+
+from libs.logger import get_logger
+from libs.settings import settings
+
+# Words and single punctuation marks, the units a subword tokenizer never merges across
+TOKEN_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Average characters per subword token for words of English text
+CHARS_PER_TOKEN = 4
+
+# Input token limits of the Gemini models, smaller prompts are packed for unknown models
+MODEL_INPUT_TOKENS = {
+    "gemini-2.5-pro": 1_048_576,
+    "gemini-2.5-flash": 1_048_576,
+    "gemini-2.0-flash": 1_048_576,
+    "gemini-2.0-flash-lite": 1_048_576,
+    "gemini-1.5-pro": 2_097_152,
+    "gemini-1.5-flash": 1_048_576,
+    "gemini-pro": 30_720,
+}
+DEFAULT_INPUT_TOKENS = 30_720
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate the number of LLM tokens of a text without a tokenizer model
+
+    Every punctuation mark counts as a token and every word as one token per started CHARS_PER_TOKEN
+    characters, close enough to subword tokenizers for budgeting.
+    """
+    return sum((len(piece) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN for piece in TOKEN_PIECE_PATTERN.findall(text))
+
+
+def model_input_tokens(model: str) -> int:
+    """Input token limit of a Gemini model, conservative for models not listed"""
+    return MODEL_INPUT_TOKENS.get(model.removeprefix("models/"), DEFAULT_INPUT_TOKENS)
+
+
+class PromptPacker:
+    """Fit prompt context into the token budget of a model, keeping the most valuable sections whole"""
+
+    def __init__(self, model: Optional[str] = None):
+        """Initialize the packer
+
+        Args:
+            model: Gemini model the prompt is for, defaults to GEMINI_MODEL
+        """
+        self.model = model or settings.GEMINI_MODEL
+        self.logger = get_logger("pdf_service.prompt")
+
+    @property
+    def input_budget(self) -> int:
+        """Tokens a prompt may use: the model limit minus the answer, capped by CHAT_PROMPT_TOKEN_LIMIT"""
+        model_limit = model_input_tokens(self.model)
+        return min(model_limit - settings.GEMINI_MAX_OUTPUT_TOKENS, settings.CHAT_PROMPT_TOKEN_LIMIT)
+
+    def pack(
+        self,
+        instructions: str,
+        question: str,
+        sections: List[Dict[str, Any]],
+        history: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Select the context sections that fit next to the instructions, history and question
+
+        Sections are taken by descending score and never cut, a section that does not fit is dropped whole.
+        The selected sections keep their original order.
+
+        Args:
+            instructions: System instructions, always sent
+            question: Message of the user, always sent
+            sections: Context sections with `text` and `score`, in reading order
+            history: Earlier turns of the conversation, oldest first, dropped oldest first when short of room
+
+        Returns:
+            Packed `context` text and its `sections`, kept `history` and token counts
+        """
+        fixed_tokens = estimate_tokens(instructions) + estimate_tokens(question)
+        remaining = self.input_budget - fixed_tokens
+
+        # Recent turns matter most, keep them first
+        kept_history: List[str] = []
+        for turn in reversed(history or []):
+            turn_tokens = estimate_tokens(turn)
+            if turn_tokens > remaining:
+                break
+            kept_history.insert(0, turn)
+            remaining -= turn_tokens
+        history_tokens = sum(estimate_tokens(turn) for turn in kept_history)
+
+        section_tokens = [section.get("token_count") or estimate_tokens(section["text"]) for section in sections]
+        ranked = sorted(range(len(sections)), key=lambda i: sections[i].get("score", 0.0), reverse=True)
+        kept = set()
+        packed_tokens = 0
+        for i in ranked:
+            if section_tokens[i] <= remaining - packed_tokens:
+                kept.add(i)
+                packed_tokens += section_tokens[i]
+        dropped_tokens = sum(section_tokens) - packed_tokens
+
+        self.logger.info(
+            "Prompt packed",
+            model=self.model,
+            budget=self.input_budget,
+            fixed_tokens=fixed_tokens,
+            history_tokens=history_tokens,
+            dropped_turns=len(history or []) - len(kept_history),
+            packed_tokens=packed_tokens,
+            dropped_tokens=dropped_tokens,
+            packed_sections=len(kept),
+            dropped_sections=len(sections) - len(kept),
+        )
+        packed_sections = [section for i, section in enumerate(sections) if i in kept]
+        return {
+            "context": "\n\n".join(section["text"] for section in packed_sections),
+            "sections": packed_sections,
+            "history": kept_history,
+            "prompt_tokens": fixed_tokens + history_tokens + packed_tokens,
+            "packed_tokens": packed_tokens,
+            "dropped_tokens": dropped_tokens,
+        }
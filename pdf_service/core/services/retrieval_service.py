@@ -0,0 +1,383 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+from pymongo import ReplaceOne
+
+from libs.logger import get_logger
+from libs.settings import settings
+from pdf_service.core.services.embeddings import EmbeddingBackend, get_embedding_backend
+from pdf_service.core.services.passage_index import (
+    BM25Index,
+    BM25IndexBuilder,
+    PassageBuilder,
+    tokenize,
+)
+from pdf_service.core.services.prompt_packer import estimate_tokens
+from pdf_service.core.services.text_codec import decode_content, decompress_content, get_codec
+from pdf_service.core.services.vector_index import VectorIndex, VectorStore
+
+# Number of passages written to pdf_passages per bulk write
+PASSAGE_WRITE_BATCH_SIZE = 500
+
+# Damping constant of reciprocal rank fusion, higher values flatten the weight of the top ranks
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[int, float]]], top_k: int) -> List[Tuple[int, float]]:
+    """Merge rankings of the same passages produced by different scorers
+
+    Args:
+        rankings: Passage IDs and scores of each scorer, best first
+        top_k: Maximum number of passages to return
+
+    Returns:
+        Passage IDs and fused scores, best first
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (passage_id, _) in enumerate(ranking):
+            fused[passage_id] = fused.get(passage_id, 0.0) + 1 / (RRF_K + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+class PassageIndexer:
+    """Chunk the pages of a document into passages and build their BM25 and vector indexes as the pages stream by"""
+
+    def __init__(self, mongodb, content_hash: str, parsed_date: datetime):
+        """Initialize the indexer
+
+        Args:
+            mongodb: MongoDB database connection
+            content_hash: SHA-256 of the PDF bytes
+            parsed_date: Timestamp of the parse
+        """
+        self.mongodb = mongodb
+        self.content_hash = content_hash
+        self.parsed_date = parsed_date
+        self.codec = get_codec()
+        self.builder = PassageBuilder(settings.CHAT_PASSAGE_WORDS, settings.CHAT_PASSAGE_OVERLAP)
+        self.index = BM25IndexBuilder()
+        self.embedding: Optional[EmbeddingBackend] = get_embedding_backend()
+        self.logger = get_logger("pdf_service.retrieval")
+        self._batch: List[ReplaceOne] = []
+        self._texts: List[str] = []
+        self._vectors: List[np.ndarray] = []
+
+    async def add_page(self, page: int, text: str) -> None:
+        """Add the text of the next page of the document"""
+        await self._add_passages(self.builder.add_page(page, text))
+
+    async def finish(self) -> int:
+        """Store the remaining passages and the index
+
+        Returns:
+            Number of passages of the document
+        """
+        await self._add_passages(self.builder.finish())
+        await self._flush()
+
+        index = self.index.build()
+        passage_count = index.passage_count
+        pdf_passages = self.mongodb["pdf_passages"]
+        # Drop passages left over from an earlier parse of a longer text
+        await pdf_passages.delete_many({"content_hash": self.content_hash, "passage": {"$gte": passage_count}})
+
+        await self.mongodb["pdf_indexes"].replace_one(
+            {"_id": self.content_hash},
+            {
+                "index": self.codec.compress(index.to_bytes()),
+                "codec": self.codec.name,
+                "passage_count": passage_count,
+                "term_count": len(index.terms),
+                "built_date": self.parsed_date,
+            },
+            upsert=True,
+        )
+
+        if self.embedding is not None and passage_count:
+            vectors = np.vstack(self._vectors).astype(settings.EMBEDDING_DTYPE)
+            await VectorStore(self.mongodb).save(self.content_hash, self.embedding.key, VectorIndex(vectors))
+        return passage_count
+
+    async def _add_passages(self, passages: List[Dict[str, Any]]) -> None:
+        for passage in passages:
+            self.index.add(passage["passage"], tokenize(passage["text"]))
+            document = {
+                "content_hash": self.content_hash,
+                "passage": passage["passage"],
+                "page_start": passage["page_start"],
+                "page_end": passage["page_end"],
+                "content": self.codec.encode(passage["text"]),
+                "codec": self.codec.name,
+                "token_count": estimate_tokens(passage["text"]),
+                "parsed_date": self.parsed_date,
+            }
+            self._batch.append(
+                ReplaceOne({"content_hash": self.content_hash, "passage": passage["passage"]}, document, upsert=True)
+            )
+            self._texts.append(passage["text"])
+        if len(self._batch) >= PASSAGE_WRITE_BATCH_SIZE:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if self._batch:
+            await self.mongodb["pdf_passages"].bulk_write(self._batch, ordered=False)
+            self._batch = []
+
+        if self._texts and self.embedding is not None:
+            try:
+                self._vectors.append(await self.embedding.embed(self._texts))
+            except Exception as e:
+                # Chat still works on the BM25 index alone
+                self.logger.warning("Passage embedding failed", content_hash=self.content_hash, error=str(e))
+                self.embedding = None
+        self._texts = []
+
+
+class RetrievalService:
+    """Service selecting the passages of a document relevant to a question"""
+
+    # Deserialized indexes by content hash, content never changes under a hash
+    _index_cache: "OrderedDict[str, BM25Index]" = OrderedDict()
+    _vector_cache: "OrderedDict[Tuple[str, str], VectorIndex]" = OrderedDict()
+
+    def __init__(self, mongodb):
+        """Initialize the retrieval service
+
+        Args:
+            mongodb: MongoDB database connection
+        """
+        self.mongodb = mongodb
+        self.logger = get_logger("pdf_service.retrieval")
+
+    async def search(
+        self, content_hash: str, query: str, top_k: Optional[int] = None, token_budget: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Get the passages of a document that best match a query and fit a token budget
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+            query: Question of the user
+            top_k: Maximum number of passages, defaults to CHAT_TOP_K
+            token_budget: Maximum estimated tokens of all passages, defaults to CHAT_CONTEXT_TOKENS
+
+        Returns:
+            Passages in document order with their pages, text and score
+        """
+        top_k = top_k or settings.CHAT_TOP_K
+        started = time.perf_counter()
+
+        ranked = await self.rank(content_hash, query, top_k)
+        search_ms = (time.perf_counter() - started) * 1000
+        passages, used_tokens = await self.fetch_passages(content_hash, ranked, token_budget)
+
+        self.logger.info(
+            "Passages retrieved",
+            content_hash=content_hash,
+            mode=settings.CHAT_RETRIEVAL_MODE,
+            passages=len(passages),
+            tokens=used_tokens,
+            search_ms=round(search_ms, 2),
+            total_ms=round((time.perf_counter() - started) * 1000, 2),
+        )
+        return sorted(passages, key=lambda passage: passage["passage"])
+
+    async def rank(self, content_hash: str, query: str, top_k: int) -> List[Tuple[int, float]]:
+        """
+        Rank the passages of a document against a query with the configured CHAT_RETRIEVAL_MODE
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+            query: Question of the user
+            top_k: Maximum number of passages
+
+        Returns:
+            Passage IDs and scores, best first
+        """
+        # Loading the keyword index also indexes documents parsed before passages existed
+        index = await self.load_index(content_hash)
+        if index is None:
+            return []
+
+        mode = settings.CHAT_RETRIEVAL_MODE
+        rankings = []
+        if mode in ("bm25", "hybrid"):
+            rankings.append(index.search(query, top_k))
+        if mode in ("vector", "hybrid"):
+            vector_ranking = await self._vector_search(content_hash, query, top_k)
+            if vector_ranking is not None:
+                rankings.append(vector_ranking)
+            elif mode == "vector":
+                rankings.append(index.search(query, top_k))
+
+        ranked = reciprocal_rank_fusion(rankings, top_k) if len(rankings) > 1 else rankings[0]
+        # Questions sharing no term with the document fall back to its opening passages
+        return ranked or [(passage_id, 0.0) for passage_id in range(min(top_k, index.passage_count))]
+
+    async def fetch_passages(
+        self, content_hash: str, ranked: List[Tuple[int, float]], token_budget: Optional[int] = None
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Read ranked passages, best first, until a token budget is spent
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+            ranked: Passage IDs and scores, best first
+            token_budget: Maximum estimated tokens of all passages, defaults to CHAT_CONTEXT_TOKENS
+
+        Returns:
+            Selected passages with their pages, text and score, and their estimated tokens
+        """
+        token_budget = token_budget or settings.CHAT_CONTEXT_TOKENS
+        cursor = self.mongodb["pdf_passages"].find(
+            {"content_hash": content_hash, "passage": {"$in": [passage_id for passage_id, _ in ranked]}},
+            {"_id": 0, "passage": 1, "page_start": 1, "page_end": 1, "content": 1, "codec": 1, "token_count": 1},
+        )
+        found = {doc["passage"]: doc async for doc in cursor}
+
+        selected = []
+        used_tokens = 0
+        for passage_id, score in ranked:
+            doc = found.get(passage_id)
+            if doc is None or used_tokens + doc["token_count"] > token_budget:
+                continue
+            used_tokens += doc["token_count"]
+            selected.append(
+                {
+                    "passage": passage_id,
+                    "page_start": doc["page_start"],
+                    "page_end": doc["page_end"],
+                    "text": decode_content(doc),
+                    "score": score,
+                    "token_count": doc["token_count"],
+                }
+            )
+        return selected, used_tokens
+
+    async def _vector_search(self, content_hash: str, query: str, top_k: int) -> Optional[List[Tuple[int, float]]]:
+        try:
+            embedding = get_embedding_backend()
+            vectors = await self._load_vectors(content_hash, embedding)
+            if vectors is None:
+                return None
+            query_vector = (await embedding.embed([query]))[0]
+        except Exception as e:
+            self.logger.warning("Vector search unavailable", content_hash=content_hash, error=str(e))
+            return None
+        return vectors.search(query_vector, top_k)
+
+    async def build_index(self, content_hash: str, pages: AsyncIterator[Tuple[int, str]]) -> int:
+        """
+        Chunk and index a document from its pages
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+            pages: Page number and text of each page, in page order
+
+        Returns:
+            Number of passages of the document
+        """
+        indexer = PassageIndexer(self.mongodb, content_hash, datetime.utcnow())
+        async for page, text in pages:
+            await indexer.add_page(page, text)
+        passage_count = await indexer.finish()
+        self._forget(content_hash)
+        return passage_count
+
+    async def load_index(self, content_hash: str) -> Optional[BM25Index]:
+        """
+        Get the BM25 index of a document, indexing documents parsed before passages existed
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+
+        Returns:
+            The index, or None when the document has no text
+        """
+        cache = RetrievalService._index_cache
+        if content_hash in cache:
+            cache.move_to_end(content_hash)
+            return cache[content_hash]
+
+        document = await self.mongodb["pdf_indexes"].find_one({"_id": content_hash})
+        if document is None:
+            # Documents parsed before passages existed are indexed from their stored pages on first use
+            self.logger.info("Building missing passage index", content_hash=content_hash)
+            if not await self.build_index(content_hash, self._stored_pages(content_hash)):
+                return None
+            document = await self.mongodb["pdf_indexes"].find_one({"_id": content_hash})
+
+        index = BM25Index.from_bytes(decompress_content(document, "index"))
+        cache[content_hash] = index
+        while len(cache) > settings.CHAT_INDEX_CACHE_SIZE:
+            cache.popitem(last=False)
+        return index
+
+    async def _load_vectors(self, content_hash: str, embedding: EmbeddingBackend) -> Optional[VectorIndex]:
+        cache = RetrievalService._vector_cache
+        cache_key = (content_hash, embedding.key)
+        if cache_key in cache:
+            cache.move_to_end(cache_key)
+            return cache[cache_key]
+
+        store = VectorStore(self.mongodb)
+        vectors = await store.load(content_hash, embedding.key)
+        if vectors is None:
+            # Passages indexed before vectors existed, or under another backend, are embedded on first use
+            self.logger.info("Building missing passage vectors", content_hash=content_hash, backend=embedding.key)
+            matrices = []
+            texts = []
+            cursor = self.mongodb["pdf_passages"].find(
+                {"content_hash": content_hash}, {"_id": 0, "content": 1, "codec": 1}
+            )
+            cursor.sort("passage", 1)
+            async for doc in cursor:
+                texts.append(decode_content(doc))
+                if len(texts) >= PASSAGE_WRITE_BATCH_SIZE:
+                    matrices.append(await embedding.embed(texts))
+                    texts = []
+            if texts:
+                matrices.append(await embedding.embed(texts))
+            if not matrices:
+                return None
+            matrix = np.vstack(matrices).astype(settings.EMBEDDING_DTYPE)
+            await store.save(content_hash, embedding.key, VectorIndex(matrix))
+            vectors = await store.load(content_hash, embedding.key)
+
+        cache[cache_key] = vectors
+        while len(cache) > settings.CHAT_INDEX_CACHE_SIZE:
+            cache.popitem(last=False)
+        return vectors
+
+    @staticmethod
+    def _forget(content_hash: str) -> None:
+        """Drop the cached indexes of a document"""
+        RetrievalService._index_cache.pop(content_hash, None)
+        for cache_key in [key for key in RetrievalService._vector_cache if key[0] == content_hash]:
+            del RetrievalService._vector_cache[cache_key]
+
+    async def _stored_pages(self, content_hash: str) -> AsyncIterator[Tuple[int, str]]:
+        cursor = self.mongodb["pdf_texts"].find(
+            {"content_hash": content_hash}, {"_id": 0, "page": 1, "content": 1, "codec": 1}
+        )
+        cursor.sort("page", 1)
+        async for doc in cursor:
+            yield doc["page"], decode_content(doc)
+
+    @staticmethod
+    async def delete_index(mongodb, content_hash: str) -> None:
+        """
+        Delete the passages, index and vectors of a document
+
+        Args:
+            mongodb: MongoDB database connection
+            content_hash: SHA-256 of the PDF bytes
+        """
+        await mongodb["pdf_passages"].delete_many({"content_hash": content_hash})
+        await mongodb["pdf_indexes"].delete_one({"_id": content_hash})
+        await VectorStore(mongodb).delete(content_hash)
+        RetrievalService._forget(content_hash)
@@ -0,0 +1,144 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from libs.cache.redis import CacheService
+from libs.logger import get_logger
+from libs.settings import settings
+
+# Redis keys and channels of the calls in flight, relative to REDIS_PREFIX
+KEY_PREFIX = "singleflight:"
+
+# Seconds the result of a call stays readable by followers that subscribed while it was being published
+RESULT_SECONDS = 10
+
+# Published when the result is stored, or when the leader failed and followers have to call themselves
+DONE = "done"
+FAILED = "failed"
+
+
+class SingleFlight:
+    """Coalesce identical concurrent calls into one, within a process and across processes through Redis
+
+    In a process, callers of a key already in flight await the future of the first call. Across processes the
+    first caller takes a Redis lock on the key, stores the result and announces it on a channel; callers in other
+    processes subscribe and wait for it up to CHAT_SINGLEFLIGHT_TIMEOUT seconds. A follower makes the call
+    itself when the leader fails, runs out of time or Redis is unavailable, so coalescing never costs an answer.
+    """
+
+    _flights: Dict[str, "asyncio.Future[str]"] = {}
+
+    def __init__(self):
+        self.cache = CacheService()
+        self.logger = get_logger("pdf_service.singleflight")
+
+    @property
+    def enabled(self) -> bool:
+        return settings.CHAT_SINGLEFLIGHT_ENABLED
+
+    async def do(self, key: str, call: Callable[[], Awaitable[str]]) -> str:
+        """
+        Make a call unless an identical one is in flight, and share its result
+
+        Args:
+            key: Identifies identical calls
+            call: Makes the call, e.g. sends the request to Gemini
+
+        Returns:
+            Result of the call, made by this caller or by another one
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.logger.info("Call coalesced", key=key, scope="process")
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+                # The caller making the call went away, make it again
+                return await self.do(key, call)
+
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._lead_or_follow(key, call)
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            # Retrieved here so a failure nobody else waited for is not reported as unhandled
+            flight.exception()
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            del self._flights[key]
+
+    async def _lead_or_follow(self, key: str, call: Callable[[], Awaitable[str]]) -> str:
+        lock_key = f"{self.cache.prefix}{KEY_PREFIX}{key}:lock"
+        try:
+            leader = await self.cache.client.set(lock_key, "1", nx=True, ex=settings.CHAT_SINGLEFLIGHT_TIMEOUT)
+        except Exception as e:
+            self.logger.error("Singleflight lock unavailable", error=str(e))
+            return await call()
+
+        if not leader:
+            result = await self._follow(key)
+            return result if result is not None else await call()
+
+        try:
+            result = await call()
+        except BaseException:
+            await self._publish(key, FAILED)
+            raise
+        finally:
+            try:
+                await self.cache.client.delete(lock_key)
+            except Exception as e:
+                # The lock expires by itself
+                self.logger.error("Failed to release singleflight lock", error=str(e))
+        await self._publish(key, DONE, result)
+        return result
+
+    async def _publish(self, key: str, status: str, result: Optional[str] = None) -> None:
+        try:
+            if result is not None:
+                await self.cache.set_cache(f"{KEY_PREFIX}{key}:result", result, RESULT_SECONDS)
+            await self.cache.client.publish(f"{self.cache.prefix}{KEY_PREFIX}{key}", status)
+        except Exception as e:
+            # Followers stop waiting after CHAT_SINGLEFLIGHT_TIMEOUT and call themselves
+            self.logger.error("Failed to publish singleflight result", error=str(e))
+
+    async def _follow(self, key: str) -> Optional[str]:
+        """Wait for the result of the call made by another process, None if it never comes"""
+        result_key = f"{KEY_PREFIX}{key}:result"
+        deadline = time.monotonic() + settings.CHAT_SINGLEFLIGHT_TIMEOUT
+        pubsub = self.cache.client.pubsub()
+        try:
+            await pubsub.subscribe(f"{self.cache.prefix}{KEY_PREFIX}{key}")
+            # The result may have been published before the subscription
+            result = await self.cache.get_cache(result_key)
+            while result is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.logger.warning("Timed out waiting for coalesced call", key=key)
+                    return None
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+                if message is None:
+                    continue
+                if message["data"] != DONE:
+                    return None
+                result = await self.cache.get_cache(result_key)
+                if result is None:
+                    return None
+            self.logger.info("Call coalesced", key=key, scope="redis")
+            return result
+        except Exception as e:
+            self.logger.error("Failed to wait for coalesced call", error=str(e))
+            return None
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
@@ -0,0 +1,121 @@
+import zlib
+from typing import Any, Dict, Optional
+
+from libs.settings import settings
+
+
+class TextCodec:
+    """Codec storing extracted text as-is"""
+
+    name = "none"
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+    def encode(self, text: str) -> Any:
+        return text
+
+    def decode(self, data: Any) -> str:
+        return data
+
+
+class ZlibCodec(TextCodec):
+    """Codec compressing extracted text with zlib"""
+
+    name = "zlib"
+
+    def __init__(self, level: Optional[int] = None):
+        self.level = 6 if level is None else level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+    def encode(self, text: str) -> bytes:
+        return self.compress(text.encode("utf-8"))
+
+    def decode(self, data: bytes) -> str:
+        return self.decompress(data).decode("utf-8")
+
+
+class ZstdCodec(TextCodec):
+    """Codec compressing extracted text with Zstandard"""
+
+    name = "zstd"
+
+    def __init__(self, level: Optional[int] = None):
+        # Imported here so the other codecs work without the zstandard package
+        import zstandard
+
+        self.level = 3 if level is None else level
+        self._compressor = zstandard.ZstdCompressor(level=self.level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.decompress(data)
+
+    def encode(self, text: str) -> bytes:
+        return self.compress(text.encode("utf-8"))
+
+    def decode(self, data: bytes) -> str:
+        return self.decompress(data).decode("utf-8")
+
+
+CODECS = {codec.name: codec for codec in (TextCodec, ZlibCodec, ZstdCodec)}
+
+_instances: Dict[str, TextCodec] = {}
+
+
+def get_codec(name: Optional[str] = None) -> TextCodec:
+    """Get a text codec by name, defaulting to the configured PDF_TEXT_CODEC
+
+    Args:
+        name: Name of the codec (none, zlib or zstd)
+
+    Returns:
+        Shared codec instance
+    """
+    name = name or settings.PDF_TEXT_CODEC
+    if name not in _instances:
+        if name not in CODECS:
+            raise ValueError(f"Unknown text codec: {name}")
+        level = settings.PDF_TEXT_CODEC_LEVEL if name == settings.PDF_TEXT_CODEC else None
+        _instances[name] = CODECS[name]() if name == TextCodec.name else CODECS[name](level)
+    return _instances[name]
+
+
+def decode_content(document: Dict[str, Any], field: str = "content") -> str:
+    """Decode a stored text field, written by any codec or before codecs existed
+
+    Args:
+        document: MongoDB document holding the field and its `codec`
+        field: Name of the encoded field
+
+    Returns:
+        Decoded text
+    """
+    content = document.get(field)
+    if content is None:
+        return ""
+    return get_codec(document.get("codec") or TextCodec.name).decode(content)
+
+
+def decompress_content(document: Dict[str, Any], field: str) -> bytes:
+    """Decompress a stored binary field written by any codec
+
+    Args:
+        document: MongoDB document holding the field and its `codec`
+        field: Name of the compressed field
+
+    Returns:
+        Decompressed bytes
+    """
+    return get_codec(document.get("codec") or TextCodec.name).decompress(document[field])
@@ -0,0 +1,139 @@
+import io
+import os
+import tempfile
+from typing import List, Optional, Tuple
+
+import numpy as np
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+from libs.logger import get_logger
+from libs.settings import settings
+
+
+class VectorIndex:
+    """Matrix of passage vectors, one row per passage, searched by cosine similarity"""
+
+    def __init__(self, matrix: np.ndarray):
+        """Initialize the index
+
+        Args:
+            matrix: Normalized float32 or float16 rows, possibly memory-mapped
+        """
+        self.matrix = matrix
+
+    @property
+    def passage_count(self) -> int:
+        return self.matrix.shape[0]
+
+    def search(self, query: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+        """Rank passages against a normalized query vector
+
+        Args:
+            query: Normalized float32 vector
+            top_k: Maximum number of passages to return
+
+        Returns:
+            Passage IDs and cosine similarities, best first
+        """
+        top_k = min(top_k, self.passage_count)
+        if top_k <= 0:
+            return []
+        # NumPy has no BLAS kernel for float16, upcasting first is faster than a float16 matmul
+        scores = self.matrix.astype(np.float32, copy=False) @ query
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(passage_id), float(scores[passage_id])) for passage_id in top]
+
+    def to_bytes(self) -> bytes:
+        """Serialize the matrix in .npy format"""
+        buffer = io.BytesIO()
+        np.save(buffer, self.matrix, allow_pickle=False)
+        return buffer.getvalue()
+
+
+class VectorStore:
+    """Passage vectors stored in GridFS and memory-mapped from a local disk cache"""
+
+    BUCKET_NAME = "pdf_vectors"
+
+    def __init__(self, mongodb, cache_dir: Optional[str] = None):
+        """Initialize the vector store
+
+        Args:
+            mongodb: MongoDB database connection
+            cache_dir: Directory of the local .npy files, defaults to EMBEDDING_CACHE_DIR
+        """
+        self.fs = AsyncIOMotorGridFSBucket(mongodb, bucket_name=self.BUCKET_NAME)
+        self.cache_dir = cache_dir or settings.EMBEDDING_CACHE_DIR
+        self.logger = get_logger("pdf_service.vectors")
+
+    @staticmethod
+    def filename(content_hash: str, key: str) -> str:
+        return f"{content_hash}.{key}.npy"
+
+    async def save(self, content_hash: str, key: str, index: VectorIndex) -> None:
+        """
+        Store the passage vectors of a document
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+            key: Key of the embedding backend that produced the vectors
+            index: Vectors of the passages
+        """
+        filename = self.filename(content_hash, key)
+        data = index.to_bytes()
+
+        # Replace the vectors of an earlier parse
+        async for grid_file in self.fs.find({"filename": filename}, {"_id": 1}):
+            await self.fs.delete(grid_file._id)
+        await self.fs.upload_from_stream(filename, data)
+
+        self._write_cache(filename, data)
+
+    async def load(self, content_hash: str, key: str) -> Optional[VectorIndex]:
+        """
+        Open the passage vectors of a document, memory-mapped from the local cache
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+            key: Key of the embedding backend
+
+        Returns:
+            The vector index, or None when the document has no vectors for this backend
+        """
+        filename = self.filename(content_hash, key)
+        path = os.path.join(self.cache_dir, filename)
+        if not os.path.exists(path):
+            try:
+                grid_out = await self.fs.open_download_stream_by_name(filename)
+            except NoFile:
+                return None
+            self._write_cache(filename, await grid_out.read())
+            self.logger.debug("Vectors cached from GridFS", filename=filename)
+
+        # The rows are paged in by the OS on demand, nothing is parsed or copied
+        return VectorIndex(np.load(path, mmap_mode="r", allow_pickle=False))
+
+    async def delete(self, content_hash: str) -> None:
+        """
+        Delete the passage vectors of a document for every backend
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+        """
+        prefix = f"{content_hash}."
+        async for grid_file in self.fs.find({"filename": {"$regex": f"^{prefix}"}}, {"_id": 1}):
+            await self.fs.delete(grid_file._id)
+
+        if os.path.isdir(self.cache_dir):
+            for filename in os.listdir(self.cache_dir):
+                if filename.startswith(prefix):
+                    os.remove(os.path.join(self.cache_dir, filename))
+
+    def _write_cache(self, filename: str, data: bytes) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write next to the target and rename, readers never see a partial file
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False) as spool:
+            spool.write(data)
+        os.replace(spool.name, os.path.join(self.cache_dir, filename))
@@ -23,6 +23,9 @@ celery_app.conf.update(
     accept_content=["json"],
     task_routes={
         "test": {"queue": settings.PDF_QUEUE_NAME},
+        "parse_pdf": {"queue": settings.PDF_QUEUE_NAME},
+        "backfill_library": {"queue": settings.PDF_QUEUE_NAME},
+        "chat_pdf": {"queue": settings.CHAT_QUEUE_NAME},
     },
     timezone="UTC",
 )
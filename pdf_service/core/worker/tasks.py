@@ -1,6 +1,106 @@
+import asyncio
+from typing import Any, Dict
+
+from libs.cache.redis import get_task_cache_context
+from libs.db import get_task_db_context
+from libs.db.mongodb import get_task_mongodb_context
+from libs.exceptions.errors import ErrorCode
+from libs.exceptions.schemas import ExceptionBase
 from pdf_service.core.worker.config import celery_app
 
 
 @celery_app.task(bind=True, name="test", max_retries=3, default_retry_delay=60)
 def test(self) -> None:
     pass
+
+
+async def _parse_pdf(document_id: str, user_id: int) -> int:
+    # Imported here to avoid a circular import, the service enqueues this task
+    from pdf_service.core.services.pdf_service import PDFService
+
+    async with get_task_mongodb_context() as mongodb:
+        pdf_service = PDFService(db=None, mongodb=mongodb)
+        result = await pdf_service.parse_pdf_text(document_id, user_id)
+        return result["page_count"]
+
+
+@celery_app.task(bind=True, name="parse_pdf", max_retries=3, default_retry_delay=60)
+def parse_pdf_task(self, document_id: str, user_id: int) -> str:
+    """Extract and store the text of an uploaded PDF as a background task"""
+    try:
+        page_count = asyncio.run(_parse_pdf(document_id, user_id))
+        return f"PDF {document_id} parsed, {page_count} pages"
+    except ExceptionBase as error:
+        # Missing or unparseable documents will not get better on retry
+        return f"PDF {document_id} not parsed: {error.message}"
+    except Exception as error:
+        if self.request.retries >= self.max_retries:
+            raise error
+        else:
+            self.retry(exc=error)
+
+
+async def _backfill_library(user_id: int) -> int:
+    # Imported here to avoid a circular import, the service enqueues this task
+    from pdf_service.core.services.pdf_service import PDFService
+
+    async with get_task_mongodb_context() as mongodb:
+        return await PDFService(db=None, mongodb=mongodb).backfill_library(user_id)
+
+
+@celery_app.task(bind=True, name="backfill_library", max_retries=3, default_retry_delay=60)
+def backfill_library_task(self, user_id: int) -> str:
+    """Merge the documents a user parsed before the library index existed into it, as a background task"""
+    try:
+        count = asyncio.run(_backfill_library(user_id))
+    except Exception as error:
+        if self.request.retries >= self.max_retries:
+            raise error
+        self.retry(exc=error)
+    return f"Library of user {user_id} backfilled, {count} documents"
+
+
+async def _chat_pdf(
+    job_id: str, user_id: int, message: str, selected_pdf: Dict[str, Any], new_conversation: bool = False
+) -> str:
+    # Imported here to avoid a circular import, the services enqueue this task
+    from pdf_service.core.services.ai_service import AIService
+    from pdf_service.core.services.chat_jobs import COMPLETED, FAILED, RUNNING, ChatJobStore
+    from pdf_service.core.services.conversation_memory import ConversationMemory
+    from pdf_service.core.services.llm_client import LLMClient
+    from pdf_service.core.services.pdf_service import PDFService
+
+    # Connections of an earlier task belong to its event loop, every task opens its own
+    async with get_task_cache_context(), get_task_mongodb_context() as mongodb, get_task_db_context() as db:
+        chat_jobs = ChatJobStore()
+        await chat_jobs.update(job_id, status=RUNNING)
+        async with LLMClient() as llm:
+            try:
+                ai_service = AIService(db, llm, mongodb=mongodb)
+                pdf_service = PDFService(db=db, mongodb=mongodb)
+                prepared = await ai_service.prepare_pdf_chat(
+                    user_id, message, pdf_service, selected_pdf, new_conversation
+                )
+                result = prepared.get("cached_answer") or await ai_service.chat_with_pdf(**prepared)
+            except ExceptionBase as error:
+                await chat_jobs.update(job_id, status=FAILED, error=error.to_dict())
+                return f"{FAILED}: {error.message}"
+            except Exception:
+                await chat_jobs.update(
+                    job_id, status=FAILED, error=ExceptionBase(ErrorCode.INTERNAL_SERVER_ERROR).to_dict()
+                )
+                raise
+            await chat_jobs.update(job_id, status=COMPLETED, result=result)
+            # The summary is folded once the answer is out, before the Gemini client and event loop go away
+            await ConversationMemory.drain()
+        return COMPLETED
+
+
+@celery_app.task(bind=True, name="chat_pdf")
+def chat_pdf_task(
+    self, job_id: str, user_id: int, message: str, selected_pdf: Dict[str, Any], new_conversation: bool = False
+) -> str:
+    """Answer a chat message about a PDF as a background task, storing the answer in its chat job"""
+    # Not retried: the Gemini client retries by itself and a second attempt could answer twice
+    status = asyncio.run(_chat_pdf(job_id, user_id, message, selected_pdf, new_conversation))
+    return f"Chat job {job_id} {status}"
@@ -13,7 +13,15 @@ from sentry_sdk.integrations.starlette import StarletteIntegration
 import time
 
 from pdf_service.api.v1.pdf.pdf_router import router as pdf_router
+from pdf_service.core.services.chat_history_writer import ChatHistoryWriter
+from pdf_service.core.services.conversation_memory import ConversationMemory
+from pdf_service.core.services.embeddings import GeminiEmbedding
+from pdf_service.core.services.llm_client import LLMClient
+from pdf_service.core.services.llm_dispatcher import LLMDispatcher
+from pdf_service.core.services.pdf_extractor import PDFExtractor
+from pdf_service.core.services.pdf_service import PDFService
 from libs import ExceptionBase, settings
+from libs.db.mongodb import get_async_mongodb
 from libs.logger import configure_logging, get_logger, LoggingMiddleware
 
 
@@ -38,7 +46,7 @@ if settings.SENTRY_ENABLED and settings.ENV_NAME == "PRODUCTION":
 
 # App Lifespan
 @asynccontextmanager
-async def lifespan(_app: FastAPI) -> AsyncGenerator[None, None]:
+async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     logger.info("Starting PDF service")
 
     # Thread limiter setting
@@ -58,14 +66,47 @@ async def lifespan(_app: FastAPI) -> AsyncGenerator[None, None]:
         logger.error("Failed to initialize rate limiter", error=str(e))
         raise
 
+    # Create MongoDB indexes used by the PDF service
+    await PDFService.ensure_indexes(await get_async_mongodb())
+    logger.info("MongoDB indexes ensured")
+
+    # Gemini connection pool shared by every request
+    app.state.llm_client = LLMClient()
+    await app.state.llm_client.start()
+    logger.info("Gemini client started", pool_size=settings.GEMINI_POOL_SIZE)
+    # Question embeddings of vector search share it too
+    GeminiEmbedding.llm_client = app.state.llm_client
+    app.state.llm_dispatcher = LLMDispatcher()
+    await app.state.llm_dispatcher.start()
+
+    # Chat messages are written behind the requests
+    app.state.chat_history_writer = ChatHistoryWriter()
+    await app.state.chat_history_writer.start()
+    logger.info("Chat history writer started", mode=app.state.chat_history_writer.mode)
+
     logger.info("PDF service started successfully")
     yield
 
-    # Close Redis connection on shutdown
     logger.info("Shutting down PDF service")
+
+    # Write the queued chat messages before Redis goes away
+    await app.state.chat_history_writer.close()
+    logger.info("Chat history flushed", **app.state.chat_history_writer.metrics())
+
+    # Close Redis connection on shutdown
     await redis_instance.close()
     logger.info("Redis connection closed")
 
+    await app.state.llm_dispatcher.close()
+    # Conversation summaries being folded still need the Gemini client
+    await ConversationMemory.drain()
+    GeminiEmbedding.llm_client = None
+    await app.state.llm_client.close()
+    logger.info("Gemini client closed")
+
+    PDFExtractor.shutdown()
+    logger.info("PDF extraction pool stopped")
+
 
 # APP Configuration
 app = FastAPI(
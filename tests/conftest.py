@@ -0,0 +1,9 @@
+import os
+from pathlib import Path
+
+from dotenv import dotenv_values
+
+# Settings are required at import time, the example environment fills in whatever the shell does not set
+for name, value in dotenv_values(Path(__file__).resolve().parent.parent / ".env.example").items():
+    if value is not None:
+        os.environ.setdefault(name, value)
@@ -0,0 +1,37 @@
+import pytest
+
+from pdf_service.api.v1.pdf.pdf_router import _parse_byte_range
+
+FILE_SIZE = 1000
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=100-", (100, 999)),
+        ("bytes=900-5000", (900, 999)),
+        ("bytes=999-999", (999, 999)),
+        ("bytes=-100", (900, 999)),
+        ("bytes=-5000", (0, 999)),
+        ("BYTES = 0-9", (0, 9)),
+    ],
+)
+def test_satisfiable_ranges(header, expected):
+    assert _parse_byte_range(header, FILE_SIZE) == expected
+
+
+@pytest.mark.parametrize("header", ["items=0-9", "bytes=0-9,20-29", "bytes=abc-", "bytes=-", "bytes=0-x"])
+def test_ignored_ranges_serve_the_whole_file(header):
+    assert _parse_byte_range(header, FILE_SIZE) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5000-6000", "bytes=10-5", "bytes=-0", "bytes=--5"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(ValueError):
+        _parse_byte_range(header, FILE_SIZE)
+
+
+def test_suffix_range_of_an_empty_file():
+    with pytest.raises(ValueError):
+        _parse_byte_range("bytes=-10", 0)
@@ -0,0 +1,95 @@
+import pytest
+
+from pdf_service.core.services.answer_cache import SemanticAnswerCache, normalize_question, stem
+
+CONTENT_HASH = "a" * 64
+MODEL = "gemini-test"
+
+# Questions about the same document asking for something else, each pair must be answered separately
+DIFFERENT_QUESTIONS = [
+    (
+        "What notice period must the tenant give before ending the lease?",
+        "What notice period must the landlord give before ending the lease?",
+    ),
+    (
+        "Is the supplier liable for indirect damages?",
+        "Is the customer liable for indirect damages?",
+    ),
+    (
+        "What is the filing deadline in Germany?",
+        "What is the filing deadline in France?",
+    ),
+    (
+        "What are the risks before the merger closes?",
+        "What are the risks after the merger closes?",
+    ),
+    ("What happens if payment is late by 30 days?", "What happens if payment is late by 60 days?"),
+    ("Can the contract be terminated early?", "Can the contract not be terminated early?"),
+    ("What does the payment clause say?", "What does the termination clause say?"),
+]
+
+# Rewordings of one question, differing only in phrasing, inflections and stopwords
+SAME_QUESTIONS = [
+    ("What's the summary of this document?", "Summarize the document"),
+    ("Can you give me a summary?", "Please summarize this PDF."),
+    ("What is the termination clause?", "Tell me about the termination clause"),
+    ("List the payment terms", "What are the payment terms?"),
+]
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    SemanticAnswerCache._documents.clear()
+    yield
+    SemanticAnswerCache._documents.clear()
+
+
+async def remember_and_lookup(cached: str, asked: str):
+    cache = SemanticAnswerCache()
+    await cache.add(CONTENT_HASH, None, MODEL, cached, "cached answer")
+    return await cache.lookup(CONTENT_HASH, None, MODEL, asked)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("cached, asked", DIFFERENT_QUESTIONS + [(b, a) for a, b in DIFFERENT_QUESTIONS])
+async def test_different_questions_miss(cached, asked):
+    assert await remember_and_lookup(cached, asked) is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("cached, asked", SAME_QUESTIONS + [(b, a) for a, b in SAME_QUESTIONS])
+async def test_reworded_questions_hit(cached, asked):
+    match = await remember_and_lookup(cached, asked)
+    assert match is not None
+    assert match["answer"] == "cached answer"
+    assert match["question"] == cached
+
+
+@pytest.mark.asyncio
+async def test_other_documents_miss():
+    cache = SemanticAnswerCache()
+    await cache.add(CONTENT_HASH, None, MODEL, "Summarize the document", "cached answer")
+    assert await cache.lookup("b" * 64, None, MODEL, "Summarize the document") is None
+    assert await cache.lookup(CONTENT_HASH, None, "other-model", "Summarize the document") is None
+
+
+@pytest.mark.asyncio
+async def test_forget_drops_the_questions_of_the_content():
+    cache = SemanticAnswerCache()
+    await cache.add(CONTENT_HASH, None, MODEL, "Summarize the document", "cached answer")
+    SemanticAnswerCache.forget(CONTENT_HASH)
+    assert await cache.lookup(CONTENT_HASH, None, MODEL, "Summarize the document") is None
+
+
+def test_guard_differs_by_content_word():
+    assert SemanticAnswerCache._guard("risks before the merger") != SemanticAnswerCache._guard("risks after the merger")
+    assert SemanticAnswerCache._guard("Is it not allowed?") != SemanticAnswerCache._guard("Is it allowed?")
+
+
+def test_stem_folds_inflections():
+    assert stem("summary") == stem("summarize") == stem("summarised")
+    assert stem("cat") == "cat"
+
+
+def test_normalize_question():
+    assert normalize_question("  What IS   the Summary?? ") == "what is the summary"
@@ -0,0 +1,306 @@
+import json
+import uuid
+from datetime import datetime
+
+import pytest
+from cryptography.fernet import Fernet
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+from pdf_service.core.services import chat_history_writer
+from pdf_service.core.services.chat_history_writer import MAX_DELIVERIES, ChatHistoryWriter
+
+
+class DriverError(Exception):
+    pass
+
+
+def rejected(reason="invalid byte sequence for encoding UTF8: 0x00"):
+    return DBAPIError("INSERT INTO chat_messages ...", {"message": "secret"}, DriverError(reason))
+
+
+def unavailable():
+    return OperationalError("INSERT INTO chat_messages ...", {"message": "secret"}, DriverError("connection refused"))
+
+
+class FakeStreams:
+    """Redis streams with one consumer group, enough of them for the writer"""
+
+    def __init__(self):
+        self.streams = {}
+        self.pending = {}
+        self.last_delivered = 0
+        self.sequence = 0
+
+    def entries(self, stream):
+        return self.streams.get(stream, [])
+
+    async def xadd(self, stream, fields):
+        self.sequence += 1
+        self.streams.setdefault(stream, []).append((f"{self.sequence}-0", fields))
+
+    async def xreadgroup(self, group, consumer, streams, count, block=None):
+        ((stream, start),) = streams.items()
+        if start == ">":
+            entries = [entry for entry in self.entries(stream) if _seq(entry[0]) > self.last_delivered][:count]
+            for entry_id, _ in entries:
+                self.pending[entry_id] = [consumer, 1]
+                self.last_delivered = _seq(entry_id)
+        else:
+            entries = [
+                entry
+                for entry in self.entries(stream)
+                if entry[0] in self.pending and self.pending[entry[0]][0] == consumer and _seq(entry[0]) > _seq(start)
+            ][:count]
+            for entry_id, _ in entries:
+                self.pending[entry_id][1] += 1
+        return [[stream, entries]] if entries else []
+
+    async def xpending_range(self, stream, group, min, max, count, consumername):
+        return [
+            {"message_id": entry_id, "times_delivered": deliveries}
+            for entry_id, (consumer, deliveries) in self.pending.items()
+            if consumer == consumername and _seq(min) <= _seq(entry_id) <= _seq(max)
+        ][:count]
+
+    async def xack(self, stream, group, *ids):
+        for entry_id in ids:
+            self.pending.pop(entry_id, None)
+
+    async def xdel(self, stream, *ids):
+        self.streams[stream] = [entry for entry in self.entries(stream) if entry[0] not in ids]
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    async def execute(self):
+        for name, args, kwargs in self.commands:
+            await getattr(self.client, name)(*args, **kwargs)
+
+
+class FakeCache:
+    def __init__(self):
+        self.client = FakeStreams()
+        self.fernet = Fernet(Fernet.generate_key())
+        self.prefix = "test:"
+
+
+def _seq(entry_id):
+    return int(entry_id.split("-")[0])
+
+
+def message(text="hello"):
+    return {
+        "id": uuid.uuid4(),
+        "user_id": 1,
+        "message": text,
+        "is_user": True,
+        "timestamp": datetime.utcnow(),
+        "document_id": None,
+        "conversation_id": None,
+    }
+
+
+class Postgres:
+    """Stands in for the inserts of the writer: rejects messages containing NUL, or everything while down"""
+
+    def __init__(self):
+        self.rows = []
+        self.down = False
+
+    async def write(self, messages):
+        if self.down:
+            raise unavailable()
+        if any("\x00" in message["message"] for message in messages):
+            raise rejected()
+        self.rows.extend(message["message"] for message in messages)
+
+
+@pytest.fixture
+def postgres():
+    return Postgres()
+
+
+@pytest.fixture
+def writer(monkeypatch, postgres):
+    cache = FakeCache()
+    monkeypatch.setattr(chat_history_writer, "CacheService", lambda: cache)
+    writer = ChatHistoryWriter("redis", flush_size=50, flush_interval_ms=10)
+    writer.cache = cache
+    writer.stream = f"{cache.prefix}{chat_history_writer.STREAM_KEY}"
+    writer.dead_letter_stream = f"{cache.prefix}{chat_history_writer.DEAD_LETTER_KEY}"
+    writer.consumer = "test-writer"
+    writer._write = postgres.write
+    return writer
+
+
+async def queue(writer, *texts):
+    for text in texts:
+        row = writer.cache.fernet.encrypt(json.dumps(message(text), default=str).encode()).decode()
+        await writer.cache.client.xadd(writer.stream, {"row": row})
+
+
+def stream(writer):
+    return writer.cache.client.entries(writer.stream)
+
+
+def dead_letters(writer):
+    return writer.cache.client.entries(writer.dead_letter_stream)
+
+
+@pytest.mark.asyncio
+async def test_rejected_message_is_dead_lettered_and_the_rest_written(writer, postgres):
+    await queue(writer, "one", "bad\x00", "two")
+    await writer.cache.client.xadd(writer.stream, {"row": "not encrypted"})
+
+    assert await writer._flush_new() == 4
+
+    assert postgres.rows == ["one", "two"]
+    assert len(dead_letters(writer)) == 2
+    assert stream(writer) == [] and writer.cache.client.pending == {}
+    assert writer.metrics()["dead_lettered"] == 2
+
+
+@pytest.mark.asyncio
+async def test_dead_letter_keeps_the_encrypted_row_and_the_reason_only(writer):
+    await queue(writer, "bad\x00")
+    await writer._flush_new()
+
+    ((_, fields),) = dead_letters(writer)
+    assert writer.cache.fernet.decrypt(fields["row"].encode())
+    assert fields["error"] == "DriverError: invalid byte sequence for encoding UTF8: 0x00"
+    assert "secret" not in fields["error"] and "INSERT" not in fields["error"]
+
+
+@pytest.mark.asyncio
+async def test_unavailable_postgres_keeps_entries_pending(writer, postgres):
+    await queue(writer, "one", "two")
+    postgres.down = True
+
+    with pytest.raises(OperationalError):
+        await writer._flush_new()
+
+    assert dead_letters(writer) == []
+    assert len(stream(writer)) == 2 and len(writer.cache.client.pending) == 2
+
+
+@pytest.mark.asyncio
+async def test_pending_entries_are_written_once_postgres_is_back(writer, postgres):
+    await queue(writer, "one", "two")
+    postgres.down = True
+    with pytest.raises(OperationalError):
+        await writer._flush_new()
+
+    postgres.down = False
+    await writer._flush_pending()
+
+    assert postgres.rows == ["one", "two"]
+    assert stream(writer) == [] and writer.cache.client.pending == {}
+    assert dead_letters(writer) == []
+
+
+@pytest.mark.asyncio
+async def test_entries_delivered_too_often_are_dead_lettered(writer, postgres):
+    await queue(writer, "one", "two")
+    postgres.down = True
+    with pytest.raises(OperationalError):
+        await writer._flush_new()
+    for _ in range(MAX_DELIVERIES - 1):
+        with pytest.raises(OperationalError):
+            await writer._flush_pending()
+    assert dead_letters(writer) == []
+
+    # The next delivery is one too many, whether or not Postgres would take the entries now
+    postgres.down = False
+    await writer._flush_pending()
+
+    assert postgres.rows == []
+    assert [fields["error"] for _, fields in dead_letters(writer)] == [
+        f"Not written after {MAX_DELIVERIES} deliveries"
+    ] * 2
+    assert stream(writer) == [] and writer.cache.client.pending == {}
+
+
+@pytest.mark.asyncio
+async def test_pending_entries_are_read_past_the_first_batch(writer, postgres):
+    writer.flush_size = 2
+    await queue(writer, "one", "two", "three", "four", "five")
+    postgres.down = True
+    for _ in range(3):
+        with pytest.raises(OperationalError):
+            await writer._flush_new()
+
+    postgres.down = False
+    await writer._flush_pending()
+
+    assert postgres.rows == ["one", "two", "three", "four", "five"]
+    assert stream(writer) == []
+
+
+@pytest.mark.asyncio
+async def test_write_batch_falls_back_to_one_message_at_a_time(writer, postgres):
+    messages = [message("one"), message("bad\x00"), message("two"), message("worse\x00")]
+
+    failures = await writer._write_batch(messages)
+
+    assert [index for index, _ in failures] == [1, 3]
+    assert postgres.rows == ["one", "two"]
+
+
+@pytest.mark.asyncio
+async def test_write_batch_raises_when_postgres_goes_away_midway(writer, postgres):
+    calls = []
+
+    async def write(messages):
+        calls.append(len(messages))
+        if len(calls) == 1:
+            raise rejected()
+        raise unavailable()
+
+    writer._write = write
+    with pytest.raises(OperationalError):
+        await writer._write_batch([message("one"), message("two")])
+
+
+@pytest.mark.asyncio
+async def test_memory_mode_drops_rejected_messages_only(postgres):
+    writer = ChatHistoryWriter("memory", flush_size=50, flush_interval_ms=10)
+    writer._write = postgres.write
+    writer._buffer = [message("one"), message("bad\x00"), message("two")]
+
+    assert await writer._flush_buffer() == 3
+
+    assert postgres.rows == ["one", "two"]
+    assert writer.metrics()["dropped"] == 1 and writer.metrics()["buffered"] == 0
+
+
+@pytest.mark.asyncio
+async def test_memory_mode_keeps_messages_while_postgres_is_down(postgres):
+    writer = ChatHistoryWriter("memory", flush_size=50, flush_interval_ms=10)
+    writer._write = postgres.write
+    writer._buffer = [message("one"), message("two")]
+    postgres.down = True
+
+    assert await writer._flush_buffer() == 0
+
+    assert writer.metrics()["buffered"] == 2 and writer.metrics()["failures"] == 1
+
+
+def test_unavailable_tells_outages_from_rejections():
+    assert ChatHistoryWriter._unavailable(unavailable())
+    assert ChatHistoryWriter._unavailable(ConnectionRefusedError())
+    assert not ChatHistoryWriter._unavailable(rejected())
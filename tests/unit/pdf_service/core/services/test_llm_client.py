@@ -0,0 +1,191 @@
+import asyncio
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from libs.exceptions.schemas import ExceptionBase
+from libs.settings import settings
+from pdf_service.core.services.llm_client import CircuitBreaker, LLMClient
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(settings, "GEMINI_MAX_RETRIES", 3)
+    monkeypatch.setattr(settings, "GEMINI_RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setattr(settings, "GEMINI_RETRY_MAX_DELAY", 1)
+    monkeypatch.setattr(settings, "GEMINI_BREAKER_FAILURES", 5)
+
+
+class Gemini:
+    """Test server answering requests with the scripted responses in order, the last one repeated"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self.handle)
+        self.server = TestServer(app)
+
+    async def handle(self, request):
+        self.requests.append(request)
+        status, headers = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        return web.json_response({"status": status}, status=status, headers=headers)
+
+    async def __aenter__(self):
+        await self.server.start_server()
+        return LLMClient(base_url=str(self.server.make_url("/v1")), api_key="test-key")
+
+    async def __aexit__(self, *exc_info):
+        await self.server.close()
+
+
+def test_breaker_opens_after_threshold_and_fails_fast():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.open_count == 1
+
+
+def test_breaker_lets_one_trial_through_after_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only the trial call goes through until it ends
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0
+
+
+def test_breaker_reopens_when_trial_fails():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0)
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.open_count == 2
+
+
+def test_breaker_released_trial_lets_the_next_call_try():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.release_trial()
+    assert breaker.allow()
+
+
+def response_with(retry_after):
+    response = MagicMock()
+    response.headers = {"Retry-After": retry_after} if retry_after is not None else {}
+    return response
+
+
+def test_retry_after_in_seconds():
+    assert LLMClient._retry_after(response_with("3")) == 3.0
+    assert LLMClient._retry_after(response_with("-1")) == 0.0
+
+
+def test_retry_after_as_http_date():
+    date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 28 <= LLMClient._retry_after(response_with(date)) <= 30
+
+
+def test_retry_after_missing_or_invalid():
+    assert LLMClient._retry_after(response_with(None)) is None
+    assert LLMClient._retry_after(response_with("soon")) is None
+
+
+@pytest.mark.asyncio
+async def test_retryable_statuses_are_retried_until_success():
+    async with Gemini((503, {}), (429, {}), (200, {})) as llm, llm:
+        async with llm.request("POST", "models/m:generateContent", {}) as response:
+            assert response.status == 200
+        metrics = llm.metrics()
+    assert metrics["requests"] == 1
+    assert metrics["retries"] == 2
+    assert metrics["circuit_state"] == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_api_key_is_sent_in_a_header():
+    gemini = Gemini((200, {}))
+    async with gemini as llm, llm:
+        async with llm.request("POST", "models/m:generateContent", {}):
+            pass
+    assert gemini.requests[0].headers["x-goog-api-key"] == "test-key"
+    assert "key" not in gemini.requests[0].query
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_not_retried():
+    async with Gemini((400, {})) as llm, llm:
+        async with llm.request("POST", "models/m:generateContent", {}) as response:
+            assert response.status == 400
+        assert llm.metrics()["retries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_last_retryable_status_is_handed_to_the_caller():
+    async with Gemini((503, {})) as llm, llm:
+        async with llm.request("POST", "models/m:generateContent", {}) as response:
+            assert response.status == 503
+        assert llm.metrics()["retries"] == settings.GEMINI_MAX_RETRIES
+
+
+@pytest.mark.asyncio
+async def test_retry_after_is_honored(monkeypatch):
+    sleeps = []
+    real_sleep = asyncio.sleep
+
+    async def record_sleep(delay):
+        sleeps.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(asyncio, "sleep", record_sleep)
+    async with Gemini((429, {"Retry-After": "0.5"}), (200, {})) as llm, llm:
+        async with llm.request("POST", "models/m:generateContent", {}) as response:
+            assert response.status == 200
+    # Closing the session sleeps too, without a delay
+    assert [delay for delay in sleeps if delay] == [0.5]
+
+
+@pytest.mark.asyncio
+async def test_retry_after_beyond_max_delay_is_not_waited():
+    async with Gemini((429, {"Retry-After": "3600"}), (200, {})) as llm, llm:
+        async with llm.request("POST", "models/m:generateContent", {}) as response:
+            assert response.status == 429
+        assert llm.metrics()["retries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_fails_fast(monkeypatch):
+    monkeypatch.setattr(settings, "GEMINI_MAX_RETRIES", 0)
+    monkeypatch.setattr(settings, "GEMINI_BREAKER_FAILURES", 2)
+    gemini = Gemini((503, {}))
+    async with gemini as llm, llm:
+        for _ in range(2):
+            async with llm.request("POST", "models/m:generateContent", {}) as response:
+                assert response.status == 503
+        with pytest.raises(ExceptionBase):
+            async with llm.request("POST", "models/m:generateContent", {}):
+                pass
+        assert llm.metrics()["rejected"] == 1
+    assert len(gemini.requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_connection_errors_raise_after_retries():
+    llm = LLMClient(base_url="http://127.0.0.1:9/v1", api_key="test-key")
+    async with llm:
+        with pytest.raises(ExceptionBase):
+            async with llm.request("POST", "models/m:generateContent", {}):
+                pass
+        assert llm.metrics()["retries"] == settings.GEMINI_MAX_RETRIES
@@ -0,0 +1,104 @@
+import pytest
+
+from pdf_service.core.services.passage_index import BM25Index, BM25IndexBuilder, PassageBuilder, tokenize
+
+
+def words(start, count):
+    return " ".join(f"w{i}" for i in range(start, start + count))
+
+
+def build_index(passages):
+    builder = BM25IndexBuilder()
+    for passage_id, text in enumerate(passages):
+        builder.add(passage_id, tokenize(text))
+    return builder.build()
+
+
+def test_tokenize_drops_stopwords_and_single_characters():
+    assert tokenize("What is the Termination clause of a 2024 contract?") == [
+        "termination",
+        "clause",
+        "2024",
+        "contract",
+    ]
+
+
+def test_passages_overlap_and_remember_their_pages():
+    builder = PassageBuilder(size=10, overlap=4)
+    passages = builder.add_page(1, words(0, 8)) + builder.add_page(2, words(8, 10)) + builder.finish()
+
+    assert [passage["passage"] for passage in passages] == [0, 1, 2]
+    assert passages[0]["text"] == words(0, 10)
+    assert (passages[0]["page_start"], passages[0]["page_end"]) == (1, 2)
+    # Each passage starts with the last `overlap` words of the previous one
+    assert passages[1]["text"] == words(6, 10)
+    assert passages[2]["text"] == words(12, 6)
+    assert (passages[2]["page_start"], passages[2]["page_end"]) == (2, 2)
+
+
+def test_finish_emits_nothing_when_every_word_was_emitted():
+    builder = PassageBuilder(size=5, overlap=2)
+    passages = builder.add_page(1, words(0, 5))
+    assert len(passages) == 1
+    assert builder.finish() == []
+
+
+def test_short_document_is_one_passage():
+    builder = PassageBuilder(size=200, overlap=40)
+    assert builder.add_page(1, "only a few words") == []
+    assert builder.finish() == [{"passage": 0, "page_start": 1, "page_end": 1, "text": "only a few words"}]
+
+
+def test_overlap_is_capped_below_the_passage_size():
+    builder = PassageBuilder(size=3, overlap=10)
+    assert builder.overlap == 2
+    passages = builder.add_page(1, words(0, 6)) + builder.finish()
+    assert [passage["text"] for passage in passages] == [words(0, 3), words(1, 3), words(2, 3), words(3, 3)]
+
+
+def test_bm25_ranks_matching_passages_first():
+    index = build_index(
+        [
+            "the payment is due within thirty days of the invoice",
+            "either party may terminate the agreement with notice",
+            "termination for breach requires written notice and a cure period",
+        ]
+    )
+    ranking = index.search("termination notice", top_k=3)
+    assert [passage_id for passage_id, _ in ranking] == [2, 1]
+    assert ranking[0][1] > ranking[1][1] > 0
+
+
+def test_bm25_rare_terms_weigh_more():
+    index = build_index(["contract clause alpha", "contract clause beta", "contract clause gamma"])
+    ranking = index.search("contract alpha", top_k=3)
+    assert ranking[0][0] == 0
+    # A term found in every passage still counts, but less than one found in a single passage
+    assert ranking[0][1] > 2 * ranking[1][1]
+
+
+def test_bm25_saturates_term_frequency_and_normalizes_length():
+    index = build_index(["liability", "liability liability liability liability", "liability cap " + words(0, 30)])
+    scores = dict(index.search("liability", top_k=3))
+    assert scores[1] > scores[0] > scores[2]
+    # Four occurrences score far less than four times one occurrence
+    assert scores[1] < 2 * scores[0]
+
+
+def test_bm25_unknown_terms_match_nothing():
+    index = build_index(["payment terms"])
+    assert index.search("indemnity", top_k=5) == []
+
+
+def test_bm25_top_k_limits_results():
+    index = build_index([f"shared term {i}" for i in range(10)])
+    assert len(index.search("shared", top_k=3)) == 3
+
+
+def test_bm25_index_survives_serialization():
+    index = build_index(["payment due in thirty days", "termination with notice", "notice of payment default"])
+    restored = BM25Index.from_bytes(index.to_bytes())
+    assert restored.passage_count == 3
+    assert restored.terms == index.terms
+    for query in ("payment notice", "termination", "default days"):
+        assert restored.search(query, top_k=3) == pytest.approx(index.search(query, top_k=3))
@@ -0,0 +1,85 @@
+import pytest
+
+from libs.settings import settings
+from pdf_service.core.services.prompt_packer import (
+    DEFAULT_INPUT_TOKENS,
+    PromptPacker,
+    estimate_tokens,
+    model_input_tokens,
+)
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    """Give prompts of the test model a budget of 100 tokens"""
+    monkeypatch.setattr(settings, "CHAT_PROMPT_TOKEN_LIMIT", 100)
+    monkeypatch.setattr(settings, "GEMINI_MAX_OUTPUT_TOKENS", 10)
+    return PromptPacker("gemini-2.5-flash")
+
+
+def section(tokens, score):
+    return {"text": f"s{score}", "score": score, "token_count": tokens}
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    # One token per started four characters of a word, one per punctuation mark
+    assert estimate_tokens("a bb cccc ddddd") == 5
+    assert estimate_tokens("Hello, world!") == 6
+
+
+def test_model_input_tokens():
+    assert model_input_tokens("gemini-1.5-pro") == 2_097_152
+    assert model_input_tokens("models/gemini-1.5-pro") == 2_097_152
+    assert model_input_tokens("some-new-model") == DEFAULT_INPUT_TOKENS
+
+
+def test_input_budget_is_capped_by_the_prompt_limit(monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_PROMPT_TOKEN_LIMIT", 50_000)
+    monkeypatch.setattr(settings, "GEMINI_MAX_OUTPUT_TOKENS", 8_000)
+    assert PromptPacker("gemini-2.5-flash").input_budget == 50_000
+    # The model limit leaves room for the answer
+    assert PromptPacker("gemini-pro").input_budget == 30_720 - 8_000
+
+
+def test_sections_are_kept_by_score_in_reading_order(budget):
+    sections = [section(40, 0.1), section(40, 0.9), section(40, 0.5)]
+    packed = budget.pack("", "", sections)
+    assert [kept["score"] for kept in packed["sections"]] == [0.9, 0.5]
+    assert packed["context"] == "s0.9\n\ns0.5"
+    assert packed["packed_tokens"] == 80
+    assert packed["dropped_tokens"] == 40
+
+
+def test_a_section_that_does_not_fit_is_dropped_whole(budget):
+    sections = [section(105, 0.9), section(30, 0.5), section(50, 0.1)]
+    packed = budget.pack("", "", sections)
+    # The best section is too big, the smaller ones still fit
+    assert [kept["score"] for kept in packed["sections"]] == [0.5, 0.1]
+    assert packed["prompt_tokens"] <= budget.input_budget
+
+
+def test_instructions_and_question_come_out_of_the_budget(budget):
+    instructions = "word " * 30
+    question = "word " * 30
+    packed = budget.pack(instructions, question, [section(50, 0.9), section(20, 0.5)])
+    assert [kept["score"] for kept in packed["sections"]] == [0.5]
+    assert packed["prompt_tokens"] == 60 + 20
+
+
+def test_oldest_history_is_dropped_first(budget):
+    history = ["past " * 40, "then " * 40, "last " * 40]
+    packed = budget.pack("", "", [], history)
+    assert packed["history"] == history[1:]
+    assert packed["prompt_tokens"] == 80
+
+
+def test_history_leaves_sections_the_remaining_budget(budget):
+    packed = budget.pack("", "", [section(30, 0.9), section(20, 0.5)], ["turn " * 60])
+    assert packed["history"] == ["turn " * 60]
+    assert [kept["score"] for kept in packed["sections"]] == [0.9]
+
+
+def test_token_count_is_estimated_when_missing(budget):
+    packed = budget.pack("", "", [{"text": "word " * 10, "score": 1.0}])
+    assert packed["packed_tokens"] == 10